@@ -0,0 +1,204 @@
+"""Busca de produtos por texto com índice e ranking.
+
+Cada produto guarda ``termos_busca``: os tokens normalizados (minúsculos, sem
+acento) de código interno/externo, descrição, tags, marca e sessão, com índice
+multikey. Uma consulta vira ``{"termos_busca": {"$all": [/^tok1/, /^tok2/]}}``:
+regex ancorada e já em minúsculas usa os limites do índice, então cada token
+casa por prefixo ("vest" encontra "vestido") sem varrer a coleção.
+
+A relevância é resolvida no banco, em faixas consultadas nesta ordem (cada uma
+exclui as anteriores): código interno/externo exato, todos os tokens como
+palavra inteira e todos os tokens como prefixo. Dentro da faixa a ordem é
+``(descricao_norm, _id)``, servida pelo índice ``(termos_busca, descricao_norm,
+_id)``; o cursor guarda (faixa, descricao_norm, _id) do último item entregue.
+``create_produto``/``update_produto`` mantêm os termos;
+``rebuild_termos_busca`` preenche produtos antigos.
+
+Para leitura de código de barras / digitação no caixa, ``codigo_interno_norm`` e
+``codigo_externo_norm`` guardam os códigos normalizados (indexados) e
+``buscar_por_codigo`` resolve o código exato numa única consulta pontual nesses
+índices, sempre com o estoque atual (não há cache em memória).
+"""
+from pymongo import UpdateOne
+import base64
+import json
+import re
+import unicodedata
+from fastapi import HTTPException
+from .connection import db
+from .paginacao import filtro_apos_cursor
+
+CAMPOS_BUSCA = ("codigo_interno", "codigo_externo", "descricao", "tags", "marca_fornecedor", "sessao")
+CAMPOS_CODIGO = ("codigo_interno", "codigo_externo")
+
+# Faixas de relevância da busca, na ordem em que são consultadas
+FAIXA_CODIGO, FAIXA_PALAVRA, FAIXA_PREFIXO = range(3)
+ORDEM_BUSCA = [("descricao_norm", 1), ("_id", 1)]
+
+# Campos retornados pela busca (sem itens/entradas)
+PROJECAO_RESUMO = {
+    "_id": 1, "codigo_interno": 1, "codigo_externo": 1, "descricao": 1, "marca_fornecedor": 1,
+    "sessao": 1, "tags": 1, "preco_custo": 1, "preco_venda": 1, "ativo": 1,
+    "em_condicional_cliente": 1, "em_condicional_fornecedor": 1, "estoque_total": 1, "estoque_disponivel": 1,
+    "estoque_em_condicional_cliente": 1,
+}
+
+def normalizar(texto) -> str:
+    """Minúsculas e sem acentos ("Calça" -> "calca")."""
+    texto = unicodedata.normalize("NFKD", str(texto or ""))
+    return "".join(c for c in texto if not unicodedata.combining(c)).lower()
+
+def tokenizar(texto) -> list[str]:
+    return re.findall(r"[a-z0-9]+", normalizar(texto))
+
+def _valores(produto: dict, campo: str) -> list:
+    if campo == "tags":
+        return [t.get("descricao") for t in produto.get("tags") or [] if isinstance(t, dict)]
+    return [produto.get(campo)]
+
+def _tokens_por_campo(produto: dict) -> dict[str, set]:
+    tokens = {}
+    for campo in CAMPOS_BUSCA:
+        conjunto = set()
+        for valor in _valores(produto, campo):
+            conjunto.update(tokenizar(valor))
+            if campo in CAMPOS_CODIGO and valor:
+                # código inteiro sem separadores: "AB-12" também casa com "ab12"
+                conjunto.add("".join(tokenizar(valor)))
+        conjunto.discard("")
+        tokens[campo] = conjunto
+    return tokens
+
+def gerar_termos(produto: dict) -> list[str]:
+    return sorted(set().union(*_tokens_por_campo(produto).values()))
+
+def normalizar_codigo(codigo) -> str:
+    return normalizar(codigo).strip()
+
+def campos_busca(produto: dict) -> dict:
+    """Campos derivados mantidos no documento do produto para a busca."""
+    return {
+        "termos_busca": gerar_termos(produto),
+        "descricao_norm": normalizar(produto.get("descricao")).strip(),
+        **{f"{campo}_norm": normalizar_codigo(produto.get(campo)) for campo in CAMPOS_CODIGO},
+    }
+
+def afeta_busca(alterados) -> bool:
+    return bool(set(alterados) & set(CAMPOS_BUSCA))
+
+def _encode_posicao(faixa: int, doc: dict) -> str:
+    payload = json.dumps([faixa, doc.get("descricao_norm"), doc["_id"]])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def _decode_posicao(cursor: str) -> tuple:
+    try:
+        faixa, descricao, ultimo_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if faixa not in (FAIXA_CODIGO, FAIXA_PALAVRA, FAIXA_PREFIXO):
+            raise ValueError(faixa)
+    except Exception:
+        raise HTTPException(status_code=400, detail="cursor inválido")
+    return faixa, descricao, ultimo_id
+
+def filtro_termos(query: str) -> dict | None:
+    """Filtro indexado: todos os tokens de ``query`` como prefixo em ``termos_busca``."""
+    tokens = tokenizar(query)
+    if not tokens:
+        return None
+    return {"termos_busca": {"$all": [re.compile("^" + re.escape(t)) for t in tokens]}}
+
+def filtro_texto_produtos(query: str) -> dict | None:
+    """Filtro indexado para restringir outras consultas pelo texto de um produto:
+    tokens como prefixo em ``termos_busca`` ou código normalizado começando com
+    ``query``. Cada ramo do ``$or`` usa seu índice; None se ``query`` é vazia."""
+    chave = normalizar_codigo(query)
+    if not chave:
+        return None
+    prefixo_codigo = re.compile("^" + re.escape(chave))
+    ramos = [{f"{campo}_norm": prefixo_codigo} for campo in CAMPOS_CODIGO]
+    termos = filtro_termos(query)
+    if termos:
+        ramos.insert(0, termos)
+    return {"$or": ramos}
+
+def filtros_faixas(query: str) -> list[dict]:
+    """Filtros das faixas de relevância (código exato, palavras inteiras,
+    prefixos), mutuamente exclusivos; lista vazia se ``query`` não tem tokens."""
+    prefixos = filtro_termos(query)
+    if prefixos is None:
+        return []
+    codigo = _filtro_codigo(normalizar_codigo(query))
+    palavras = {"termos_busca": {"$all": tokenizar(query)}}
+    return [
+        codigo,
+        {**palavras, "$nor": [codigo]},
+        {**prefixos, "$nor": [codigo, palavras]},
+    ]
+
+async def buscar_produtos(query: str, limit: int = 20, cursor: str | None = None) -> dict:
+    """Produtos que casam com todos os tokens de ``query``, por relevância.
+
+    Percorre as faixas de ``filtros_faixas`` a partir da posição do cursor,
+    cada uma ordenada pelo índice, até completar ``limit`` itens. Retorna
+    ``{"items", "next_cursor"}`` com o resumo ``PROJECAO_RESUMO``.
+    """
+    filtros = filtros_faixas(query)
+    if not filtros:
+        return {"items": [], "next_cursor": None}
+    limit = max(1, limit)
+    inicio, posicao = FAIXA_CODIGO, None
+    if cursor:
+        inicio, *posicao = _decode_posicao(cursor)
+    projection = {**PROJECAO_RESUMO, "descricao_norm": 1}
+    encontrados = []
+    for faixa in range(inicio, len(filtros)):
+        filtro = filtros[faixa]
+        if faixa == inicio and posicao:
+            filtro = {"$and": [filtro, filtro_apos_cursor("descricao_norm", 1, *posicao)]}
+        falta = limit + 1 - len(encontrados)
+        docs = await db.produtos.find(filtro, projection=projection).sort(ORDEM_BUSCA).limit(falta).to_list(falta)
+        encontrados.extend((faixa, doc) for doc in docs)
+        if len(encontrados) > limit:
+            break
+    pagina = encontrados[:limit]
+    next_cursor = _encode_posicao(*pagina[-1]) if len(encontrados) > limit else None
+    items = []
+    for _, doc in pagina:
+        doc.pop("descricao_norm", None)
+        items.append(doc)
+    return {"items": items, "next_cursor": next_cursor}
+
+def _filtro_codigo(valor) -> dict:
+    return {"$or": [{f"{campo}_norm": valor} for campo in CAMPOS_CODIGO]}
+
+async def buscar_por_codigo(codigo: str) -> dict | None:
+    """Produto (resumo com estoque atual) cujo código interno ou externo é exatamente ``codigo``."""
+    chave = normalizar_codigo(codigo)
+    if not chave:
+        return None
+    return await db.produtos.find_one(_filtro_codigo(chave), projection=PROJECAO_RESUMO)
+
+async def buscar_por_prefixo_codigo(prefixo: str, limit: int = 20) -> list:
+    """Produtos cujo código interno ou externo começa com ``prefixo`` (regex ancorada no índice)."""
+    chave = normalizar_codigo(prefixo)
+    if not chave:
+        return []
+    filtro = _filtro_codigo({"$regex": "^" + re.escape(chave)})
+    limit = max(1, limit)
+    return await db.produtos.find(filtro, projection=PROJECAO_RESUMO).sort("codigo_interno_norm", 1).limit(limit).to_list(limit)
+
+async def rebuild_termos_busca(apply: bool = True, somente_faltantes: bool = False, batch_size: int = 500) -> dict:
+    """Recalcula os campos de busca de todos os produtos (ou só dos que não têm)."""
+    query = {"$or": [{campo: {"$exists": False}} for campo in campos_busca({})]} if somente_faltantes else {}
+    projection = {campo: 1 for campo in CAMPOS_BUSCA}
+    examinados = 0
+    ops = []
+    async for produto in db.produtos.find(query, projection=projection, batch_size=batch_size):
+        examinados += 1
+        if apply:
+            ops.append(UpdateOne({"_id": produto["_id"]}, {"$set": campos_busca(produto)}))
+        if len(ops) >= batch_size:
+            await db.produtos.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await db.produtos.bulk_write(ops, ordered=False)
+    return {"examinados": examinados}
@@ -0,0 +1,149 @@
+"""Cache de respostas dos relatórios (``/reports/*``).
+
+As respostas são guardadas por endpoint + parâmetros normalizados, com TTL.
+O armazenamento é plugável (``REPORT_CACHE_BACKEND``):
+
+- ``memory``: dicionário LRU no processo (um worker), com limite de entradas;
+- ``mongo``: coleção ``report_cache`` com índice TTL, compartilhada entre os
+  workers do uvicorn;
+- ``off``: desliga o cache.
+
+Toda escrita de saídas (vendas, devoluções), despesas, produtos (cadastro,
+edição, importação) ou condicionais (envio, retorno) chama
+``invalidar_relatorios``. Os contadores de hit/miss ficam em ``stats()``.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import functools
+import json
+import logging
+import os
+import time
+from .connection import db
+
+def _env_int(nome: str, padrao: int) -> int:
+    try:
+        return int(os.getenv(nome, padrao))
+    except ValueError:
+        return padrao
+
+class MemoryCacheStore:
+    """LRU em memória com TTL por entrada."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value, ttl: int):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class MongoCacheStore:
+    """Coleção com índice TTL em ``expires_at`` (ver ``indexes.py``).
+
+    O TTL do MongoDB remove documentos com atraso de até um minuto, por isso
+    a leitura também confere ``expires_at``.
+    """
+
+    def __init__(self, collection: str = "report_cache"):
+        self.collection = collection
+
+    async def get(self, key: str):
+        doc = await db[self.collection].find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        return doc["value"] if doc else None
+
+    async def set(self, key: str, value, ttl: int):
+        await db[self.collection].replace_one(
+            {"_id": key},
+            {"_id": key, "value": value, "expires_at": datetime.utcnow() + timedelta(seconds=ttl)},
+            upsert=True
+        )
+
+    async def clear(self):
+        await db[self.collection].delete_many({})
+
+def _criar_store():
+    backend = os.getenv("REPORT_CACHE_BACKEND", "memory").lower()
+    if backend == "off":
+        return None
+    if backend == "mongo":
+        return MongoCacheStore()
+    return MemoryCacheStore(max_entries=_env_int("REPORT_CACHE_MAX_ENTRIES", 256))
+
+_store = _criar_store()
+_stats = {"hits": 0, "misses": 0, "invalidacoes": 0}
+
+def set_store(store):
+    """Troca o armazenamento (None desliga o cache)."""
+    global _store
+    _store = store
+
+def stats() -> dict:
+    result = {"backend": type(_store).__name__ if _store else None, **_stats}
+    if isinstance(_store, MemoryCacheStore):
+        result["entradas"] = len(_store)
+    return result
+
+def cache_key(nome: str, params: dict) -> str:
+    """Chave estável: endpoint + parâmetros ordenados (None é ignorado)."""
+    normalizados = {k: v for k, v in sorted(params.items()) if v is not None}
+    return f"{nome}:{json.dumps(normalizados, sort_keys=True, default=str)}"
+
+async def invalidar_relatorios():
+    """Descarta as respostas em cache (chamado quando saídas ou despesas mudam)."""
+    if _store is None:
+        return
+    _stats["invalidacoes"] += 1
+    try:
+        await _store.clear()
+    except Exception as e:
+        logging.warning("Falha ao invalidar cache de relatórios: %s", e)
+
+def cached_report(nome: str, ttl: int | None = None):
+    """Decorator para endpoints de relatório: responde do cache quando possível.
+
+    A assinatura do endpoint é preservada (``functools.wraps``), então o FastAPI
+    continua resolvendo os parâmetros normalmente.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(**kwargs):
+            if _store is None:
+                return await func(**kwargs)
+            key = cache_key(nome, kwargs)
+            try:
+                cached = await _store.get(key)
+            except Exception as e:
+                logging.warning("Falha ao ler cache de relatórios: %s", e)
+                cached = None
+            if cached is not None:
+                _stats["hits"] += 1
+                return cached
+            _stats["misses"] += 1
+            result = await func(**kwargs)
+            try:
+                await _store.set(key, result, ttl if ttl is not None else _env_int("REPORT_CACHE_TTL_SECONDS", 60))
+            except Exception as e:
+                logging.warning("Falha ao gravar cache de relatórios: %s", e)
+            return result
+        return wrapper
+    return decorator
@@ -1,10 +1,7 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from .connection import db
 from pymongo import ReturnDocument
 from ..models.clientes import Cliente
-import os
-
-client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
-db = client["projeto_silvana"]
+from .vendas_view_db import propagar_cliente
 
 # CRUD para Cliente
 async def create_cliente(cliente: Cliente):
@@ -27,10 +24,21 @@ async def get_clientes(q: str | None = None, cpf: str | None = None):
 async def get_cliente_by_id(cliente_id: str):
     return await db.clientes.find_one({"_id": cliente_id})
 
+async def get_clientes_ids_existentes(cliente_ids) -> set:
+    """Dos ids informados, retorna os que existem (uma única consulta ``$in``)."""
+    ids = list(set(cliente_ids))
+    if not ids:
+        return set()
+    cursor = db.clientes.find({"_id": {"$in": ids}}, projection={"_id": 1})
+    return {doc["_id"] async for doc in cursor}
+
 async def update_cliente(cliente_id: str, update_data: dict):
-    return await db.clientes.find_one_and_update(
+    cliente = await db.clientes.find_one_and_update(
         {"_id": cliente_id}, {"$set": update_data}, return_document=ReturnDocument.AFTER
     )
+    # nome/telefone/cpf são exibidos nas listagens de vendas
+    propagar_cliente(cliente, update_data)
+    return cliente
 
 async def delete_cliente(cliente_id: str):
     return await db.clientes.delete_one({"_id": cliente_id})
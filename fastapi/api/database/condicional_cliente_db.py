@@ -1,12 +1,16 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from .connection import db
 from pymongo import ReturnDocument
 from ..models.condicional_cliente import CondicionalCliente
 from ..models.saidas import Saida
+from .rollup_db import registrar_saidas
+from .saidas_hook import apos_gravar_saidas
+from .cache import invalidar_relatorios
+from .metricas_db import incrementar_metricas, incrementar_pecas_em_condicional
+from .estoque_db import (
+    SEM_HISTORICO, EstoqueInsuficiente, ProdutoAlterado, alterar_itens, apagar_produto_gravado, baixar_reservados,
+    desfazer_itens, liberar_reserva, reservado,
+)
 from datetime import datetime
-import os
-
-client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
-db = client["projeto_silvana"]
 
 # CRUD para CondicionalCliente
 async def create_condicional_cliente(condicional: CondicionalCliente):
@@ -123,7 +127,7 @@ async def processar_baixa_condicional(condicional_id: str, produtos_devolvidos:
         quantidade_vendida = quantidade_total - quantidade_devolvida
 
         # Atualizar produto flags
-        remaining_cond_cliente = sum(it.get("quantity", 0) for it in produto.get("itens", []) if it.get("condicionais_cliente"))
+        remaining_cond_cliente = sum(reservado(it, "condicionais_cliente") for it in produto.get("itens", []))
         await db.produtos.update_one(
             {"_id": produto_id},
             {"$set": {"em_condicional_cliente": remaining_cond_cliente > 0}}
@@ -137,7 +141,10 @@ async def processar_baixa_condicional(condicional_id: str, produtos_devolvidos:
                 quantidade=quantidade_vendida,
                 tipo="venda"
             )
-            saida_result = await db.saidas.insert_one(saida.dict(by_alias=True))
+            saida_doc = saida.dict(by_alias=True)
+            saida_result = await db.saidas.insert_one(saida_doc)
+            await registrar_saidas([saida_doc])
+            await apos_gravar_saidas([saida_doc])
             saida_id = saida_result.inserted_id
 
             # Processar venda (importar função)
@@ -164,71 +171,43 @@ async def enviar_produto_condicional_cliente(condicional_id: str, produto_id: st
     if not condicional.get("ativa"):
         return {"error": "Condicional não está ativa"}
     
-    produto = await db.produtos.find_one({"_id": produto_id})
-    if not produto:
-        return {"error": "Produto não encontrado"}
-    
-    # Verifica se há estoque disponível (não em condicional cliente)
-    itens_disponiveis = [
-        item for item in produto.get("itens", [])
-        if not item.get("condicionais_cliente")
-    ]
-    
-    estoque_disponivel = sum(item.get("quantity", 0) for item in itens_disponiveis)
-    
-    if estoque_disponivel < quantidade:
-        return {"error": f"Estoque insuficiente. Disponível: {estoque_disponivel}"}
-    
-    # Marca itens FIFO como condicional de cliente
-    itens_ordenados = sorted(
-        itens_disponiveis,
-        key=lambda x: x.get("acquisition_date", datetime.utcnow())
-    )
-    
-    quantidade_restante = quantidade
-    itens_atualizados = list(produto.get("itens", []))
-    
-    for item in itens_ordenados:
-        if quantidade_restante <= 0:
-            break
+    def alterar(itens_atualizados):
+        # Verifica se há estoque disponível (não reservado em condicional cliente)
+        livres = {i: item.get("quantity", 0) - reservado(item, "condicionais_cliente") for i, item in enumerate(itens_atualizados)}
+        disponiveis = [i for i, livre in livres.items() if livre > 0]
+        estoque_disponivel = sum(livres[i] for i in disponiveis)
         
-        # Encontra o índice do item na lista original (apenas itens sem reservass)
-        idx = next(
-            (i for i, it in enumerate(itens_atualizados) 
-             if it.get("acquisition_date") == item.get("acquisition_date") and
-                it.get("quantity") == item.get("quantity") and
-                not it.get("condicionais_cliente")),
-            None
-        )
+        if estoque_disponivel < quantidade:
+            raise EstoqueInsuficiente(f"Estoque insuficiente. Disponível: {estoque_disponivel}")
         
-        if idx is None:
-            continue
+        # Reserva unidades FIFO para o condicional de cliente
+        disponiveis.sort(key=lambda i: itens_atualizados[i].get("acquisition_date", datetime.utcnow()))
         
-        item_quantity = itens_atualizados[idx].get("quantity", 0)
+        quantidade_restante = quantidade
         
-        if item_quantity <= quantidade_restante:
-            # Marca o item completamente como reservado (um id por unidade)
-            itens_atualizados[idx]["condicionais_cliente"] = [condicional_id] * item_quantity
-            quantidade_restante -= item_quantity
-        else:
-            # Divide o item: reduz o remanescente e adiciona um novo item reservado
-            itens_atualizados[idx]["quantity"] = item_quantity - quantidade_restante
-            novo_item = {
-                "quantity": quantidade_restante,
-                "acquisition_date": itens_atualizados[idx]["acquisition_date"],
-                "condicionais_fornecedor": itens_atualizados[idx].get("condicionais_fornecedor", []),
-                "condicionais_cliente": [condicional_id] * quantidade_restante
-            }
-            itens_atualizados.append(novo_item)
-            quantidade_restante = 0
+        for idx in disponiveis:
+            if quantidade_restante <= 0:
+                break
+            
+            # A reserva é uma contagem no próprio lote: não é preciso dividi-lo
+            reservar = min(livres[idx], quantidade_restante)
+            reservas = itens_atualizados[idx]["condicionais_cliente"]
+            reservas[condicional_id] = reservas.get(condicional_id, 0) + reservar
+            quantidade_restante -= reservar
     
-    # Atualiza o produto
-    await db.produtos.update_one(
-        {"_id": produto_id},
-        {
-            "$set": {"itens": itens_atualizados, "updated_at": datetime.utcnow(), "em_condicional_cliente": True}
-        }
-    )
+    # Atualiza o produto com checagem de rev, reaplicando a reserva sobre o estado
+    # novo se outra operação (ex.: uma venda simultânea) o alterou no meio
+    try:
+        produto, _ = await alterar_itens(produto_id, alterar)
+    except EstoqueInsuficiente as e:
+        return {"error": str(e)}
+    except ProdutoAlterado:
+        return {"error": "Produto alterado por outra operação simultânea. Tente novamente."}
+    if not produto:
+        return {"error": "Produto não encontrado"}
+    
+    await incrementar_metricas(pecas_enviadas=quantidade)
+    await incrementar_pecas_em_condicional(quantidade)
     
     # Atualiza a condicional com o produto se não existir
     produto_existente = next(
@@ -249,6 +228,8 @@ async def enviar_produto_condicional_cliente(condicional_id: str, produto_id: st
             {"$push": {"produtos": {"produto_id": produto_id, "quantidade": quantidade}}}
         )
     
+    # peças em condicional e estatísticas das condicionais mudaram
+    await invalidar_relatorios()
     return {"success": True, "produto_id": produto_id, "quantidade": quantidade}
 
 async def calcular_retorno_condicional_cliente(condicional_id: str, produtos_devolvidos_codigos: list):
@@ -273,7 +254,7 @@ async def calcular_retorno_condicional_cliente(condicional_id: str, produtos_dev
     for prod_qty in condicional.get("produtos", []):
         produto_id = prod_qty["produto_id"]
         quantidade_enviada = prod_qty["quantidade"]
-        produto = await db.produtos.find_one({"_id": produto_id})
+        produto = await db.produtos.find_one({"_id": produto_id}, projection=SEM_HISTORICO)
         if not produto:
             continue
         codigo_interno = produto.get("codigo_interno")
@@ -320,121 +301,72 @@ async def processar_retorno_condicional_cliente(condicional_id: str, produtos_de
             vendas_por_produto.setdefault(v["produto_id"], 0)
             vendas_por_produto[v["produto_id"]] += v["quantidade"]
 
-    # Itera por cada produto e aplica devoluções e vendas (usando os números calculados)
+    # Valida todas as quantidades antes de gravar qualquer coisa
+    aplicar = []
     for p in calc["produtos"]:
         produto_id = p["produto_id"]
-        quantidade_enviada = p["quantidade_enviada"]
-        quantidade_devolvida = p["quantidade_devolvida"]
-        quantidade_vendida_calc = p["quantidade_vendida"]
-
-        produto = await db.produtos.find_one({"_id": produto_id})
-        if not produto:
-            continue
-
-        # Começa aplicando devoluções (desmarcar condicional)
-        itens_condicional = [
-            (i, item) for i, item in enumerate(produto.get("itens", []))
-            if condicional_id in (item.get("condicionais_cliente") or [])
-        ]
-
-        itens_atualizados = list(produto.get("itens", []))
-        quantidade_devolucao_restante = quantidade_devolvida
-
-        for idx, item in itens_condicional:
-            if quantidade_devolucao_restante <= 0:
-                break
-            item_qty = item.get("quantity", 0)
-            # number of units reserved for this condicional in this item (usually equals item_qty)
-            reserved_count = (item.get("condicionais_cliente") or []).count(condicional_id)
-            if reserved_count <= 0:
-                continue
-            # If entire item is covered by the reserved count and we need to devolve >= item_qty
-            if item_qty <= quantidade_devolucao_restante:
-                # remove all reservations for this condicional from the item
-                itens_atualizados[idx]["condicionais_cliente"] = [cid for cid in itens_atualizados[idx].get("condicionais_cliente", []) if cid != condicional_id]
-                quantidade_devolucao_restante -= item_qty
-            else:
-                # Partially devolve: split the item into reserved and unreserved parts
-                reserved_remaining = item_qty - quantidade_devolucao_restante
-                current_list = itens_atualizados[idx].get("condicionais_cliente", [])
-                # keep the first 'reserved_remaining' occurrences for the reserved part
-                itens_atualizados[idx]["quantity"] = reserved_remaining
-                itens_atualizados[idx]["condicionais_cliente"] = current_list[:reserved_remaining]
-                novo_item = {
-                    "quantity": quantidade_devolucao_restante,
-                    "acquisition_date": item["acquisition_date"],
-                    "condicionais_fornecedor": item.get("condicionais_fornecedor"),
-                    "condicionais_cliente": []
-                }
-                itens_atualizados.append(novo_item)
-                quantidade_devolucao_restante = 0
-
-        # Se vendas_list foi fornecida usamos as quantidades das vendas, senão usamos cálculo automático
-        quantidade_vendida_para_aplicar = quantidade_vendida_calc
+        quantidade_vendida_para_aplicar = p["quantidade_vendida"]
         if vendas_list and vendas_por_produto.get(produto_id) is not None:
-            if vendas_por_produto[produto_id] != quantidade_vendida_calc:
-                return {"error": f"Soma das vendas fornecidas para produto {produto_id} ({vendas_por_produto[produto_id]}) não confere com quantidade vendida calculada ({quantidade_vendida_calc})"}
+            if vendas_por_produto[produto_id] != p["quantidade_vendida"]:
+                return {"error": f"Soma das vendas fornecidas para produto {produto_id} ({vendas_por_produto[produto_id]}) não confere com quantidade vendida calculada ({p['quantidade_vendida']})"}
             quantidade_vendida_para_aplicar = vendas_por_produto[produto_id]
+        aplicar.append((produto_id, p["quantidade_devolvida"], quantidade_vendida_para_aplicar))
+
+    # 1) Aplica devoluções e vendas nos lotes de todos os produtos. Se um deles
+    # não puder ser gravado, desfaz os anteriores e nada é registrado: o retorno
+    # é tudo ou nada e pode ser repetido
+    aplicados = []
+    for produto_id, quantidade_devolvida, quantidade_vendida_para_aplicar in aplicar:
+        def alterar(itens_atualizados):
+            # Começa aplicando devoluções (desmarcar condicional)
+            itens_condicional = [
+                item for item in itens_atualizados
+                if reservado(item, "condicionais_cliente", condicional_id) > 0
+            ]
+            quantidade_devolucao_restante = quantidade_devolvida
+
+            for item in itens_condicional:
+                if quantidade_devolucao_restante <= 0:
+                    break
+                # Unidades devolvidas deixam de estar reservadas e voltam a ficar disponíveis no mesmo lote
+                quantidade_devolucao_restante -= liberar_reserva(
+                    item, "condicionais_cliente", condicional_id, quantidade_devolucao_restante
+                )
 
-        # Processa vendas - remove itens marcados que não foram devolvidos (FIFO)
-        quantidade_venda_restante = quantidade_vendida_para_aplicar
-        itens_para_venda = [
-            (i, item) for i, item in enumerate(itens_atualizados)
-            if condicional_id in (item.get("condicionais_cliente") or [])
-        ]
-        itens_para_venda.sort(key=lambda x: x[1].get("acquisition_date", datetime.utcnow()))
+            # Processa vendas - remove itens marcados que não foram devolvidos (FIFO)
+            baixar_reservados(itens_atualizados, "condicionais_cliente", condicional_id, quantidade_vendida_para_aplicar)
+
+        # Atualiza o produto (flags em_condicional_* e contadores conforme itens restantes), com
+        # checagem de rev: se uma venda alterou o produto no meio, reaplica sobre o estado novo
+        try:
+            produto, itens_atualizados = await alterar_itens(produto_id, alterar)
+        except ProdutoAlterado:
+            for aplicado in reversed(aplicados):
+                await desfazer_itens(aplicado["produto_id"], aplicado["produto"].get("itens", []), aplicado["itens"])
+            return {"error": f"Produto {produto_id} alterado por outra operação simultânea. Tente novamente."}
+        if not produto:
+            continue
+        aplicados.append({
+            "produto_id": produto_id, "produto": produto, "itens": itens_atualizados,
+            "quantidade_devolvida": quantidade_devolvida, "quantidade_vendida": quantidade_vendida_para_aplicar,
+        })
 
-        for idx, item in itens_para_venda:
-            if quantidade_venda_restante <= 0:
-                break
-            item_qty = item.get("quantity", 0)
-            # number of units reserved for this condicional in this item
-            reserved_count = (item.get("condicionais_cliente") or []).count(condicional_id)
-            if reserved_count <= 0:
-                continue
-            use_qty = min(reserved_count, quantidade_venda_restante)
-            if use_qty >= item_qty:
-                # consume whole item
-                itens_atualizados[idx] = None
-                quantidade_venda_restante -= item_qty
-            else:
-                # partially consume reserved units: reduce quantity and reservations
-                itens_atualizados[idx]["quantity"] = item_qty - use_qty
-                current_list = item.get("condicionais_cliente", [])
-                # remove 'use_qty' occurrences of condicional_id from the list
-                removed = 0
-                new_list = []
-                for cid in current_list:
-                    if cid == condicional_id and removed < use_qty:
-                        removed += 1
-                        continue
-                    new_list.append(cid)
-                itens_atualizados[idx]["condicionais_cliente"] = new_list
-                quantidade_venda_restante -= use_qty
-                # if partially consumed, we may want to append an unreserved item fragment, but reserved items are usually isolated
-
-
-        itens_atualizados = [item for item in itens_atualizados if item is not None]
-
-        # Atualiza o produto e decrementa em_condicional pelo total enviado
-        # Ajusta flag em_condicional_cliente conforme itens restantes
-        remaining_cond_cliente = sum(it.get("quantity", 0) for it in itens_atualizados if it.get("condicionais_cliente"))
-        await db.produtos.update_one(
-            {"_id": produto_id},
-            {
-                "$set": {"itens": itens_atualizados, "updated_at": datetime.utcnow(), "em_condicional_cliente": remaining_cond_cliente > 0}
-            }
-        )
+    # 2) Com todos os lotes gravados, registra métricas, vendas e rollups
+    for aplicado in aplicados:
+        produto_id = aplicado["produto_id"]
+        produto = aplicado["produto"]
+        quantidade_devolvida = aplicado["quantidade_devolvida"]
+        quantidade_vendida_para_aplicar = aplicado["quantidade_vendida"]
+        await incrementar_metricas(pecas_vendidas=quantidade_vendida_para_aplicar, pecas_devolvidas=quantidade_devolvida)
+        await incrementar_pecas_em_condicional(-(quantidade_vendida_para_aplicar + quantidade_devolvida))
 
         # Se estoque total zerou, só apagar se não houver condicionais (fornecedor ou cliente)
-        total_restante = sum(it.get("quantity", 0) for it in itens_atualizados)
-        produto_apagado = False
+        total_restante = sum(it.get("quantity", 0) for it in aplicado["itens"])
         if total_restante == 0:
             from ..database.produtos_db import can_delete_produto
             can_delete = await can_delete_produto(produto_id)
             if can_delete:
-                await db.produtos.delete_one({"_id": produto_id})
-                produto_apagado = True
+                await apagar_produto_gravado(produto)
 
         # snapshot do produto sem itens para registrar na saida
         produto_snapshot = {k: v for k, v in (produto or {}).items() if k != 'itens'}
@@ -458,7 +390,10 @@ async def processar_retorno_condicional_cliente(condicional_id: str, produtos_de
                     observacoes=v.get("observacoes"),
                     produto=produto_snapshot
                 )
-                result = await db.saidas.insert_one(saida.dict(by_alias=True))
+                saida_doc = saida.dict(by_alias=True)
+                result = await db.saidas.insert_one(saida_doc)
+                await registrar_saidas([saida_doc])
+                await apos_gravar_saidas([saida_doc])
                 vendas_criadas.append({"saida_id": str(result.inserted_id), "produto_id": produto_id, "quantidade": v["quantidade"]})
         else:
             if quantidade_vendida_para_aplicar > 0:
@@ -471,10 +406,15 @@ async def processar_retorno_condicional_cliente(condicional_id: str, produtos_de
                     observacoes=f"Venda por condicional {condicional_id}",
                     produto=produto_snapshot
                 )
-                result = await db.saidas.insert_one(saida.dict(by_alias=True))
+                saida_doc = saida.dict(by_alias=True)
+                result = await db.saidas.insert_one(saida_doc)
+                await registrar_saidas([saida_doc])
+                await apos_gravar_saidas([saida_doc])
                 vendas_criadas.append({"saida_id": str(result.inserted_id), "produto_id": produto_id, "quantidade": quantidade_vendida_para_aplicar})
 
     # Encerra a condicional
     await update_condicional_cliente(condicional_id, {"data_devolucao": datetime.utcnow(), "ativa": False})
+    await incrementar_metricas(condicionais_encerradas=1)
+    await invalidar_relatorios()
 
     return {"success": True, "condicional_id": condicional_id, "vendas_criadas": vendas_criadas, "devolucoes_processadas": devolucoes_processadas}
\ No newline at end of file
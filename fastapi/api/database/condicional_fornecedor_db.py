@@ -1,14 +1,22 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from .connection import db, get_client, suporta_transacoes
 from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from ..models.condicional_fornecedor import CondicionalFornecedor
+from ..models.entradas import Entrada
+from ..models.produtos import Produto
 from ..models.saidas import Saida
+from .rollup_db import registrar_saidas
+from .saidas_hook import apos_gravar_saidas
+from .cache import invalidar_relatorios
+from .produtos_db import preparar_documento_produto
+from .tags_db import get_or_create_tags_by_descricoes
+from .estoque_db import (
+    SEM_HISTORICO, EstoqueInsuficiente, ProdutoAlterado, alterar_itens, apagar_produto_gravado, baixar_reservados,
+    copiar_lotes, estoque_inc, liberar_reserva, novo_lot_id, reservado,
+)
 from datetime import datetime, date
-import os
 import logging
 
-client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
-db = client["projeto_silvana"]
-
 # CRUD para CondicionalFornecedor
 async def create_condicional_fornecedor(condicional: CondicionalFornecedor):
     # Converte data_condicional para datetime para compatibilidade com BSON
@@ -42,6 +50,86 @@ async def get_condicional_fornecedor_completa(condicional_id: str):
     ]
     return await db.condicional_fornecedores.aggregate(pipeline).to_list(None)
 
+async def get_desempenho_condicionais_fornecedor(fornecedor_id: str | None = None, page: int = 1, per_page: int = 20):
+    """
+    Desempenho de cada condicional fornecedor numa única agregação: peças
+    vendidas e devolvidas (saídas agrupadas por tipo), peças ainda em estoque
+    consignadas por ela e quantas ainda podem ser devolvidas. Paginado.
+    """
+    query = {"fornecedor_id": fornecedor_id} if fornecedor_id else {}
+    skip = (max(1, page) - 1) * max(1, per_page)
+
+    # unidades deste condicional em cada lote (mapa condicional_id -> quantidade)
+    unidades_no_lote = {"$sum": {"$map": {
+        "input": {"$filter": {
+            "input": {"$objectToArray": {"$cond": [
+                {"$eq": [{"$type": "$itens.condicionais_fornecedor"}, "object"]},
+                "$itens.condicionais_fornecedor",
+                {}
+            ]}},
+            "cond": {"$eq": ["$$this.k", "$$cid"]}
+        }},
+        "in": "$$this.v"
+    }}}
+
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"created_at": -1}},
+        {"$facet": {
+            "metadata": [{"$count": "total"}],
+            "data": [
+                {"$skip": skip},
+                {"$limit": per_page},
+                {"$lookup": {
+                    "from": "saidas",
+                    "localField": "_id",
+                    "foreignField": "condicional_fornecedor_id",
+                    "pipeline": [{"$group": {"_id": "$tipo", "quantidade": {"$sum": "$quantidade"}}}],
+                    "as": "saidas_por_tipo"
+                }},
+                {"$lookup": {
+                    "from": "produtos",
+                    "localField": "produtos_id",
+                    "foreignField": "_id",
+                    "let": {"cid": "$_id"},
+                    "pipeline": [
+                        {"$project": {"itens": 1}},
+                        {"$unwind": "$itens"},
+                        {"$group": {"_id": None, "quantidade": unidades_no_lote}}
+                    ],
+                    "as": "estoque"
+                }},
+            ]
+        }}
+    ]
+
+    result = await db.condicional_fornecedores.aggregate(pipeline).to_list(None)
+    if not result:
+        return {"total": 0, "items": []}
+    metadata = result[0].get("metadata", [])
+    total = metadata[0]["total"] if metadata else 0
+
+    items = []
+    for cond in result[0].get("data", []):
+        por_tipo = {s["_id"]: s["quantidade"] for s in cond.get("saidas_por_tipo", [])}
+        devolvidas = por_tipo.get("devolucao", 0)
+        em_stock = sum(e["quantidade"] for e in cond.get("estoque", []))
+        quantidade_max = cond.get("quantidade_max_devolucao")
+        if quantidade_max is not None:
+            podem_devolver = max(0, min(quantidade_max - devolvidas, em_stock))
+        else:
+            podem_devolver = em_stock
+        items.append({
+            "condicional_id": cond["_id"],
+            "fornecedor_id": cond.get("fornecedor_id"),
+            "fechada": cond.get("fechada", False),
+            "pecas_vendidas": por_tipo.get("venda", 0),
+            "pecas_devolvidas": devolvidas,
+            "em_stock": em_stock,
+            "podem_ser_devolvidas": podem_devolver
+        })
+    return {"total": total, "items": items}
+
 async def get_produtos_em_condicional_fornecedor():
     pipeline = [
         {"$unwind": "$produtos_id"},
@@ -63,64 +151,24 @@ async def calcular_quantidade_vendida_condicional_fornecedor(condicional_id: str
 
 async def processar_devolucoes_condicional_fornecedor(condicional_id: str, produto_id: str, quantidade_devolvida: int):
     """Remove itens devolvidos do estoque do produto"""
-    """Remove itens devolvidos do estoque do produto"""
-    produto = await db.produtos.find_one({"_id": produto_id})
+    # Remover FIFO as unidades deste condicional (lotes que zeram saem do produto);
+    # grava com checagem de rev, repetindo se uma venda alterou o produto no meio
+    try:
+        produto, itens_atualizados = await alterar_itens(
+            produto_id, lambda itens: baixar_reservados(itens, "condicionais_fornecedor", condicional_id, quantidade_devolvida)
+        )
+    except ProdutoAlterado:
+        return {"error": "Produto alterado por outra operação simultânea. Tente novamente."}
     if not produto:
         return
 
-    # Encontrar itens marcados com este condicional (com índices)
-    itens_condicional = [
-        (i, item) for i, item in enumerate(produto.get("itens", []))
-        if condicional_id in (item.get("condicionais_fornecedor") or [])
-    ]
-
-    itens_atualizados = list(produto.get("itens", []))
-    quantidade_restante = quantidade_devolvida
-
-    # Remover itens FIFO — processar em ordem crescente de aquisição, mas para pops usar índices decrescentes
-    # Vamos ordenar por acquisition_date asc (já estava ordenado na coleta externa), mas removemos por índice desc
-    for idx, item in sorted(itens_condicional, key=lambda x: x[0], reverse=True):
-        if quantidade_restante <= 0:
-            break
-
-        item_qty = item.get("quantity", 0)
-        reserved_count = (item.get("condicionais_fornecedor") or []).count(condicional_id)
-
-        if reserved_count <= quantidade_restante:
-            # Remover item completamente
-            itens_atualizados.pop(idx)
-            quantidade_restante -= reserved_count
-        else:
-            # Reduzir quantidade e remover apenas as ocorrências do condicional equivalentes à quantidade_restante
-            itens_atualizados[idx]["quantity"] = item_qty - quantidade_restante
-            current_list = item.get("condicionais_fornecedor", [])
-            # remove apenas 'quantidade_restante' ocorrências do condicional_id
-            removed = 0
-            new_list = []
-            for cid in current_list:
-                if cid == condicional_id and removed < quantidade_restante:
-                    removed += 1
-                    continue
-                new_list.append(cid)
-            itens_atualizados[idx]["condicionais_fornecedor"] = new_list
-            quantidade_restante = 0
-
-    # Atualizar produto
-    remaining_cond_fornecedor = sum(item.get("quantity", 0) for item in itens_atualizados if item.get("condicionais_fornecedor"))
-    await db.produtos.update_one(
-        {"_id": produto_id},
-        {
-            "$set": {"itens": itens_atualizados, "updated_at": datetime.utcnow(), "em_condicional_fornecedor": remaining_cond_fornecedor > 0}
-        }
-    )
-
     # Deletar produto se estoque zerou e não está em nenhum condicional
     total_restante = sum(item.get("quantity", 0) for item in itens_atualizados)
     if total_restante == 0:
         from .produtos_db import can_delete_produto
         can_delete = await can_delete_produto(produto_id)
         if can_delete:
-            await db.produtos.delete_one({"_id": produto_id})
+            await apagar_produto_gravado(produto)
 
 
 async def adicionar_produto_condicional_fornecedor(condicional_id: str, produto_id: str, quantidade: int):
@@ -132,16 +180,17 @@ async def adicionar_produto_condicional_fornecedor(condicional_id: str, produto_
     if not condicional:
         return {"error": "Condicional não encontrado"}
     
-    produto = await db.produtos.find_one({"_id": produto_id})
+    produto = await db.produtos.find_one({"_id": produto_id}, projection=SEM_HISTORICO)
     if not produto:
         return {"error": "Produto não encontrado"}
     
     # Cria um novo item marcado como condicional de fornecedor
     novo_item = {
+        "lot_id": novo_lot_id(),
         "quantity": quantidade,
         "acquisition_date": datetime.utcnow(),
-        "condicionais_fornecedor": [condicional_id] * quantidade,
-        "condicionais_cliente": []
+        "condicionais_fornecedor": {condicional_id: quantidade},
+        "condicionais_cliente": {}
     }
     
     # Adiciona o item ao produto
@@ -149,7 +198,8 @@ async def adicionar_produto_condicional_fornecedor(condicional_id: str, produto_
         {"_id": produto_id},
         {
             "$push": {"itens": novo_item},
-            "$set": {"updated_at": datetime.utcnow(), "em_condicional_fornecedor": True}
+            "$set": {"updated_at": datetime.utcnow(), "em_condicional_fornecedor": True},
+            "$inc": {**estoque_inc(total=quantidade, em_fornecedor=quantidade), "rev": 1}
         }
     )
     
@@ -160,6 +210,8 @@ async def adicionar_produto_condicional_fornecedor(condicional_id: str, produto_
             {"$push": {"produtos_id": produto_id}}
         )
     
+    # estoque e desempenho das condicionais mudaram
+    await invalidar_relatorios()
     return {"success": True, "produto_id": produto_id, "quantidade": quantidade}
 
 async def devolver_itens_condicional_fornecedor(condicional_id: str, produto_id: str, quantidade: int):
@@ -171,21 +223,6 @@ async def devolver_itens_condicional_fornecedor(condicional_id: str, produto_id:
     if not condicional:
         return {"error": "Condicional não encontrado"}
     
-    produto = await db.produtos.find_one({"_id": produto_id})
-    if not produto:
-        return {"error": "Produto não encontrado"}
-    
-    # Encontra itens deste condicional (itens que têm esse condicional em sua lista)
-    itens_condicional = [
-        item for item in produto.get("itens", [])
-        if condicional_id in (item.get("condicionais_fornecedor") or [])
-    ]
-    
-    quantidade_disponivel = sum(item.get("quantity", 0) for item in itens_condicional)
-    
-    if quantidade_disponivel < quantidade:
-        return {"error": f"Quantidade insuficiente para devolução. Disponível: {quantidade_disponivel}"}
-    
     # Verifica limite de devolução
     quantidade_max = condicional.get("quantidade_max_devolucao")
     if quantidade_max is not None:
@@ -202,64 +239,32 @@ async def devolver_itens_condicional_fornecedor(condicional_id: str, produto_id:
         if total_ja_devolvido + quantidade > quantidade_max:
             return {"error": f"Limite de devolução excedido. Máximo: {quantidade_max}, Já devolvido: {total_ja_devolvido}"}
     
-    # Remove itens FIFO do condicional
-    itens_ordenados = sorted(
-        itens_condicional,
-        key=lambda x: x.get("acquisition_date", datetime.utcnow())
-    )
-    
-    quantidade_restante = quantidade
-    itens_atualizados = list(produto.get("itens", []))
-    
-    for item in itens_ordenados:
-        if quantidade_restante <= 0:
-            break
-        
-        idx = next(
-            (i for i, it in enumerate(itens_atualizados) 
-             if it.get("acquisition_date") == item.get("acquisition_date") and
-                condicional_id in (it.get("condicionais_fornecedor") or [])),
-            None
-        )
-        
-        if idx is None:
-            continue
-        
-        item_quantity = itens_atualizados[idx].get("quantity", 0)
-        
-        if item_quantity <= quantidade_restante:
-            quantidade_restante -= item_quantity
-            itens_atualizados.pop(idx)
-        else:
-            # reduz a quantidade e remove 'quantidade_restante' ocorrências do condicional desta unidade
-            itens_atualizados[idx]["quantity"] = item_quantity - quantidade_restante
-            cf_list = itens_atualizados[idx].get("condicionais_fornecedor", [])[:]
-            removed = 0
-            new_cf = []
-            for cid in cf_list:
-                if cid == condicional_id and removed < quantidade_restante:
-                    removed += 1
-                    continue
-                new_cf.append(cid)
-            itens_atualizados[idx]["condicionais_fornecedor"] = new_cf
-            quantidade_restante = 0
+    def alterar(itens_atualizados):
+        # Unidades deste condicional ainda no produto (relidas a cada tentativa)
+        quantidade_disponivel = sum(reservado(item, "condicionais_fornecedor", condicional_id) for item in itens_atualizados)
+        if quantidade_disponivel < quantidade:
+            raise EstoqueInsuficiente(f"Quantidade insuficiente para devolução. Disponível: {quantidade_disponivel}")
+        # Remove FIFO as unidades do condicional (lotes que zeram saem do produto)
+        baixar_reservados(itens_atualizados, "condicionais_fornecedor", condicional_id, quantidade)
     
-    # Atualiza o produto
-    remaining_cond_fornecedor = sum(item.get("quantity", 0) for item in itens_atualizados if item.get("condicionais_fornecedor"))
-    await db.produtos.update_one(
-        {"_id": produto_id},
-        {
-            "$set": {"itens": itens_atualizados, "updated_at": datetime.utcnow(), "em_condicional_fornecedor": remaining_cond_fornecedor > 0}
-        }
-    )
+    # Grava com checagem de rev, repetindo se uma venda alterou o produto no meio
+    try:
+        produto, itens_atualizados = await alterar_itens(produto_id, alterar)
+    except EstoqueInsuficiente as e:
+        return {"error": str(e)}
+    except ProdutoAlterado:
+        return {"error": "Produto alterado por outra operação simultânea. Tente novamente."}
+    if not produto:
+        return {"error": "Produto não encontrado"}
     
     # Se estoque total zerou após devolução, apagar produto se não houver mais condicionais
+    # (somente se ninguém repôs ou vendeu depois da gravação)
     total_restante = sum(item.get("quantity", 0) for item in itens_atualizados)
     if total_restante == 0:
         from .produtos_db import can_delete_produto
         can_delete = await can_delete_produto(produto_id)
         if can_delete:
-            await db.produtos.delete_one({"_id": produto_id})
+            await apagar_produto_gravado(produto)
     
     # Cria saída de devolução
     saida = Saida(
@@ -272,7 +277,10 @@ async def devolver_itens_condicional_fornecedor(condicional_id: str, produto_id:
         observacoes=f"Devolução de condicional {condicional_id}"
     )
     
-    result = await db.saidas.insert_one(saida.dict(by_alias=True))
+    saida_doc = saida.dict(by_alias=True)
+    result = await db.saidas.insert_one(saida_doc)
+    await registrar_saidas([saida_doc])
+    await apos_gravar_saidas([saida_doc])
     
     pode_devolver_ainda = None
     if quantidade_max is not None:
@@ -312,17 +320,16 @@ async def get_status_devolucao_condicional_fornecedor(condicional_id: str, produ
     saidas_devolucao = await db.saidas.find(query).to_list(None)
     total_devolvido = sum(s.get("quantidade", 0) for s in saidas_devolucao)
     
-    # Calcula total em condicional (soma quantidades de itens que tem este condicional em seu array)
+    # Calcula total em condicional (soma das unidades deste condicional em cada lote)
     total_em_condicional = 0
     for prod_id_ in condicional.get("produtos_id", []):
         if produto_id and prod_id_ != produto_id:
             continue
         
-        produto = await db.produtos.find_one({"_id": prod_id_})
+        produto = await db.produtos.find_one({"_id": prod_id_}, projection=SEM_HISTORICO)
         if produto:
             for item in produto.get("itens", []):
-                if condicional_id in (item.get("condicionais_fornecedor") or []):
-                    total_em_condicional += item.get("quantity", 0)
+                total_em_condicional += reservado(item, "condicionais_fornecedor", condicional_id)
 
 
     # Calcula total vendido originado desta condicional (procura saídas que tiveram condicional_fornecedor_id)
@@ -344,79 +351,108 @@ async def get_status_devolucao_condicional_fornecedor(condicional_id: str, produ
         "quantidade_vendida": total_vendido
     }
 # Função auxiliar: cria uma condicional e vários produtos associados em lote
+# (usada por POST /condicionais-fornecedor/batch-create)
+def _itens_condicional(itens: list, condicional_id: str) -> list:
+    """Lotes do produto marcados como da condicional (um lote de 1 unidade se vier vazio)."""
+    novos = []
+    for itm in itens or [{'quantity': 1}]:
+        item = dict(itm)
+        item['quantity'] = int(item['quantity']) if item.get('quantity') is not None else 1
+        item['condicionais_fornecedor'] = {condicional_id: item['quantity']}
+        item['condicionais_cliente'] = item.get('condicionais_cliente') or {}
+        novos.append(item)
+    return novos
+
+def montar_lote_condicional(condicional: dict, produtos: list, tags: dict) -> tuple[list, list]:
+    """Documentos de produtos e entradas de uma condicional recebida em lote.
+
+    ``produtos`` são modelos ``Produto`` já validados e ``tags`` o resultado de
+    ``get_or_create_tags_by_descricoes``. Nada é gravado aqui.
+    """
+    docs, entradas = [], []
+    for produto in produtos:
+        tags_produto = []
+        for tag in produto.tags:
+            resolvida = tags.get(tag.descricao.strip().lower())
+            if resolvida and all(t['_id'] != resolvida['_id'] for t in tags_produto):
+                tags_produto.append({'_id': resolvida['_id'], 'descricao': resolvida['descricao']})
+        doc = produto.dict(by_alias=True)
+        doc['itens'] = copiar_lotes(_itens_condicional(doc.get('itens'), condicional['_id']))
+        docs.append(preparar_documento_produto(doc, tags_produto))
+        for item in doc['itens']:
+            if item['quantity'] > 0:
+                entradas.append(Entrada(produtos_id=doc['_id'], quantidade=item['quantity'], tipo='compra').dict(by_alias=True))
+    condicional['produtos_id'] = [doc['_id'] for doc in docs]
+    return docs, entradas
+
+async def _validar_lote(produtos: list) -> list:
+    validados = [p if isinstance(p, Produto) else Produto(**{'itens': [], 'tags': [], **p}) for p in produtos]
+    codigos = [p.codigo_interno for p in validados]
+    vistos = set()
+    repetidos = sorted({c for c in codigos if c in vistos or vistos.add(c)})
+    if repetidos:
+        raise ValueError(f"codigo_interno repetido no lote: {', '.join(repetidos)}")
+    cursor = db.produtos.find({"codigo_interno": {"$in": codigos}}, projection={"codigo_interno": 1})
+    existentes = sorted([p["codigo_interno"] async for p in cursor])
+    if existentes:
+        raise ValueError(f"codigo_interno already exists: {', '.join(existentes)}")
+    return validados
+
+async def _gravar_lote(condicional: dict, docs: list, entradas: list, session=None):
+    await db.produtos.insert_many(docs, session=session)
+    if entradas:
+        await db.entradas.insert_many(entradas, session=session)
+    await db.condicional_fornecedores.insert_one(condicional, session=session)
+
+async def _desfazer_lote(condicional: dict, docs: list):
+    ids = [doc['_id'] for doc in docs]
+    try:
+        await db.produtos.delete_many({"_id": {"$in": ids}})
+        await db.entradas.delete_many({"produtos_id": {"$in": ids}})
+        await db.condicional_fornecedores.delete_one({"_id": condicional['_id']})
+    except Exception:
+        logging.exception('Falha ao desfazer a condicional %s criada em lote', condicional['_id'])
+
 async def create_condicional_with_produtos(condicional_data: dict, produtos: list):
     """
-    Cria uma condicional fornecedor e insere múltiplos produtos associados em uma única operação lógica.
-    Retorna (condicional_id, [produto_ids]) em caso de sucesso. Em caso de erro, tenta rollback das inserções parciais.
+    Cria uma condicional fornecedor e os produtos recebidos nela de uma vez.
+
+    Todos os produtos são validados antes de gravar (códigos repetidos ou já
+    cadastrados levantam ValueError); as tags são resolvidas numa consulta e
+    produtos, entradas e a condicional vão em um ``insert_many``/``insert_one``
+    cada, independente do tamanho do lote. Com replica set as gravações rodam
+    numa transação; sem, uma falha remove o que já foi inserido.
+    Retorna {"condicional_id", "produto_ids"}.
     """
+    condicional = CondicionalFornecedor(**condicional_data).dict(by_alias=True)
+    if isinstance(condicional.get('data_condicional'), date):
+        condicional['data_condicional'] = datetime.combine(condicional['data_condicional'], datetime.min.time())
+    validados = await _validar_lote(produtos or [])
+    # tags ficam fora da transação: são compartilhadas e get_or_create é idempotente
+    tags = await get_or_create_tags_by_descricoes(t.descricao for p in validados for t in p.tags)
+    docs, entradas = montar_lote_condicional(condicional, validados, tags)
+    logging.info('Criando condicional %s com %d produtos e %d entradas', condicional['_id'], len(docs), len(entradas))
 
-    print("create_condicional_with_produtos called")
-    print("Condicional data:", condicional_data)
-    print("Produtos count:", len(produtos or []))
-
-    print("primeiro produto:", produtos[0] if produtos else "nenhum produto")
-    inserted_produto_ids = []
-    condicional_id = None
-    logging.info('create_condicional_with_produtos called')
-    logging.info('Condicional data: %s', condicional_data)
-    logging.info('Produtos count: %d', len(produtos or []))
     try:
-        # Criar condicional
-        from ..models.condicional_fornecedor import CondicionalFornecedor as CFModel
-        cf = CFModel(**condicional_data)
-        condicional_id = await create_condicional_fornecedor(cf)
-        logging.info('Created condicional_id: %s', condicional_id)
-
-        # Inserir produtos com referencia a condicional
-        from ..models.produtos import Produto as ProdutoModel
-        # import create_produto localmente to avoid circular imports at module load
-        from ..database.produtos_db import create_produto
-        for idx, prod in enumerate(produtos):
-            logging.info('Processing produto %d: %s', idx, prod.get('codigo_interno') if isinstance(prod, dict) else str(prod))
-            # Garantir que itens têm condicional_fornecedor_id
-            itens = prod.get('itens') or []
-            if not itens:
-                # cria um item default
-                itens = [{'quantity': 1}]
-            # marcar itens com condicional id (usar array de ids por unidade)
-            new_itens = []
-            for itm in itens:
-                qty = int(itm.get('quantity', 1)) if itm.get('quantity') is not None else 1
-                it_copy = dict(itm)
-                it_copy['condicionais_fornecedor'] = [condicional_id] * qty
-                it_copy['condicionais_cliente'] = it_copy.get('condicionais_cliente', [])
-                new_itens.append(it_copy)
-            prod['itens'] = new_itens
-            # garantir campos obrigatórios que o modelo pode esperar
-            prod.setdefault('entradas', [])
-            prod.setdefault('saidas', [])
-            # criar produto (usa a lógica existente que normaliza tags/entradas)
-            produto_obj = ProdutoModel(**prod)
-            produto_id = await create_produto(produto_obj)
-            logging.info('Inserted produto_id: %s', str(produto_id))
-            inserted_produto_ids.append(produto_id)
-
-        # Atualizar condicional com os produtos criados
-        await db.condicional_fornecedores.update_one(
-            {"_id": condicional_id},
-            {"$set": {"produtos_id": inserted_produto_ids, "updated_at": datetime.utcnow()}}
-        )
-        logging.info('Updated condicional with produtos_id')
-
-        return {"condicional_id": condicional_id, "produto_ids": inserted_produto_ids}
-    except Exception as e:
-        # Em caso de erro, tentar rollback: remover produtos inseridos e a condicional criada
-        try:
-            if inserted_produto_ids:
-                await db.produtos.delete_many({"_id": {"$in": inserted_produto_ids}})
-            if condicional_id:
-                await db.condicional_fornecedores.delete_one({"_id": condicional_id})
-        except Exception:
-            logging.exception('Error during rollback after create_condicional_with_produtos failure')
-            pass
-        raise e
-
-
+        if await suporta_transacoes():
+            async with await get_client().start_session() as session:
+                await session.with_transaction(lambda s: _gravar_lote(condicional, docs, entradas, s))
+        else:
+            try:
+                await _gravar_lote(condicional, docs, entradas)
+            except Exception:
+                await _desfazer_lote(condicional, docs)
+                raise
+    except DuplicateKeyError as e:
+        # código cadastrado por outra requisição entre a validação e o insert
+        raise ValueError(f"codigo_interno already exists: {e}")
+    except BulkWriteError as e:
+        if any(w.get('code') == 11000 for w in e.details.get('writeErrors', [])):
+            raise ValueError("codigo_interno already exists")
+        raise
+
+    await invalidar_relatorios()
+    return {"condicional_id": condicional['_id'], "produto_ids": condicional['produtos_id']}
 
 async def processar_condicional_fornecedor(condicional_id: str, ids_produtos_devolvidos: list[str]):
     """
@@ -445,60 +481,26 @@ async def processar_condicional_fornecedor(condicional_id: str, ids_produtos_dev
 
     produto_ids = condicional.get("produtos_id", []) or []
     for produto_id in produto_ids:
-        produto = await db.produtos.find_one({"_id": produto_id})
+        def alterar(new_itens):
+            if produto_id in ids_devolvidos_set:
+                # Devolvido: remover as unidades vinculadas à condicional (lotes que zeram saem)
+                baixar_reservados(new_itens, "condicionais_fornecedor", condicional_id,
+                                  sum(reservado(item, "condicionais_fornecedor", condicional_id) for item in new_itens))
+            else:
+                # Não devolvido: retirar marcação condicional (vira estoque normal)
+                for item in new_itens:
+                    liberar_reserva(item, "condicionais_fornecedor", condicional_id)
+
+        # Grava com checagem de rev (repete se uma venda alterou o produto no meio)
+        try:
+            produto, new_itens = await alterar_itens(produto_id, alterar)
+        except ProdutoAlterado:
+            results.append({"produto_id": produto_id, "error": "Produto alterado por outra operação simultânea. Tente novamente."})
+            continue
         if not produto:
             results.append({"produto_id": produto_id, "error": "produto not found"})
             continue
-
-        itens = list(produto.get("itens", []))
-        modified = False
-        new_itens = []
-
-        for item in itens:
-            cf_list = list(item.get("condicionais_fornecedor", []))
-            if condicional_id in cf_list:
-                occ = cf_list.count(condicional_id)
-                # Se este produto foi marcado como devolvido, remover as unidades vinculadas à condicional
-                if produto_id in ids_devolvidos_set:
-                    qty = item.get("quantity", 0)
-                    if qty > occ:
-                        itm = dict(item)
-                        itm["quantity"] = qty - occ
-                        # remover todas ocorrências do condicional
-                        new_cf = [c for c in cf_list if c != condicional_id]
-                        if new_cf:
-                            itm["condicionais_fornecedor"] = new_cf
-                        else:
-                            itm.pop("condicionais_fornecedor", None)
-                        new_itens.append(itm)
-                    else:
-                        # todas unidades deste item devolvidas -> omitimos (remoção)
-                        pass
-                    modified = True
-                else:
-                    # não devolvido: retirar marcação condicional (vira estoque normal)
-                    itm = dict(item)
-                    new_cf = [c for c in cf_list if c != condicional_id]
-                    if new_cf:
-                        itm["condicionais_fornecedor"] = new_cf
-                    else:
-                        itm.pop("condicionais_fornecedor", None)
-                    new_itens.append(itm)
-                    modified = True
-            else:
-                # item sem esta condicional, mantém
-                new_itens.append(item)
-
-        # Atualizar produto se houve modificação
-        if modified:
-            remaining_cond_qty = sum(it.get("quantity", 0) for it in new_itens if it.get("condicionais_fornecedor"))
-            await db.produtos.update_one(
-                {"_id": produto_id},
-                {"$set": {"itens": new_itens, "updated_at": datetime.utcnow(), "em_condicional_fornecedor": remaining_cond_qty > 0}}
-            )
-        else:
-            # atualiza timestamp mínimo para indicar processing
-            await db.produtos.update_one({"_id": produto_id}, {"$set": {"updated_at": datetime.utcnow()}})
+        modified = any(reservado(item, "condicionais_fornecedor", condicional_id) for item in produto.get("itens", []))
 
         # Se não restar estoque, tenta deletar.
         # Em vez de usar can_delete_produto, verificamos se o produto aparece
@@ -510,11 +512,11 @@ async def processar_condicional_fornecedor(condicional_id: str, ids_produtos_dev
             cond_cliente = await db.condicional_clientes.find_one({"produtos.produto_id": produto_id, "ativa": True})
             if not cond_cliente:
                 # Seguro para deletar (não há condicionais de cliente ativas referenciando este produto)
-                await db.produtos.delete_one({"_id": produto_id})
-                produto_deletado = True
+                produto_deletado = await apagar_produto_gravado(produto)
 
         results.append({"produto_id": produto_id, "modified": modified, "produto_deletado": produto_deletado})
 
+    await invalidar_relatorios()
     return {"success": True, "condicional_id": condicional_id, "results": results}
 
      
@@ -537,7 +539,7 @@ async def listar_produtos_em_condicional_fornecedor(condicional_id: str):
     
     produtos = []
     for prod_id in condicional.get("produtos_id", []):
-        produto = await db.produtos.find_one({"_id": prod_id})
+        produto = await db.produtos.find_one({"_id": prod_id}, projection=SEM_HISTORICO)
         if produto:
             produtos.append(produto)
     
@@ -0,0 +1,117 @@
+"""Conexão compartilhada com o MongoDB.
+
+Um único ``AsyncIOMotorClient`` por processo, criado no lifespan da aplicação
+(``main.lifespan``) e fechado no shutdown. Todos os módulos ``*_db.py`` usam o
+objeto ``db`` exportado aqui, que resolve o banco do client compartilhado a cada
+acesso; fora do lifespan (scripts, testes) o client é criado sob demanda.
+
+Configuração do pool via variáveis de ambiente:
+
+- ``MONGODB_URL``: URL de conexão (padrão ``mongodb://localhost:27017``)
+- ``MONGODB_DB``: nome do banco (padrão ``projeto_silvana``)
+- ``MONGO_MAX_POOL_SIZE`` / ``MONGO_MIN_POOL_SIZE``: tamanho do pool por processo
+- ``MONGO_MAX_IDLE_TIME_MS``: tempo máximo de uma conexão ociosa no pool
+- ``MONGO_CONNECT_TIMEOUT_MS``, ``MONGO_SERVER_SELECTION_TIMEOUT_MS``,
+  ``MONGO_SOCKET_TIMEOUT_MS``, ``MONGO_WAIT_QUEUE_TIMEOUT_MS``: timeouts
+
+Transações multi-documento exigem replica set (um replica set local de um nó
+basta); ``suporta_transacoes`` verifica uma vez por client.
+"""
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+import os
+import logging
+
+DEFAULT_MONGODB_URL = "mongodb://localhost:27017"
+DEFAULT_DB_NAME = "projeto_silvana"
+
+# variável de ambiente -> opção do client (pymongo)
+_POOL_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGO_MIN_POOL_SIZE": "minPoolSize",
+    "MONGO_MAX_IDLE_TIME_MS": "maxIdleTimeMS",
+    "MONGO_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+    "MONGO_SOCKET_TIMEOUT_MS": "socketTimeoutMS",
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+}
+
+_client: AsyncIOMotorClient | None = None
+_transacoes: bool | None = None
+
+
+def get_client_options() -> dict:
+    """Lê as opções de pool/timeout do ambiente (apenas as definidas)."""
+    options = {}
+    for env_name, option in _POOL_OPTIONS.items():
+        raw = os.getenv(env_name)
+        if raw is None or raw.strip() == "":
+            continue
+        try:
+            options[option] = int(raw)
+        except ValueError:
+            logging.warning("Valor inválido para %s: %r (ignorado)", env_name, raw)
+    return options
+
+
+def get_db_name() -> str:
+    return os.getenv("MONGODB_DB", DEFAULT_DB_NAME)
+
+
+def connect() -> AsyncIOMotorClient:
+    """Cria o client compartilhado (idempotente)."""
+    global _client
+    if _client is None:
+        url = os.getenv("MONGODB_URL", DEFAULT_MONGODB_URL)
+        options = get_client_options()
+        _client = AsyncIOMotorClient(url, **options)
+        logging.info("MongoDB client criado (opções: %s)", options)
+    return _client
+
+
+def close() -> None:
+    """Fecha o client compartilhado e libera as conexões do pool."""
+    global _client, _transacoes
+    if _client is not None:
+        _client.close()
+        _client = None
+        _transacoes = None
+        logging.info("MongoDB client fechado")
+
+
+def get_client() -> AsyncIOMotorClient:
+    return connect()
+
+
+def get_db() -> AsyncIOMotorDatabase:
+    return get_client()[get_db_name()]
+
+
+async def suporta_transacoes() -> bool:
+    """True se o servidor é membro de replica set ou mongos (resultado em cache)."""
+    global _transacoes
+    if _transacoes is None:
+        try:
+            hello = await get_client().admin.command("hello")
+            _transacoes = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+        except Exception as e:
+            logging.warning("Não foi possível verificar suporte a transações: %s", e)
+            return False
+    return _transacoes
+
+
+async def get_database() -> AsyncIOMotorDatabase:
+    """Dependência FastAPI: ``db = Depends(get_database)``."""
+    return get_db()
+
+
+class _DatabaseProxy:
+    """Encaminha ``db.<colecao>`` para o banco do client compartilhado atual."""
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+
+db = _DatabaseProxy()
@@ -1,10 +1,6 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from .connection import db
 from pymongo import ReturnDocument
 from ..models.desejo_cliente import DesejoCliente
-import os
-
-client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
-db = client["projeto_silvana"]
 
 # CRUD para DesejoCliente
 async def create_desejo_cliente(desejo: DesejoCliente):
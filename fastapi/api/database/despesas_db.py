@@ -1,15 +1,13 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from .connection import db
 from pymongo import ReturnDocument
 from ..models.despesas import Despesa
+from .cache import invalidar_relatorios
 from datetime import datetime
-import os
-
-client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
-db = client["projeto_silvana"]
 
 # CRUD para Despesa
 async def create_despesa(despesa: Despesa):
     result = await db.despesas.insert_one(despesa.dict(by_alias=True))
+    await invalidar_relatorios()
     return result.inserted_id
 
 async def get_despesas():
@@ -19,12 +17,16 @@ async def get_despesa_by_id(despesa_id: str):
     return await db.despesas.find_one({"_id": despesa_id})
 
 async def update_despesa(despesa_id: str, update_data: dict):
-    return await db.despesas.find_one_and_update(
+    result = await db.despesas.find_one_and_update(
         {"_id": despesa_id}, {"$set": update_data}, return_document=ReturnDocument.AFTER
     )
+    await invalidar_relatorios()
+    return result
 
 async def delete_despesa(despesa_id: str):
-    return await db.despesas.delete_one({"_id": despesa_id})
+    result = await db.despesas.delete_one({"_id": despesa_id})
+    await invalidar_relatorios()
+    return result
 
 # Despesas por mês
 async def get_despesas_por_mes(mes: int, ano: int):
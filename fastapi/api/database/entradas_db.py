@@ -1,10 +1,7 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from .connection import db
 from pymongo import ReturnDocument
 from ..models.entradas import Entrada
-import os
-
-client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
-db = client["projeto_silvana"]
+from .paginacao import encode_cursor, decode_cursor, filtro_apos_cursor
 
 # CRUD para Entrada
 async def create_entrada(entrada: Entrada):
@@ -14,6 +11,19 @@ async def create_entrada(entrada: Entrada):
 async def get_entradas():
     return await db.entradas.find().to_list(None)
 
+async def get_entradas_by_produto(produto_id: str, cursor: str | None = None, limit: int = 50):
+    """Entradas do produto, mais recentes primeiro, paginadas por (data_entrada, _id)."""
+    limit = max(1, min(limit, 200))
+    query = {"produtos_id": produto_id}
+    if cursor:
+        query = {"$and": [query, filtro_apos_cursor("data_entrada", -1, *decode_cursor(cursor, "data_entrada", -1))]}
+    items = await db.entradas.find(query).sort([("data_entrada", -1), ("_id", -1)]).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor("data_entrada", -1, items[-1])
+    return {"items": items, "next_cursor": next_cursor}
+
 async def get_entrada_by_id(entrada_id: str):
     return await db.entradas.find_one({"_id": entrada_id})
 
@@ -0,0 +1,354 @@
+"""Lotes (``itens``) e contadores de estoque materializados no produto.
+
+Cada produto carrega ``estoque_total``, ``estoque_disponivel``,
+``estoque_em_condicional_cliente`` e ``estoque_em_condicional_fornecedor``,
+derivados dos lotes em ``itens``. Quem reescreve ``itens`` grava os contadores
+recalculados no mesmo update (``calcular_estoque`` / ``gravar_itens``); quem
+apenas acrescenta ou consome unidades usa ``$inc`` (``estoque_inc``). Consultas
+de estoque passam a ler um único campo; ``rebuild_estoque_dos_itens`` recalcula
+tudo a partir dos lotes.
+
+Cada lote tem um ``lot_id`` estável, usado para endereçá-lo nos updates
+(``arrayFilters``) em vez de procurá-lo por data de aquisição e quantidade.
+
+As reservas de um lote (``condicionais_fornecedor`` / ``condicionais_cliente``)
+são mapas ``{condicional_id: quantidade}``. Documentos antigos guardavam uma
+lista com um id por unidade; ``contar_reservas`` lê os dois formatos.
+"""
+from pymongo import UpdateOne
+from bson import ObjectId
+from datetime import datetime
+import logging
+from .connection import db
+
+ESTOQUE_FIELDS = (
+    "estoque_total",
+    "estoque_disponivel",
+    "estoque_em_condicional_cliente",
+    "estoque_em_condicional_fornecedor",
+)
+
+RESERVAS = ("condicionais_fornecedor", "condicionais_cliente")
+
+# Tentativas de gravação otimista (campo `rev` do produto) antes de desistir
+MAX_TENTATIVAS_ITENS = 5
+
+# Projeção das leituras de produto nos caminhos de venda/condicional: o histórico
+# de movimentações fica nas coleções entradas/saidas (documentos antigos ainda
+# podem ter cópias embutidas até rodar scripts/migrate_strip_entradas.py)
+SEM_HISTORICO = {"entradas": 0, "saidas": 0}
+
+def contar_reservas(valor) -> dict:
+    """Lê as reservas de um lote como ``{condicional_id: quantidade}``.
+
+    Aceita o formato compacto (mapa) e o antigo (lista com um id por unidade).
+    """
+    if not valor:
+        return {}
+    if isinstance(valor, dict):
+        return {cid: int(qtd) for cid, qtd in valor.items() if qtd}
+    contagem = {}
+    for cid in valor:
+        contagem[cid] = contagem.get(cid, 0) + 1
+    return contagem
+
+def reservado(item: dict, campo: str, condicional_id: str | None = None) -> int:
+    """Unidades do lote reservadas em ``campo`` (para uma condicional ou no total)."""
+    reservas = contar_reservas(item.get(campo))
+    if condicional_id is not None:
+        return reservas.get(condicional_id, 0)
+    return sum(reservas.values())
+
+def liberar_reserva(item: dict, campo: str, condicional_id: str, quantidade: int | None = None) -> int:
+    """Remove (in place) até ``quantidade`` unidades da reserva; None remove todas.
+
+    Retorna quantas unidades foram liberadas.
+    """
+    reservas = contar_reservas(item.get(campo))
+    atual = reservas.get(condicional_id, 0)
+    liberar = atual if quantidade is None else min(atual, quantidade)
+    if atual - liberar > 0:
+        reservas[condicional_id] = atual - liberar
+    else:
+        reservas.pop(condicional_id, None)
+    item[campo] = reservas
+    return liberar
+
+def baixar_reservados(itens: list, campo: str, condicional_id: str, quantidade: int) -> int:
+    """Retira do estoque (in place, FIFO) até ``quantidade`` unidades reservadas
+    para ``condicional_id`` em ``campo``; lotes que zeram são removidos.
+
+    Retorna quantas unidades foram retiradas.
+    """
+    restante = quantidade
+    for item in sorted(itens, key=lambda it: it.get("acquisition_date") or datetime.utcnow()):
+        if restante <= 0:
+            break
+        baixa = liberar_reserva(item, campo, condicional_id, restante)
+        item["quantity"] = item.get("quantity", 0) - baixa
+        restante -= baixa
+    itens[:] = [item for item in itens if item.get("quantity", 0) > 0]
+    return quantidade - restante
+
+def calcular_estoque(itens: list) -> dict:
+    """Calcula os contadores a partir da lista de itens (lotes) do produto.
+
+    Itens em condicional de cliente não estão disponíveis; itens em condicional
+    de fornecedor continuam vendáveis (contam como disponíveis).
+    """
+    total = em_cliente = em_fornecedor = 0
+    for item in itens or []:
+        qty = int(item.get("quantity", 0) or 0)
+        total += qty
+        em_cliente += min(qty, reservado(item, "condicionais_cliente"))
+        em_fornecedor += min(qty, reservado(item, "condicionais_fornecedor"))
+    return {
+        "estoque_total": total,
+        "estoque_disponivel": total - em_cliente,
+        "estoque_em_condicional_cliente": em_cliente,
+        "estoque_em_condicional_fornecedor": em_fornecedor,
+    }
+
+def estoque_inc(total: int = 0, em_cliente: int = 0, em_fornecedor: int = 0) -> dict:
+    """Monta o ``$inc`` dos contadores para uma movimentação de unidades.
+
+    ``total``: unidades que entram (+) ou saem (-) do produto;
+    ``em_cliente`` / ``em_fornecedor``: variação das unidades reservadas.
+    """
+    inc = {
+        "estoque_total": total,
+        "estoque_disponivel": total - em_cliente,
+        "estoque_em_condicional_cliente": em_cliente,
+        "estoque_em_condicional_fornecedor": em_fornecedor,
+    }
+    return {k: v for k, v in inc.items() if v}
+
+def novo_lot_id() -> str:
+    return str(ObjectId())
+
+def normalizar_lotes(itens: list) -> list:
+    """Normaliza os lotes in place: atribui ``lot_id`` aos antigos e converte as
+    reservas para o formato de mapa."""
+    for item in itens:
+        if not item.get("lot_id"):
+            item["lot_id"] = novo_lot_id()
+        for campo in RESERVAS:
+            item[campo] = contar_reservas(item.get(campo))
+    return itens
+
+def copiar_lotes(itens: list) -> list:
+    """Cópia normalizada dos lotes, para editar sem alterar o documento lido."""
+    return normalizar_lotes([dict(item) for item in itens or []])
+
+def devolver_lotes(itens_atuais: list, itens_antes: list, itens_depois: list) -> list:
+    """Devolve a ``itens_atuais`` as unidades (e reservas) que saíram entre
+    ``itens_antes`` e ``itens_depois``, lote a lote por ``lot_id``.
+
+    Usado para desfazer uma baixa ou um retorno de condicional já gravados:
+    alterações feitas por outras operações depois são preservadas; lotes que
+    foram removidos voltam.
+    """
+    itens = copiar_lotes(itens_atuais)
+    atuais = {item["lot_id"]: item for item in itens}
+    depois = {item.get("lot_id"): item for item in itens_depois}
+    for antes in itens_antes:
+        apos = depois.get(antes.get("lot_id")) or {}
+        quantidade = antes.get("quantity", 0) - apos.get("quantity", 0)
+        devolvidas = {}
+        for campo in RESERVAS:
+            reservas = contar_reservas(antes.get(campo))
+            for cid, qtd in contar_reservas(apos.get(campo)).items():
+                reservas[cid] = reservas.get(cid, 0) - qtd
+            devolvidas[campo] = {cid: qtd for cid, qtd in reservas.items() if qtd > 0}
+        if quantidade <= 0 and not any(devolvidas.values()):
+            continue
+        atual = atuais.get(antes.get("lot_id"))
+        if atual is None:
+            atual = {**antes, "quantity": 0, **{campo: {} for campo in RESERVAS}}
+            itens.append(atual)
+            atuais[atual["lot_id"]] = atual
+        atual["quantity"] = atual.get("quantity", 0) + max(quantidade, 0)
+        for campo, reservas in devolvidas.items():
+            for cid, qtd in reservas.items():
+                atual[campo][cid] = atual[campo].get(cid, 0) + qtd
+    return itens
+
+def filtro_rev(produto: dict) -> dict:
+    """Filtro de update que só casa se o produto ainda estiver na revisão lida."""
+    if "rev" in produto:
+        return {"_id": produto["_id"], "rev": produto["rev"]}
+    return {"_id": produto["_id"], "rev": {"$exists": False}}
+
+def _contadores_lote(item: dict):
+    """Campos numéricos de um lote (quantidade e reservas), ou None se o lote
+    ainda estiver no formato antigo de reservas."""
+    contadores = {"quantity": item.get("quantity", 0)}
+    for campo in RESERVAS:
+        valor = item.get(campo) or {}
+        if not isinstance(valor, dict):
+            return None
+        for cid, qtd in valor.items():
+            contadores[f"{campo}.{cid}"] = qtd
+    return contadores
+
+def montar_update_itens(itens_antes: list, itens_depois: list):
+    """Monta o update que leva ``itens_antes`` a ``itens_depois``.
+
+    Se os mesmos lotes continuam existindo e só as quantidades (do lote ou das
+    reservas já existentes) mudaram, caso comum de uma venda parcial, gera
+    ``$inc`` por lote via ``arrayFilters``; caso contrário (lotes criados ou
+    removidos, reservas novas ou encerradas) grava o array inteiro.
+    Retorna ``(update, array_filters)``.
+    """
+    reescrever = ({"$set": {"itens": itens_depois}}, None)
+    antes = {item.get("lot_id"): item for item in itens_antes}
+    if None in antes or len(antes) != len(itens_antes) or len(itens_depois) != len(itens_antes):
+        return reescrever
+
+    inc = {}
+    array_filters = []
+    for item in itens_depois:
+        anterior = antes.get(item.get("lot_id"))
+        if anterior is None:
+            return reescrever
+        campos_fixos = (set(item) | set(anterior)) - {"quantity", *RESERVAS}
+        if any(item.get(k) != anterior.get(k) for k in campos_fixos):
+            return reescrever
+        novos, antigos = _contadores_lote(item), _contadores_lote(anterior)
+        if novos is None or antigos is None or novos.keys() != antigos.keys():
+            return reescrever
+        deltas = {campo: novos[campo] - antigos[campo] for campo in novos if novos[campo] != antigos[campo]}
+        if deltas:
+            nome = f"l{len(array_filters)}"
+            for campo, delta in deltas.items():
+                inc[f"itens.$[{nome}].{campo}"] = delta
+            array_filters.append({f"{nome}.lot_id": item["lot_id"]})
+    return ({"$inc": inc} if inc else {}), (array_filters or None)
+
+async def gravar_itens(produto: dict, itens: list, extra_set: dict | None = None, session=None) -> bool:
+    """Grava os lotes do produto junto com contadores, flags e revisão.
+
+    O update só é aplicado se o produto ainda estiver na revisão lida
+    (``filtro_rev``); retorna False quando outra operação o alterou.
+    ``session`` permite gravar dentro de uma transação.
+    """
+    estoque = calcular_estoque(itens)
+    lotes_update, array_filters = montar_update_itens(produto.get("itens", []), itens)
+    update = {
+        "$set": {
+            **estoque,
+            "em_condicional_cliente": estoque["estoque_em_condicional_cliente"] > 0,
+            "em_condicional_fornecedor": estoque["estoque_em_condicional_fornecedor"] > 0,
+            "updated_at": datetime.utcnow(),
+            **(extra_set or {}),
+        },
+        "$inc": {"rev": 1},
+    }
+    for op, campos in lotes_update.items():
+        update[op].update(campos)
+    result = await db.produtos.update_one(filtro_rev(produto), update, array_filters=array_filters, session=session)
+    return result.matched_count == 1
+
+class ProdutoAlterado(Exception):
+    """Outra operação alterou o produto em todas as tentativas de ``alterar_itens``."""
+
+class EstoqueInsuficiente(Exception):
+    """Levantada por ``alterar`` quando o estado relido não permite a operação;
+    ``alterar_itens`` a propaga sem gravar."""
+
+async def alterar_itens(produto_id: str, alterar, tentativas: int = MAX_TENTATIVAS_ITENS):
+    """Lê o produto, aplica ``alterar(itens)`` numa cópia dos lotes e grava com
+    ``gravar_itens``; se outra operação (ex.: uma venda) alterou o produto entre
+    a leitura e a gravação, repete sobre o estado novo.
+
+    ``alterar`` edita a lista in place e pode ser chamada mais de uma vez; para
+    desistir sem gravar, levanta ``EstoqueInsuficiente``.
+    Retorna ``(produto lido, itens gravados)`` ou ``(None, None)`` se o produto
+    não existe; levanta ``ProdutoAlterado`` se esgotar as tentativas.
+    """
+    for _ in range(tentativas):
+        produto = await db.produtos.find_one({"_id": produto_id}, projection=SEM_HISTORICO)
+        if not produto:
+            return None, None
+        itens = copiar_lotes(produto.get("itens", []))
+        alterar(itens)
+        if await gravar_itens(produto, itens):
+            return produto, itens
+    raise ProdutoAlterado(produto_id)
+
+async def desfazer_itens(produto_id: str, itens_antes: list, itens_depois: list) -> bool:
+    """Desfaz (com ``devolver_lotes`` e a mesma checagem de ``rev``) uma alteração
+    de lotes já gravada por ``alterar_itens``. Retorna False se não conseguir."""
+    def devolver(itens):
+        itens[:] = devolver_lotes(itens, itens_antes, itens_depois)
+
+    try:
+        produto, _ = await alterar_itens(produto_id, devolver)
+    except ProdutoAlterado:
+        produto = None
+    if not produto:
+        logging.error("Não foi possível desfazer a alteração dos lotes do produto %s: %s", produto_id, itens_antes)
+        return False
+    return True
+
+async def apagar_produto_gravado(produto: dict) -> bool:
+    """Apaga o produto se ele ainda está na revisão gravada por ``alterar_itens``
+    (ninguém repôs estoque depois)."""
+    result = await db.produtos.delete_one({"_id": produto["_id"], "rev": produto.get("rev", 0) + 1})
+    return result.deleted_count == 1
+
+async def get_estoque(produto_id: str):
+    """Retorna os contadores do produto (None se não existir).
+
+    Produtos ainda sem contadores (anteriores à materialização) são calculados
+    a partir dos itens e gravados, para que a próxima leitura seja direta.
+    """
+    projection = {f: 1 for f in ESTOQUE_FIELDS}
+    produto = await db.produtos.find_one({"_id": produto_id}, projection=projection)
+    if produto is None:
+        return None
+    if all(f in produto for f in ESTOQUE_FIELDS):
+        return {f: produto[f] for f in ESTOQUE_FIELDS}
+    produto = await db.produtos.find_one({"_id": produto_id}, projection={"itens": 1, "rev": 1})
+    if produto is None:
+        return None
+    estoque = calcular_estoque(produto.get("itens", []))
+    # Só grava se ninguém alterou o produto depois da leitura: uma venda no meio
+    # já grava os próprios contadores, que não podem ser sobrescritos
+    await db.produtos.update_one(filtro_rev(produto), {"$set": estoque})
+    return estoque
+
+async def rebuild_estoque_dos_itens(produto_id: str | None = None, apply: bool = True, somente_faltantes: bool = False,
+                                    batch_size: int = 500) -> dict:
+    """Recalcula os contadores a partir dos itens (lotes) de cada produto.
+
+    Não concilia com o histórico de ``entradas``/``saidas``: só corrige
+    contadores que divergem dos lotes, não lotes que divergem do histórico. O
+    histórico não é completo o bastante para isso (lotes de condicional de
+    fornecedor entram sem ``Entrada`` e produtos antigos ainda guardam
+    movimentações embutidas), então os lotes são a fonte da verdade.
+
+    Retorna um resumo com os produtos examinados e os que estavam divergentes.
+    Com ``apply=False`` apenas conta as divergências; ``somente_faltantes``
+    restringe aos produtos que ainda não têm contadores (usado no startup).
+    """
+    query = {"_id": produto_id} if produto_id else {}
+    if somente_faltantes:
+        query["estoque_total"] = {"$exists": False}
+    projection = {"itens": 1, **{f: 1 for f in ESTOQUE_FIELDS}}
+    examinados = 0
+    divergentes = 0
+    ops = []
+    async for produto in db.produtos.find(query, projection=projection, batch_size=batch_size):
+        examinados += 1
+        estoque = calcular_estoque(produto.get("itens", []))
+        if any(produto.get(f) != v for f, v in estoque.items()):
+            divergentes += 1
+            if apply:
+                ops.append(UpdateOne({"_id": produto["_id"]}, {"$set": estoque}))
+        if len(ops) >= batch_size:
+            await db.produtos.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await db.produtos.bulk_write(ops, ordered=False)
+    return {"examinados": examinados, "divergentes": divergentes}
@@ -1,11 +1,7 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from .connection import db
 from pymongo import ReturnDocument
 from ..models.faturamento_item import FaturamentoItem
 from datetime import datetime
-import os
-
-client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
-db = client["projeto_silvana"]
 
 # CRUD para FaturamentoItem
 async def create_faturamento_item(faturamento: FaturamentoItem):
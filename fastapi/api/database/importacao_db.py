@@ -0,0 +1,211 @@
+"""Importação de produtos em lote (CSV ou NDJSON).
+
+O arquivo é lido como fluxo de linhas e processado em blocos de
+``TAMANHO_BLOCO`` registros. Por bloco são feitas: uma consulta ``$in`` dos
+códigos internos já existentes, uma resolução de tags em lote
+(``get_or_create_tags_by_descricoes``), um ``insert_many`` de produtos e um de
+entradas. Linhas inválidas não interrompem a importação: entram no relatório
+com o número da linha e o motivo.
+
+Colunas (CSV com cabeçalho, ou chaves do JSON): codigo_interno, codigo_externo,
+descricao, marca_fornecedor, sessao, preco_custo, preco_venda (centavos),
+quantidade (padrão 1) e tags (separadas por ``|`` no CSV, lista no NDJSON).
+"""
+from pymongo.errors import BulkWriteError
+from pydantic import ValidationError
+import codecs
+import csv
+import json
+import re
+from .connection import db
+from .cache import invalidar_relatorios
+from .tags_db import get_or_create_tags_by_descricoes
+from .produtos_db import preparar_documento_produto
+from ..models.produtos import Produto
+from ..models.itens import Item
+from ..models.entradas import Entrada
+
+TAMANHO_BLOCO = 500
+MAX_ERROS_RELATORIO = 1000
+
+async def linhas_de_bytes(chunks):
+    """Converte um fluxo assíncrono de bytes em linhas de texto (UTF-8, com ou sem BOM)."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    resto = ""
+    async for chunk in chunks:
+        resto += decoder.decode(chunk)
+        *linhas, resto = resto.split("\n")
+        for linha in linhas:
+            yield linha.rstrip("\r")
+    resto += decoder.decode(b"", final=True)
+    if resto:
+        yield resto.rstrip("\r")
+
+async def registros_csv(linhas):
+    """Gera ``(numero_linha, registro | None, erro | None)`` a partir de linhas CSV.
+
+    Campos entre aspas podem conter quebras de linha: a linha só é processada
+    quando as aspas fecham.
+    """
+    cabecalho = None
+    pendente, inicio, numero = "", 0, 0
+    async for linha in linhas:
+        numero += 1
+        pendente = f"{pendente}\n{linha}" if pendente else linha
+        inicio = inicio or numero
+        if pendente.count('"') % 2:
+            continue
+        texto, linha_registro = pendente, inicio
+        pendente, inicio = "", 0
+        if not texto.strip():
+            continue
+        valores = next(csv.reader([texto]))
+        if cabecalho is None:
+            cabecalho = [c.strip() for c in valores]
+            continue
+        if len(valores) > len(cabecalho):
+            yield linha_registro, None, "mais colunas que o cabeçalho"
+            continue
+        yield linha_registro, dict(zip(cabecalho, valores)), None
+    if pendente:
+        yield inicio, None, "aspas não fechadas"
+
+async def registros_ndjson(linhas):
+    numero = 0
+    async for linha in linhas:
+        numero += 1
+        if not linha.strip():
+            continue
+        try:
+            registro = json.loads(linha)
+        except ValueError as e:
+            yield numero, None, f"JSON inválido: {e}"
+            continue
+        if not isinstance(registro, dict):
+            yield numero, None, "cada linha deve ser um objeto JSON"
+            continue
+        yield numero, registro, None
+
+def _inteiro(valor, campo: str, padrao=None) -> int:
+    if valor is None or (isinstance(valor, str) and not valor.strip()):
+        if padrao is None:
+            raise ValueError(f"{campo} é obrigatório")
+        return padrao
+    try:
+        return int(str(valor).strip())
+    except ValueError:
+        raise ValueError(f"{campo} deve ser inteiro (centavos/unidades)")
+
+def validar_registro(registro: dict) -> dict:
+    """Normaliza e valida um registro; levanta ValueError com a mensagem da linha."""
+    tags = registro.get("tags") or []
+    if isinstance(tags, str):
+        tags = [t.strip() for t in tags.split("|") if t.strip()]
+    for tag in tags:
+        if re.search(r"\s", str(tag).strip()):
+            raise ValueError(f"tag '{tag}' não pode conter espaços")
+    quantidade = _inteiro(registro.get("quantidade"), "quantidade", padrao=1)
+    if quantidade < 0:
+        raise ValueError("quantidade não pode ser negativa")
+    try:
+        produto = Produto(
+            codigo_interno=str(registro.get("codigo_interno") or "").strip(),
+            codigo_externo=str(registro.get("codigo_externo") or "").strip(),
+            descricao=str(registro.get("descricao") or "").strip(),
+            marca_fornecedor=str(registro.get("marca_fornecedor") or "").strip(),
+            sessao=str(registro.get("sessao") or "").strip(),
+            preco_custo=_inteiro(registro.get("preco_custo"), "preco_custo"),
+            preco_venda=_inteiro(registro.get("preco_venda"), "preco_venda"),
+            itens=[Item(quantity=quantidade)] if quantidade else [],
+            tags=[],
+        )
+    except ValidationError as e:
+        raise ValueError("; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+    if not produto.codigo_interno:
+        raise ValueError("codigo_interno é obrigatório")
+    if not produto.descricao:
+        raise ValueError("descricao é obrigatória")
+    return {"produto": produto, "tags": tags}
+
+def _erro(relatorio: dict, numero: int, codigo, mensagem: str):
+    relatorio["erros_total"] += 1
+    if len(relatorio["erros"]) < MAX_ERROS_RELATORIO:
+        relatorio["erros"].append({"linha": numero, "codigo_interno": codigo, "erro": mensagem})
+
+async def _importar_bloco(bloco: list, vistos: set, apply: bool, relatorio: dict):
+    # códigos repetidos no arquivo ou já cadastrados
+    codigos = [linha["produto"].codigo_interno for _, linha in bloco]
+    cursor = db.produtos.find({"codigo_interno": {"$in": codigos}}, projection={"codigo_interno": 1})
+    existentes = {p["codigo_interno"] async for p in cursor}
+    validos = []
+    for numero, linha in bloco:
+        codigo = linha["produto"].codigo_interno
+        if codigo in existentes:
+            _erro(relatorio, numero, codigo, "codigo_interno already exists")
+        elif codigo in vistos:
+            _erro(relatorio, numero, codigo, "codigo_interno repetido no arquivo")
+        else:
+            vistos.add(codigo)
+            validos.append((numero, linha))
+    if not validos:
+        return
+    if not apply:
+        relatorio["importados"] += len(validos)
+        return
+
+    tags = await get_or_create_tags_by_descricoes(t for _, linha in validos for t in linha["tags"])
+    docs = []
+    for _, linha in validos:
+        tags_produto = []
+        for descricao in linha["tags"]:
+            tag = tags.get(str(descricao).strip().lower())
+            if tag and all(t["_id"] != tag["_id"] for t in tags_produto):
+                tags_produto.append({"_id": tag["_id"], "descricao": tag["descricao"]})
+        docs.append(preparar_documento_produto(linha["produto"].dict(by_alias=True), tags_produto))
+
+    falhas = {}
+    try:
+        await db.produtos.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # ex.: código cadastrado por outra requisição entre a checagem e o insert
+        falhas = {w["index"]: w.get("errmsg", "erro ao inserir") for w in e.details.get("writeErrors", [])}
+    entradas = []
+    for indice, ((numero, linha), doc) in enumerate(zip(validos, docs)):
+        if indice in falhas:
+            _erro(relatorio, numero, linha["produto"].codigo_interno,
+                  "codigo_interno already exists" if "duplicate key" in falhas[indice] else falhas[indice])
+            continue
+        relatorio["importados"] += 1
+        for item in doc.get("itens", []):
+            if item.get("quantity", 0) > 0:
+                entradas.append(Entrada(produtos_id=doc["_id"], quantidade=item["quantity"], tipo="compra").dict(by_alias=True))
+    if entradas:
+        await db.entradas.insert_many(entradas, ordered=False)
+
+async def importar_produtos(registros, apply: bool = True, tamanho_bloco: int = TAMANHO_BLOCO) -> dict:
+    """Importa os registros de ``registros_csv``/``registros_ndjson``.
+
+    Com ``apply=False`` apenas valida (inclusive códigos já cadastrados) sem
+    gravar nada. Retorna ``{"linhas", "importados", "erros_total", "erros"}``
+    (``erros`` limitado a ``MAX_ERROS_RELATORIO`` itens).
+    """
+    relatorio = {"linhas": 0, "importados": 0, "erros_total": 0, "erros": []}
+    vistos = set()
+    bloco = []
+    async for numero, registro, falha in registros:
+        relatorio["linhas"] += 1
+        if falha is None:
+            try:
+                bloco.append((numero, validar_registro(registro)))
+            except ValueError as e:
+                falha = str(e)
+        if falha is not None:
+            _erro(relatorio, numero, (registro or {}).get("codigo_interno"), falha)
+        if len(bloco) >= tamanho_bloco:
+            await _importar_bloco(bloco, vistos, apply, relatorio)
+            bloco = []
+    if bloco:
+        await _importar_bloco(bloco, vistos, apply, relatorio)
+    if apply and relatorio["importados"]:
+        await invalidar_relatorios()
+    return relatorio
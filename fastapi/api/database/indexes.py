@@ -0,0 +1,169 @@
+"""Registro central de índices.
+
+``INDEXES`` declara, por coleção, todos os índices que as consultas da API
+precisam; ``ensure_indexes`` cria os que faltarem (idempotente, chamado em
+background no startup). ``QUERY_SHAPES`` lista os formatos de consulta
+"quentes" e ``verify_query_shapes`` roda ``explain()`` em cada um para apontar
+planos com COLLSCAN (ver ``scripts/check_indexes.py``).
+"""
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from .connection import get_db
+from datetime import datetime
+import logging
+import re
+
+INDEXES: dict[str, list[IndexModel]] = {
+    "produtos": [
+        IndexModel([("codigo_interno", ASCENDING)], unique=True),
+        IndexModel([("tags._id", ASCENDING)]),
+        # (created_at, _id): ordem e cursor da listagem de produtos
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("estoque_total", ASCENDING)]),
+        # busca: faixa por termos, ordenada por (descricao_norm, _id) no próprio índice
+        IndexModel([("termos_busca", ASCENDING), ("descricao_norm", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("codigo_interno_norm", ASCENDING)]),
+        IndexModel([("codigo_externo_norm", ASCENDING)]),
+    ],
+    "tags": [
+        IndexModel([("descricao_case_insensitive", ASCENDING)], unique=True),
+    ],
+    "saidas": [
+        IndexModel([("tipo", ASCENDING), ("data_saida", DESCENDING)]),
+        IndexModel([("produtos_id", ASCENDING), ("tipo", ASCENDING)]),
+        IndexModel([("cliente_id", ASCENDING), ("data_saida", DESCENDING)]),
+        IndexModel([("condicional_fornecedor_id", ASCENDING), ("tipo", ASCENDING)]),
+        IndexModel([("venda_id", ASCENDING)], sparse=True),
+    ],
+    "vendas": [
+        IndexModel([("data_venda", DESCENDING)]),
+        IndexModel([("cliente_id", ASCENDING), ("data_venda", DESCENDING)]),
+    ],
+    # _id no fim: desempate da ordenação e da paginação por cursor
+    "vendas_view": [
+        IndexModel([("data_saida", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("valor_total", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("cliente_id", ASCENDING), ("data_saida", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("produtos_id", ASCENDING), ("data_saida", DESCENDING), ("_id", DESCENDING)]),
+    ],
+    "entradas": [
+        IndexModel([("produtos_id", ASCENDING), ("data_entrada", DESCENDING), ("_id", DESCENDING)]),
+    ],
+    "condicional_clientes": [
+        IndexModel([("ativa", ASCENDING), ("data_condicional", DESCENDING)]),
+        IndexModel([("cliente_id", ASCENDING), ("ativa", ASCENDING)]),
+        IndexModel([("produtos.produto_id", ASCENDING), ("ativa", ASCENDING)]),
+    ],
+    "condicional_fornecedores": [
+        IndexModel([("produtos_id", ASCENDING), ("ativa", ASCENDING)]),
+        IndexModel([("fornecedor_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+    ],
+    "vendas_rollup": [
+        IndexModel([("dimensao", ASCENDING), ("tipo", ASCENDING), ("dia", ASCENDING)]),
+    ],
+    "report_cache": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "users": [
+        IndexModel([("email", ASCENDING)]),
+    ],
+    "despesas": [
+        IndexModel([("data_despesa", DESCENDING)]),
+    ],
+}
+
+# Formatos das consultas quentes (valores são apenas exemplos para o explain)
+QUERY_SHAPES = [
+    {"nome": "vendas por periodo", "colecao": "saidas",
+     "filtro": {"tipo": "venda", "data_saida": {"$gte": datetime(2000, 1, 1)}}, "sort": [("data_saida", DESCENDING)]},
+    {"nome": "listagem de vendas", "colecao": "vendas_view",
+     "filtro": {"data_saida": {"$gte": datetime(2000, 1, 1)}}, "sort": [("data_saida", DESCENDING), ("_id", DESCENDING)]},
+    {"nome": "listagem de vendas por valor", "colecao": "vendas_view",
+     "filtro": {"valor_total": {"$lt": 10000}}, "sort": [("valor_total", DESCENDING), ("_id", DESCENDING)]},
+    {"nome": "listagem de vendas do cliente", "colecao": "vendas_view",
+     "filtro": {"cliente_id": "x"}, "sort": [("data_saida", DESCENDING), ("_id", DESCENDING)]},
+    {"nome": "saidas por produto", "colecao": "saidas", "filtro": {"produtos_id": "x"}},
+    {"nome": "vendas por cliente", "colecao": "saidas",
+     "filtro": {"cliente_id": "x"}, "sort": [("data_saida", DESCENDING)]},
+    {"nome": "saidas por condicional fornecedor", "colecao": "saidas",
+     "filtro": {"condicional_fornecedor_id": "x", "tipo": "venda"}},
+    {"nome": "saidas por venda (carrinho)", "colecao": "saidas", "filtro": {"venda_id": "x"}},
+    {"nome": "entradas por produto", "colecao": "entradas",
+     "filtro": {"produtos_id": "x"}, "sort": [("data_entrada", DESCENDING), ("_id", DESCENDING)]},
+    {"nome": "condicionais cliente ativas", "colecao": "condicional_clientes", "filtro": {"ativa": True}},
+    {"nome": "condicionais por cliente", "colecao": "condicional_clientes",
+     "filtro": {"cliente_id": "x", "ativa": True}},
+    {"nome": "condicionais cliente por produto", "colecao": "condicional_clientes",
+     "filtro": {"produtos.produto_id": "x", "ativa": True}},
+    {"nome": "condicional fornecedor por produto", "colecao": "condicional_fornecedores",
+     "filtro": {"produtos_id": "x", "ativa": True}},
+    {"nome": "condicionais por fornecedor", "colecao": "condicional_fornecedores",
+     "filtro": {"fornecedor_id": "x"}, "sort": [("created_at", DESCENDING)]},
+    {"nome": "produtos por tag", "colecao": "produtos", "filtro": {"tags._id": {"$in": ["x"]}}},
+    {"nome": "produtos com estoque baixo", "colecao": "produtos", "filtro": {"estoque_total": {"$lt": 5}}},
+    {"nome": "busca de produtos por prefixo", "colecao": "produtos", "filtro": {"termos_busca": {"$all": [re.compile("^vest")]}},
+     "sort": [("descricao_norm", ASCENDING), ("_id", ASCENDING)]},
+    {"nome": "busca de produtos por palavra inteira", "colecao": "produtos", "filtro": {"termos_busca": {"$all": ["vestido"]}},
+     "sort": [("descricao_norm", ASCENDING), ("_id", ASCENDING)]},
+    {"nome": "produto por codigo normalizado", "colecao": "produtos", "filtro": {"codigo_externo_norm": "x"}},
+    {"nome": "produto por codigo_interno", "colecao": "produtos", "filtro": {"codigo_interno": "x"}},
+    {"nome": "tag por descricao", "colecao": "tags", "filtro": {"descricao_case_insensitive": "x"}},
+    {"nome": "rollup de vendas por dia", "colecao": "vendas_rollup",
+     "filtro": {"dimensao": "total", "tipo": "venda", "dia": {"$gte": datetime(2000, 1, 1)}}},
+    {"nome": "usuario por email", "colecao": "users", "filtro": {"email": "x"}},
+]
+
+
+async def ensure_indexes(database=None) -> dict:
+    """Cria os índices declarados em ``INDEXES``.
+
+    ``create_indexes`` é idempotente para índices já existentes; falhas (ex.:
+    duplicatas impedindo um índice único) são registradas por índice sem
+    interromper os demais.
+    """
+    database = database if database is not None else get_db()
+    result = {"criados": [], "falhas": []}
+    for colecao, modelos in INDEXES.items():
+        for modelo in modelos:
+            nome = modelo.document["name"]
+            try:
+                await database[colecao].create_indexes([modelo])
+                result["criados"].append(f"{colecao}.{nome}")
+            except Exception as e:
+                logging.warning("Falha ao criar índice %s.%s: %s", colecao, nome, e)
+                result["falhas"].append({"indice": f"{colecao}.{nome}", "erro": str(e)})
+    logging.info("Índices garantidos: %d ok, %d falhas", len(result["criados"]), len(result["falhas"]))
+    return result
+
+
+def _plan_stages(plan) -> list[str]:
+    """Lista os estágios de um plano (winningPlan) percorrendo-o recursivamente."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_plan_stages(value))
+    return stages
+
+
+async def verify_query_shapes(database=None) -> list[dict]:
+    """Roda ``explain()`` em cada formato de ``QUERY_SHAPES`` e marca os COLLSCAN."""
+    database = database if database is not None else get_db()
+    report = []
+    for shape in QUERY_SHAPES:
+        cursor = database[shape["colecao"]].find(shape["filtro"])
+        if shape.get("sort"):
+            cursor = cursor.sort(shape["sort"])
+        explain = await cursor.explain()
+        stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        report.append({
+            "nome": shape["nome"],
+            "colecao": shape["colecao"],
+            "estagios": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return report
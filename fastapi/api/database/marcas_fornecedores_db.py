@@ -1,10 +1,6 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from .connection import db
 from pymongo import ReturnDocument
 from ..models.marcas_fornecedores import MarcaFornecedor
-import os
-
-client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
-db = client["projeto_silvana"]
 
 # CRUD para MarcaFornecedor
 async def create_marca_fornecedor(marca: MarcaFornecedor):
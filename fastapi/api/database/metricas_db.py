@@ -0,0 +1,70 @@
+"""Contadores de condicionais e meios de pagamento mantidos incrementalmente.
+
+``metricas_mensais`` guarda um documento por mês (``_id`` = ``"AAAA-MM"``) com
+as peças enviadas, vendidas e devolvidas em condicionais de cliente, as
+condicionais encerradas e as taxas de meios de pagamento. O documento
+``"global"`` guarda as peças atualmente fora em condicional. Os contadores são
+incrementados por quem envia, processa o retorno ou fatura uma venda, e o
+dashboard os lê em O(1).
+"""
+from datetime import datetime
+from .connection import db
+
+GLOBAL_ID = "global"
+
+def mes_id(data: datetime | None = None) -> str:
+    data = data or datetime.utcnow()
+    return f"{data.year:04d}-{data.month:02d}"
+
+async def incrementar_metricas(data: datetime | None = None, **campos):
+    """Soma ``campos`` (ex.: ``pecas_vendidas=2``) no documento do mês de ``data``."""
+    inc = {campo: valor for campo, valor in campos.items() if valor}
+    if not inc:
+        return
+    await db.metricas_mensais.update_one(
+        {"_id": mes_id(data)},
+        {"$inc": inc, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+async def _calcular_pecas_em_condicional() -> int:
+    docs = await db.produtos.aggregate([
+        {"$group": {"_id": None, "total": {"$sum": "$estoque_em_condicional_cliente"}}}
+    ]).to_list(None)
+    return docs[0]["total"] if docs else 0
+
+async def incrementar_pecas_em_condicional(quantidade: int):
+    """Ajusta as peças atualmente em condicional de cliente (+ envio, - retorno)."""
+    if not quantidade:
+        return
+    if not await db.metricas_mensais.find_one({"_id": GLOBAL_ID}, projection={"_id": 1}):
+        # primeiro uso: parte do valor atual dos produtos (já inclui esta movimentação)
+        await get_pecas_em_condicional()
+        return
+    await db.metricas_mensais.update_one({"_id": GLOBAL_ID}, {"$inc": {"pecas_em_condicional": quantidade}})
+
+async def get_pecas_em_condicional() -> int:
+    """Peças atualmente em condicional; calculado a partir dos produtos e gravado na primeira leitura."""
+    doc = await db.metricas_mensais.find_one({"_id": GLOBAL_ID})
+    if doc is not None:
+        return doc.get("pecas_em_condicional", 0)
+    total = await _calcular_pecas_em_condicional()
+    await db.metricas_mensais.update_one(
+        {"_id": GLOBAL_ID}, {"$setOnInsert": {"pecas_em_condicional": total}}, upsert=True
+    )
+    return total
+
+async def get_metricas_mes(data: datetime | None = None) -> dict:
+    return await db.metricas_mensais.find_one({"_id": mes_id(data)}) or {}
+
+def resumo_conversao(metricas: dict) -> dict:
+    """Indicadores de conversão do mês a partir dos contadores."""
+    vendidas = metricas.get("pecas_vendidas", 0)
+    devolvidas = metricas.get("pecas_devolvidas", 0)
+    encerradas = metricas.get("condicionais_encerradas", 0)
+    retornadas = vendidas + devolvidas
+    return {
+        "percentual_conversao": round(vendidas / retornadas * 100, 1) if retornadas else 0.0,
+        "pecas_devolvidas_por_condicional": round(devolvidas / encerradas, 1) if encerradas else 0.0,
+        "taxas_meios_pagamento": metricas.get("taxas_meios_pagamento", 0),
+    }
@@ -1,10 +1,6 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from .connection import db
 from pymongo import ReturnDocument
 from ..models.modalidade_pagamento import ModalidadePagamento
-import os
-
-client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
-db = client["projeto_silvana"]
 
 # CRUD para ModalidadePagamento
 async def create_modalidade_pagamento(modalidade: ModalidadePagamento):
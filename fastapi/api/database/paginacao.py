@@ -0,0 +1,47 @@
+"""Paginação por cursor (keyset) compartilhada pelas listagens.
+
+A ordenação é sempre ``{campo: ordem, _id: ordem}``; o cursor guarda o valor do
+campo e o ``_id`` do último documento entregue e a página seguinte começa logo
+depois dele, sem ``$skip``.
+"""
+from datetime import datetime
+from fastapi import HTTPException
+import base64
+import json
+
+def encode_cursor(sort_field: str, sort_order: int, doc: dict) -> str:
+    """Token opaco com a posição (valor do campo de ordenação, _id) do último documento da página."""
+    valor = doc.get(sort_field)
+    if isinstance(valor, datetime):
+        valor = {"$date": valor.isoformat()}
+    payload = json.dumps([sort_field, sort_order, valor, doc["_id"]])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort_field: str, sort_order: int) -> tuple:
+    """Retorna (valor, _id) do token; 400 se inválido ou de outra ordenação."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        campo, ordem, valor, ultimo_id = json.loads(payload)
+        if isinstance(valor, dict):
+            valor = datetime.fromisoformat(valor["$date"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="cursor inválido")
+    if (campo, ordem) != (sort_field, sort_order):
+        raise HTTPException(status_code=400, detail="cursor gerado para outra ordenação")
+    return valor, ultimo_id
+
+def filtro_apos_cursor(sort_field: str, sort_order: int, valor, ultimo_id) -> dict:
+    """Condição keyset: documentos depois de (valor, _id) na ordem {campo, _id}.
+
+    Nulos ficam antes de qualquer valor na ordenação do MongoDB, mas comparações
+    $lt/$gt não os alcançam, então são tratados à parte (ex.: valor_total ausente).
+    """
+    op = "$lt" if sort_order == -1 else "$gt"
+    if valor is None:
+        if sort_order == -1:
+            return {sort_field: None, "_id": {op: ultimo_id}}
+        return {"$or": [{sort_field: {"$ne": None}}, {sort_field: None, "_id": {op: ultimo_id}}]}
+    condicoes = [{sort_field: {op: valor}}, {sort_field: valor, "_id": {op: ultimo_id}}]
+    if sort_order == -1:
+        condicoes.append({sort_field: None})
+    return {"$or": condicoes}
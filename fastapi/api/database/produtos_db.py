@@ -1,15 +1,34 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from .connection import db
 from pymongo import ReturnDocument
 from ..models.produtos import Produto
-import os
 import logging
 from ..database.tags_db import get_or_create_tag_by_descricao, get_tag_by_id
-from ..database.entradas_db import create_entrada, get_entrada_by_id
+from ..database.entradas_db import create_entrada
+from .estoque_db import ESTOQUE_FIELDS, SEM_HISTORICO, calcular_estoque, normalizar_lotes, reservado
+from .vendas_view_db import propagar_produto
+from .cache import invalidar_relatorios
+from .busca_db import PROJECAO_RESUMO, afeta_busca, buscar_produtos, campos_busca, filtro_termos
+from .paginacao import encode_cursor, decode_cursor, filtro_apos_cursor
 from bson import ObjectId
 from datetime import datetime
 
-client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
-db = client["projeto_silvana"]
+def preparar_documento_produto(doc: dict, tags: list) -> dict:
+    """Completa o documento de um produto novo: tags normalizadas, flags de
+    condicional, contadores de estoque e campos de busca (sem histórico embutido)."""
+    doc['tags'] = tags
+    doc['created_at'] = datetime.utcnow()
+    # o histórico fica nas coleções entradas/saidas, não no documento do produto
+    doc.pop('entradas', None)
+    doc.pop('saidas', None)
+
+    # Ensure conditional flags reflect items - MUST set after dict() to override Pydantic defaults
+    has_cond_fornecedor = any((itm.get("condicionais_fornecedor") and len(itm.get("condicionais_fornecedor")) > 0) for itm in doc.get("itens", []))
+    has_cond_cliente = any((itm.get("condicionais_cliente") and len(itm.get("condicionais_cliente")) > 0) for itm in doc.get("itens", []))
+    doc['em_condicional_fornecedor'] = bool(has_cond_fornecedor)
+    doc['em_condicional_cliente'] = bool(has_cond_cliente)
+    doc.update(calcular_estoque(doc.get('itens', [])))
+    doc.update(campos_busca(doc))
+    return doc
 
 # CRUD para Produto
 async def create_produto(produto: Produto):
@@ -44,17 +63,9 @@ async def create_produto(produto: Produto):
         default_item_added = True
 
     # Convert to dict AFTER modifying produto object
-    doc = produto.dict(by_alias=True)
-    doc['tags'] = normalized_tags
-    doc['created_at'] = datetime.utcnow()
+    doc = preparar_documento_produto(produto.dict(by_alias=True), normalized_tags)
 
-    # Ensure conditional flags reflect items - MUST set after dict() to override Pydantic defaults
-    has_cond_fornecedor = any((itm.get("condicionais_fornecedor") and len(itm.get("condicionais_fornecedor")) > 0) for itm in doc.get("itens", []))
-    has_cond_cliente = any((itm.get("condicionais_cliente") and len(itm.get("condicionais_cliente")) > 0) for itm in doc.get("itens", []))
-    doc['em_condicional_fornecedor'] = bool(has_cond_fornecedor)
-    doc['em_condicional_cliente'] = bool(has_cond_cliente)
-
-    logging.info(f"Creating produto {doc.get('codigo_interno')}: has_cond_fornecedor={has_cond_fornecedor}, em_condicional_fornecedor={doc['em_condicional_fornecedor']}, itens={doc.get('itens')}")
+    logging.info(f"Creating produto {doc.get('codigo_interno')}: em_condicional_fornecedor={doc['em_condicional_fornecedor']}, itens={doc.get('itens')}")
 
     # Insert product
     result = await db.produtos.insert_one(doc)
@@ -64,11 +75,7 @@ async def create_produto(produto: Produto):
     if default_item_added:
         from ..models.entradas import Entrada as EntradaModel
         entrada_obj = EntradaModel(produtos_id=produto_id, quantidade=default_item.quantity, tipo='compra')
-        entrada_id = await create_entrada(entrada_obj)
-        # fetch the entrada to append to produto document
-        entrada_doc = await get_entrada_by_id(entrada_id)
-        if entrada_doc:
-            await db.produtos.update_one({"_id": produto_id}, {"$push": {"entradas": entrada_doc}})
+        await create_entrada(entrada_obj)
 
     # If explicit items were provided, create entradas for each item so stock is recorded in the entradas collection
     if doc.get('itens'):
@@ -79,22 +86,79 @@ async def create_produto(produto: Produto):
                 if qty <= 0:
                     continue
                 entrada_obj = EntradaModel(produtos_id=produto_id, quantidade=qty, tipo='compra')
-                entrada_id = await create_entrada(entrada_obj)
-                entrada_doc = await get_entrada_by_id(entrada_id)
-                if entrada_doc:
-                    await db.produtos.update_one({"_id": produto_id}, {"$push": {"entradas": entrada_doc}})
+                await create_entrada(entrada_obj)
         except Exception:
             # don't block creation if entradas fail; log
             import traceback
             traceback.print_exc()
 
+    # estoque baixo, desempenho e dashboard leem os produtos
+    await invalidar_relatorios()
     return produto_id
 
-async def get_produtos():
-    return await db.produtos.find().to_list(None)
+# Campos que nunca vão na listagem: histórico embutido e campos derivados da busca
+PROJECAO_LISTAGEM = {"entradas": 0, "saidas": 0, "termos_busca": 0, "descricao_norm": 0, "codigo_interno_norm": 0,
+                     "codigo_externo_norm": 0}
+
+def filtro_produtos(q: str | None = None, ativo: bool | None = None, sessao: str | None = None,
+                    marca_fornecedor: str | None = None, em_condicional_fornecedor: bool | None = None,
+                    em_condicional_cliente: bool | None = None, com_estoque: bool | None = None) -> dict:
+    query = {}
+    if q:
+        query.update(filtro_termos(q) or {})
+    if ativo is not None:
+        # produtos antigos não têm o campo e são considerados ativos
+        query["ativo"] = {"$ne": False} if ativo else False
+    if sessao:
+        query["sessao"] = sessao
+    if marca_fornecedor:
+        query["marca_fornecedor"] = marca_fornecedor
+    if em_condicional_fornecedor is not None:
+        query["em_condicional_fornecedor"] = em_condicional_fornecedor
+    if em_condicional_cliente is not None:
+        query["em_condicional_cliente"] = em_condicional_cliente
+    if com_estoque is not None:
+        query["estoque_total"] = {"$gt": 0} if com_estoque else {"$lte": 0}
+    return query
+
+def projecao_produtos(fields: str | None = None, resumo: bool = False) -> dict:
+    """``fields`` (lista separada por vírgula) > ``resumo`` > todos os campos menos ``PROJECAO_LISTAGEM``."""
+    campos = [f.strip() for f in (fields or '').split(',') if f.strip()]
+    if campos:
+        # created_at é a chave do cursor
+        return {**{c: 1 for c in campos if c not in PROJECAO_LISTAGEM}, "created_at": 1}
+    if resumo:
+        return {**PROJECAO_RESUMO, "created_at": 1}
+    return PROJECAO_LISTAGEM
+
+async def get_produtos(cursor: str | None = None, limit: int = 50, fields: str | None = None, resumo: bool = False,
+                       todos: bool = False, **filtros):
+    """Lista produtos com filtros (ver ``filtro_produtos``) e projeção.
+
+    Pagina por ``(created_at, _id)``, mais recentes primeiro: sem ``cursor``
+    retorna a primeira página, depois o ``next_cursor`` recebido; retorna
+    ``{"items", "next_cursor"}``. ``todos=True`` devolve a lista completa
+    (exportações/integrações que precisam do catálogo inteiro).
+    """
+    query = filtro_produtos(**filtros)
+    projection = projecao_produtos(fields, resumo)
+    if todos:
+        return await db.produtos.find(query, projection=projection).to_list(None)
+
+    limit = max(1, min(limit, 200))
+    if cursor:
+        query = {"$and": [query, filtro_apos_cursor("created_at", -1, *decode_cursor(cursor, "created_at", -1))]}
+    items = await db.produtos.find(query, projection=projection).sort(
+        [("created_at", -1), ("_id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor("created_at", -1, items[-1])
+    return {"items": items, "next_cursor": next_cursor}
 
 async def get_produto_by_id(produto_id: str):
-    return await db.produtos.find_one({"_id": produto_id})
+    return await db.produtos.find_one({"_id": produto_id}, projection=SEM_HISTORICO)
 
 async def update_produto(produto_id: str, update_data: dict):
     # If tags are provided, normalize them like in create_produto
@@ -119,45 +183,59 @@ async def update_produto(produto_id: str, update_data: dict):
                     normalized_tags.append({'_id': tag_doc['_id'], 'descricao': tag_doc['descricao']})
         update_data['tags'] = normalized_tags
 
+    # Contadores de estoque são derivados dos itens, a revisão é controlada pelo
+    # servidor e o histórico vive nas próprias coleções; nunca aceitos do cliente
+    for field in (*ESTOQUE_FIELDS, 'rev', 'entradas', 'saidas'):
+        update_data.pop(field, None)
+
     # If items are being updated, compute delta and create entrada for added quantity
     if update_data.get('itens') is not None:
+        normalizar_lotes(update_data['itens'])
         try:
-            current = await db.produtos.find_one({"_id": produto_id})
+            current = await db.produtos.find_one({"_id": produto_id}, projection=SEM_HISTORICO)
             old_total = sum((i.get('quantity', 0) for i in current.get('itens', []))) if current else 0
             new_total = sum((i.get('quantity', 0) for i in update_data.get('itens', [])))
             delta = int(new_total) - int(old_total)
             if delta > 0:
                 from ..models.entradas import Entrada as EntradaModel
                 entrada_obj = EntradaModel(produtos_id=produto_id, quantidade=delta, tipo='compra')
-                entrada_id = await create_entrada(entrada_obj)
-                entrada_doc = await get_entrada_by_id(entrada_id)
-                if entrada_doc:
-                    await db.produtos.update_one({"_id": produto_id}, {"$push": {"entradas": entrada_doc}})
+                await create_entrada(entrada_obj)
 
             # Update em_condicional flags based on new items array
             has_cond_fornecedor = any((itm.get("condicionais_fornecedor") and len(itm.get("condicionais_fornecedor")) > 0) for itm in update_data.get("itens", []))
             has_cond_cliente = any((itm.get("condicionais_cliente") and len(itm.get("condicionais_cliente")) > 0) for itm in update_data.get("itens", []))
             update_data['em_condicional_fornecedor'] = bool(has_cond_fornecedor)
             update_data['em_condicional_cliente'] = bool(has_cond_cliente)
+            update_data.update(calcular_estoque(update_data.get('itens', [])))
 
         except Exception:
             import traceback
             traceback.print_exc()
 
     update_data['updated_at'] = datetime.utcnow()
-    return await db.produtos.find_one_and_update(
-        {"_id": produto_id}, {"$set": update_data}, return_document=ReturnDocument.AFTER
+    produto = await db.produtos.find_one_and_update(
+        {"_id": produto_id}, {"$set": update_data, "$inc": {"rev": 1}}, return_document=ReturnDocument.AFTER
     )
+    if produto and afeta_busca(update_data):
+        termos = campos_busca(produto)
+        await db.produtos.update_one({"_id": produto_id}, {"$set": termos})
+        produto.update(termos)
+    # descrição/código/preço são exibidos nas listagens de vendas
+    propagar_produto(produto, update_data)
+    await invalidar_relatorios()
+    return produto
 
 async def delete_produto(produto_id: str):
-    return await db.produtos.delete_one({"_id": produto_id})
+    result = await db.produtos.delete_one({"_id": produto_id})
+    await invalidar_relatorios()
+    return result
 
 async def can_delete_produto(produto_id: str):
     produto = await db.produtos.find_one({"_id": produto_id}, projection={"itens": 1})
     if produto is None:
         return None
-    total_cond_fornecedor = sum(len(it.get("condicionais_fornecedor") or []) for it in produto.get("itens", []))
-    total_cond_cliente = sum(len(it.get("condicionais_cliente") or []) for it in produto.get("itens", []))
+    total_cond_fornecedor = sum(reservado(it, "condicionais_fornecedor") for it in produto.get("itens", []))
+    total_cond_cliente = sum(reservado(it, "condicionais_cliente") for it in produto.get("itens", []))
 
     # Além de checks nos itens, verificar se existe alguma condicional_fornecedor referenciando este produto
     condicional_ref = await db.condicional_fornecedores.find_one({"produtos_id": produto_id, "ativa": True})
@@ -228,19 +306,10 @@ async def get_produtos_by_tags(tag_ids: list, mode: str = 'OR'):
     ]
     return await db.produtos.aggregate(pipeline).to_list(None)
 
-# Busca por texto (descrição)
-async def search_produtos(query: str):
-    regex = {"$regex": query, "$options": "i"}
-    return await db.produtos.find({
-        "$or": [
-            {"codigo_externo": regex},
-            {"marca_fornecedor": regex},
-            {"sessao": regex},
-            {"codigo_interno": regex},
-            {"descricao": regex},
-            {"tags.descricao": regex}
-        ]
-    }).to_list(None)
+# Busca por texto (código, descrição, tags, marca, sessão) via termos indexados
+async def search_produtos(query: str, limit: int = 50):
+    result = await buscar_produtos(query, limit=limit)
+    return result["items"]
 
 # Verifica existência de código interno
 async def exists_codigo_interno(codigo_interno: str, exclude_id: str | None = None):
@@ -0,0 +1,159 @@
+"""Totais diários de saídas (``vendas_rollup``), mantidos incrementalmente.
+
+Cada documento soma ``count``, ``quantidade`` e ``valor_total`` das saídas de um
+dia e ``tipo`` numa dimensão: ``total`` (todas as saídas) ou por ``tag``,
+``marca_fornecedor`` e ``sessao`` do produto (snapshot gravado na saída). Todo
+caminho que grava ou apaga saídas chama ``registrar_saidas`` (e, ao lado dele,
+``saidas_hook.apos_gravar_saidas`` para cache e view); os relatórios leem os
+rollups, então o custo depende dos dias exibidos e não do número de vendas.
+``rebuild_rollup`` recalcula tudo a partir de ``saidas`` e grava documentos
+absolutos (não ``$inc``), então pode ser repetido sem duplicar totais; no
+startup roda sob uma trava em ``startup_locks`` para que só um worker o faça.
+"""
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+import logging
+from .connection import db
+
+DIMENSAO_TOTAL = "total"
+
+def dia_da_saida(data: datetime) -> datetime:
+    return datetime(data.year, data.month, data.day)
+
+def chaves_rollup(saida: dict) -> list[tuple]:
+    """Chaves ``(dia, tipo, dimensao, valor)`` que uma saída alimenta."""
+    data = saida.get("data_saida") or datetime.utcnow()
+    base = (dia_da_saida(data), saida.get("tipo"))
+    chaves = [(*base, DIMENSAO_TOTAL, None)]
+    produto = saida.get("produto") or {}
+    for tag in produto.get("tags") or []:
+        tag_id = tag.get("_id") if isinstance(tag, dict) else tag
+        if tag_id:
+            chaves.append((*base, "tag", tag_id))
+    for dimensao in ("marca_fornecedor", "sessao"):
+        if produto.get(dimensao):
+            chaves.append((*base, dimensao, produto[dimensao]))
+    return chaves
+
+def acumular_rollup(saidas: list[dict], sinal: int = 1, acumulado: dict | None = None) -> dict:
+    """Soma as saídas por chave: {chave: {"count", "quantidade", "valor_total"}}."""
+    acumulado = acumulado if acumulado is not None else {}
+    for saida in saidas:
+        for chave in chaves_rollup(saida):
+            totais = acumulado.setdefault(chave, {"count": 0, "quantidade": 0, "valor_total": 0})
+            totais["count"] += sinal
+            totais["quantidade"] += sinal * (saida.get("quantidade") or 0)
+            totais["valor_total"] += sinal * (saida.get("valor_total") or 0)
+    return acumulado
+
+def _rollup_id(chave: tuple) -> str:
+    dia, tipo, dimensao, valor = chave
+    return f"{dia:%Y-%m-%d}|{tipo}|{dimensao}|{valor or ''}"
+
+def montar_ops_rollup(acumulado: dict) -> list[UpdateOne]:
+    ops = []
+    for chave, totais in acumulado.items():
+        dia, tipo, dimensao, valor = chave
+        ops.append(UpdateOne(
+            {"_id": _rollup_id(chave)},
+            {
+                "$inc": totais,
+                "$setOnInsert": {"dia": dia, "tipo": tipo, "dimensao": dimensao, "valor": valor},
+                "$set": {"updated_at": datetime.utcnow()},
+            },
+            upsert=True,
+        ))
+    return ops
+
+async def registrar_saidas(saidas: list[dict], sinal: int = 1):
+    """Aplica as saídas gravadas (``sinal=1``) ou apagadas (``sinal=-1``) aos rollups.
+
+    Falhas são apenas registradas em log: a saída já foi gravada e
+    ``rebuild_rollup`` corrige os totais.
+    """
+    ops = montar_ops_rollup(acumular_rollup(saidas, sinal))
+    if not ops:
+        return
+    try:
+        await db.vendas_rollup.bulk_write(ops, ordered=False)
+    except Exception as e:
+        logging.warning("Falha ao atualizar vendas_rollup: %s", e)
+
+def montar_docs_rollup(acumulado: dict) -> list[ReplaceOne]:
+    """Documentos absolutos (substituição por ``_id``) usados pela reconstrução."""
+    agora = datetime.utcnow()
+    ops = []
+    for chave, totais in acumulado.items():
+        dia, tipo, dimensao, valor = chave
+        doc = {"dia": dia, "tipo": tipo, "dimensao": dimensao, "valor": valor, **totais, "updated_at": agora}
+        ops.append(ReplaceOne({"_id": _rollup_id(chave)}, doc, upsert=True))
+    return ops
+
+# Validade da trava do rebuild no startup: se o worker que a pegou morrer, outro
+# pode assumir depois desse prazo
+VALIDADE_TRAVA = timedelta(minutes=30)
+TRAVA_REBUILD = "rebuild_rollup"
+
+async def adquirir_trava(nome: str, validade: timedelta = VALIDADE_TRAVA) -> bool:
+    """Pega a trava ``nome`` em ``startup_locks`` (insert com ``_id`` fixo: só um
+    processo consegue); uma trava vencida pode ser assumida."""
+    agora = datetime.utcnow()
+    try:
+        await db.startup_locks.insert_one({"_id": nome, "expira_em": agora + validade})
+        return True
+    except DuplicateKeyError:
+        result = await db.startup_locks.update_one(
+            {"_id": nome, "expira_em": {"$lt": agora}}, {"$set": {"expira_em": agora + validade}}
+        )
+        return result.modified_count == 1
+
+async def liberar_trava(nome: str):
+    await db.startup_locks.delete_one({"_id": nome})
+
+async def rebuild_rollup(desde: datetime | None = None, apply: bool = True, somente_se_vazio: bool = False,
+                         batch_size: int = 1000) -> dict:
+    """Recalcula os rollups a partir de ``saidas`` (a partir do dia ``desde``, se dado).
+
+    Com ``apply=False`` apenas conta; ``somente_se_vazio`` só reconstrói quando
+    a coleção ainda não existe/está vazia (usado no startup, sob a trava
+    ``TRAVA_REBUILD``: com vários workers só um reconstrói).
+    """
+    if somente_se_vazio:
+        if not await adquirir_trava(TRAVA_REBUILD):
+            return {"saidas": 0, "chaves": 0}
+        try:
+            if await db.vendas_rollup.find_one({}, projection={"_id": 1}):
+                return {"saidas": 0, "chaves": 0}
+            return await rebuild_rollup(desde, apply=apply, batch_size=batch_size)
+        finally:
+            await liberar_trava(TRAVA_REBUILD)
+
+    query = {"data_saida": {"$gte": dia_da_saida(desde)}} if desde else {}
+    projection = {"data_saida": 1, "tipo": 1, "quantidade": 1, "valor_total": 1,
+                  "produto.tags._id": 1, "produto.marca_fornecedor": 1, "produto.sessao": 1}
+    acumulado = {}
+    total_saidas = 0
+    lote = []
+    async for saida in db.saidas.find(query, projection=projection, batch_size=batch_size):
+        total_saidas += 1
+        lote.append(saida)
+        if len(lote) >= batch_size:
+            acumular_rollup(lote, acumulado=acumulado)
+            lote = []
+    acumular_rollup(lote, acumulado=acumulado)
+
+    if apply:
+        # Substitui cada chave pelo total recalculado: vendas registradas via $inc
+        # durante a varredura não são somadas de novo
+        ops = montar_docs_rollup(acumulado)
+        for i in range(0, len(ops), batch_size):
+            await db.vendas_rollup.bulk_write(ops[i:i + batch_size], ordered=False)
+        # Chaves do intervalo que não têm mais saídas
+        recalculadas = {_rollup_id(chave) for chave in acumulado}
+        faixa = {"dia": {"$gte": dia_da_saida(desde)}} if desde else {}
+        obsoletas = [doc["_id"] async for doc in db.vendas_rollup.find(faixa, projection={"_id": 1})
+                     if doc["_id"] not in recalculadas]
+        for i in range(0, len(obsoletas), batch_size):
+            await db.vendas_rollup.delete_many({"_id": {"$in": obsoletas[i:i + batch_size]}})
+    return {"saidas": total_saidas, "chaves": len(acumulado)}
@@ -1,41 +1,52 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from .connection import db, get_client, suporta_transacoes
 from pymongo import ReturnDocument
 from ..models.saidas import Saida
+from .vendas_db import baixar_estoque_produto, desfazer_baixa
+from .rollup_db import registrar_saidas
+from .saidas_hook import apos_gravar_saidas
+from .metricas_db import incrementar_metricas
+from .cache import invalidar_relatorios
+from .paginacao import encode_cursor, decode_cursor, filtro_apos_cursor
+from .busca_db import filtro_texto_produtos
 from ..models.faturamento_item import FaturamentoItem
 from ..models.despesas import Despesa
 from ..models.imposto_a_recolher import ImpostoARecolher
 from datetime import datetime, timedelta
 from fastapi import HTTPException
-import os
-
-client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
-db = client["projeto_silvana"]
-
-# Função auxiliar para calcular estoque
-async def get_estoque_atual(produto_id: str):
-    pipeline = [
-        {"$match": {"_id": produto_id}},
-        {"$lookup": {"from": "entradas", "localField": "_id", "foreignField": "produtos_id", "as": "entradas"}},
-        {"$lookup": {"from": "saidas", "localField": "_id", "foreignField": "produtos_id", "as": "saidas"}},
-        {"$addFields": {
-            "total_entradas": {"$sum": "$entradas.quantidade"},
-            "total_saidas": {"$sum": "$saidas.quantidade"},
-            "estoque": {"$subtract": ["$total_entradas", "$total_saidas"]}
-        }},
-        {"$project": {"estoque": 1}}
-    ]
-    result = await db.produtos.aggregate(pipeline).to_list(None)
-    return result[0]["estoque"] if result else 0
+import asyncio
 
 # CRUD para Saida
 async def create_saida(saida: Saida):
-    # Validação: verificar estoque
-    estoque = await get_estoque_atual(saida.produtos_id)
-    if estoque < saida.quantidade:
-        raise HTTPException(status_code=400, detail="Estoque insuficiente")
-    
-    result = await db.saidas.insert_one(saida.dict(by_alias=True))
-    return result.inserted_id
+    """Registra uma saída manual (perda, doação...) baixando o estoque.
+
+    A baixa é a mesma das vendas (FIFO, otimista por ``rev``), de modo que os
+    contadores do produto e o histórico de saídas não divirjam. Com replica set
+    baixa e insert vão numa transação; sem, a baixa é desfeita se o insert falhar.
+    """
+    async def registrar(session=None):
+        baixa = await baixar_estoque_produto(saida.produtos_id, saida.quantidade, session)
+        if baixa.get("error"):
+            raise HTTPException(status_code=400, detail=baixa["error"])
+        if saida.produto is None:
+            # snapshot do produto, sem 'itens' (como nas vendas)
+            saida.produto = {k: v for k, v in baixa["produto"].items() if k != "itens"}
+        doc = saida.dict(by_alias=True)
+        try:
+            await db.saidas.insert_one(doc, session=session)
+        except Exception:
+            if session is None:
+                await desfazer_baixa(baixa)
+            raise
+        return doc
+
+    if await suporta_transacoes():
+        async with await get_client().start_session() as session:
+            doc = await session.with_transaction(registrar)
+    else:
+        doc = await registrar()
+    await registrar_saidas([doc])
+    await apos_gravar_saidas([doc])
+    return doc["_id"]
 
 async def get_saidas():
     return await db.saidas.find().to_list(None)
@@ -43,23 +54,13 @@ async def get_saidas():
 async def get_saida_by_id(saida_id: str):
     return await db.saidas.find_one({"_id": saida_id})
 
-async def get_saidas_filtered(page: int = 1, per_page: int = 20, date_from: str | None = None, date_to: str | None = None,
-                               produto_id: str | None = None, produto_query: str | None = None, tag_ids: list | None = None, cliente_id: str | None = None, sort_by: str = 'data', order: str = 'desc'):
-    """Retorna vendas (saidas tipo 'venda') com filtros, ordenação e paginação.
-
-    - date_from / date_to: strings no formato YYYY-MM-DD (date_only)
-    - produto_id: filtra por produto exato
-    - produto_query: texto para buscar em descricao do produto
-    - tag_ids: lista de tag _id para filtrar produtos que possuam qualquer uma das tags (OR)
-    - cliente_id: filtra por cliente exato
-    - sort_by: 'valor' ou 'data'
-    - order: 'asc' ou 'desc'
-    """
-    match_stage = {"tipo": "venda"}
+def _filtro_vendas(date_from: str | None = None, date_to: str | None = None,
+                   produto_id: str | None = None, cliente_id: str | None = None) -> dict:
+    """Filtro indexado das listagens de vendas (``vendas_view`` só contém vendas)."""
+    match_stage = {}
 
     # Date filters
     date_filter = {}
-    from datetime import datetime, timedelta
     if date_from:
         try:
             df = datetime.fromisoformat(date_from)
@@ -82,70 +83,144 @@ async def get_saidas_filtered(page: int = 1, per_page: int = 20, date_from: str
 
     if cliente_id:
         match_stage["cliente_id"] = cliente_id
+    return match_stage
 
-    pipeline = [
-        {"$match": match_stage},
-        {"$lookup": {"from": "produtos", "localField": "produtos_id", "foreignField": "_id", "as": "produto"}},
-        {"$unwind": {"path": "$produto", "preserveNullAndEmptyArrays": True}},
-        # lookup cliente info
-        {"$lookup": {"from": "clientes", "localField": "cliente_id", "foreignField": "_id", "as": "cliente"}},
-        {"$unwind": {"path": "$cliente", "preserveNullAndEmptyArrays": True}},
-    ]
+async def _ids_produtos_filtrados(produto_query: str | None, tag_ids: list | None) -> list | None:
+    """Ids dos produtos que atendem ao texto/tags (None quando não há filtro de produto).
 
-    # produto_query matching
-    if produto_query:
-        regex = {"$regex": produto_query, "$options": "i"}
-        pipeline.append({"$match": {"$or": [{"produto.descricao": regex}, {"produto.codigo_interno": regex}, {"produto.codigo_externo": regex}]}})
+    A busca roda em ``produtos`` pelos índices de ``termos_busca``, dos códigos
+    normalizados e de ``tags._id``; as vendas são então restritas com
+    ``produtos_id: {$in: ...}`` no próprio filtro.
+    """
+    texto = filtro_texto_produtos(produto_query) if produto_query else None
+    if texto is None and not tag_ids:
+        return None
+    # produto_query: termos_busca / códigos normalizados (indexados), sem regex sem âncora
+    query = dict(texto or {})
 
     # tag filtering (OR): produto.tags._id in tag_ids
     if tag_ids:
-        pipeline.append({"$match": {"produto.tags._id": {"$in": tag_ids}}})
+        query["tags._id"] = {"$in": tag_ids}
+    return [p["_id"] async for p in db.produtos.find(query, projection={"_id": 1})]
 
-    # Sorting
+async def _montar_filtro_vendas(date_from: str | None = None, date_to: str | None = None, produto_id: str | None = None,
+                                produto_query: str | None = None, tag_ids: list | None = None, cliente_id: str | None = None) -> dict | None:
+    """Filtro completo das listagens de vendas; None quando nenhum produto atende ao filtro."""
+    match_stage = _filtro_vendas(date_from, date_to, produto_id, cliente_id)
+    ids = await _ids_produtos_filtrados(produto_query, tag_ids)
+    if ids is None:
+        return match_stage
+    if produto_id:
+        ids = [produto_id] if produto_id in ids else []
+    if not ids:
+        return None
+    match_stage["produtos_id"] = {"$in": ids}
+    return match_stage
+
+def _ordenacao(sort_by: str, order: str) -> tuple[str, int]:
     sort_field = "data_saida" if sort_by != 'valor' else "valor_total"
     sort_order = -1 if (order or 'desc').lower() == 'desc' else 1
+    return sort_field, sort_order
 
-    # Facet to get total count and paginated results
-    skip = (max(1, page) - 1) * max(1, per_page)
-    pipeline.extend([
-        {"$sort": {sort_field: sort_order}},
-        {"$facet": {
-            "metadata": [{"$count": "total"}],
-            "data": [{"$skip": skip}, {"$limit": per_page}]
-        }}
-    ])
-
-    result = await db.saidas.aggregate(pipeline).to_list(None)
-    if not result:
+async def get_saidas_filtered(page: int = 1, per_page: int = 20, date_from: str | None = None, date_to: str | None = None,
+                               produto_id: str | None = None, produto_query: str | None = None, tag_ids: list | None = None, cliente_id: str | None = None, sort_by: str = 'data', order: str = 'desc'):
+    """Retorna vendas (saidas tipo 'venda', lidas de ``vendas_view``) com filtros, ordenação e paginação.
+
+    - date_from / date_to: strings no formato YYYY-MM-DD (date_only)
+    - produto_id: filtra por produto exato
+    - produto_query: texto para buscar em descricao do produto
+    - tag_ids: lista de tag _id para filtrar produtos que possuam qualquer uma das tags (OR)
+    - cliente_id: filtra por cliente exato
+    - sort_by: 'valor' ou 'data'
+    - order: 'asc' ou 'desc'
+    """
+    match_stage = await _montar_filtro_vendas(date_from, date_to, produto_id, produto_query, tag_ids, cliente_id)
+    if match_stage is None:
         return {"total": 0, "items": []}
-    metadata = result[0].get("metadata", [])
-    total = metadata[0]["total"] if metadata else 0
-    items = result[0].get("data", [])
-
-    # Format items: flatten produto and cliente info
-    for it in items:
-        prod = it.pop("produto", None)
-        if prod:
-            it["produto_descricao"] = prod.get("descricao")
-            it["produto_codigo_interno"] = prod.get("codigo_interno")
-            it["preco_venda"] = prod.get("preco_venda")
-        client = it.pop("cliente", None)
-        if client:
-            # include useful client fields
-            it["cliente_nome"] = client.get("nome")
-            it["cliente_telefone"] = client.get("telefone")
-            # include cpf if available
-            it["cliente_cpf"] = client.get("cpf")
+
+    # Sorting
+    sort_field, sort_order = _ordenacao(sort_by, order)
+
+    # Página e total em paralelo, ambos numa única coleção já com produto e cliente achatados
+    skip = (max(1, page) - 1) * max(1, per_page)
+    cursor = db.vendas_view.find(match_stage).sort([(sort_field, sort_order), ("_id", sort_order)]).skip(skip).limit(per_page)
+    items, total = await asyncio.gather(cursor.to_list(per_page), db.vendas_view.count_documents(match_stage))
 
     return {"total": total, "items": items}
 
+async def get_saidas_cursor(cursor: str | None = None, per_page: int = 20, date_from: str | None = None, date_to: str | None = None,
+                            produto_id: str | None = None, produto_query: str | None = None, tag_ids: list | None = None,
+                            cliente_id: str | None = None, sort_by: str = 'data', order: str = 'desc', incluir_total: bool = False):
+    """Como ``get_saidas_filtered``, mas paginado por cursor (keyset).
+
+    A página seguinte começa depois do ``next_cursor`` da anterior usando o
+    índice ``(campo, _id)`` de ``vendas_view``, sem ``$skip``: qualquer página
+    custa o mesmo que a primeira. O total (``count_documents``) só é calculado
+    com ``incluir_total``.
+    """
+    sort_field, sort_order = _ordenacao(sort_by, order)
+    per_page = max(1, per_page)
+    match_stage = await _montar_filtro_vendas(date_from, date_to, produto_id, produto_query, tag_ids, cliente_id)
+    if match_stage is None:
+        return {"items": [], "next_cursor": None, **({"total": 0} if incluir_total else {})}
+    filtro_pagina = dict(match_stage)
+    if cursor:
+        filtro_pagina = {"$and": [match_stage, filtro_apos_cursor(sort_field, sort_order, *decode_cursor(cursor, sort_field, sort_order))]}
+
+    cursor_pagina = db.vendas_view.find(filtro_pagina).sort([(sort_field, sort_order), ("_id", sort_order)]).limit(per_page + 1)
+    consultas = [cursor_pagina.to_list(per_page + 1)]
+    if incluir_total:
+        consultas.append(db.vendas_view.count_documents(match_stage))
+    resultados = await asyncio.gather(*consultas)
+
+    items = resultados[0]
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(sort_field, sort_order, items[-1])
+    result = {"items": items, "next_cursor": next_cursor}
+    if incluir_total:
+        result["total"] = resultados[1]
+    return result
+
+EXPORT_BATCH_SIZE = 500
+
+async def iterar_vendas_export(date_from: str | None = None, date_to: str | None = None, produto_id: str | None = None,
+                               produto_query: str | None = None, tag_ids: list | None = None, cliente_id: str | None = None,
+                               sort_by: str = 'data', order: str = 'desc', batch_size: int = EXPORT_BATCH_SIZE):
+    """Percorre todas as vendas do filtro direto do cursor, em lotes de ``batch_size``.
+
+    Mesmos filtros de ``get_saidas_filtered``; a memória fica limitada a um lote
+    por vez (nada de ``to_list(None)``), então serve para exportar anos inteiros.
+    """
+    match_stage = await _montar_filtro_vendas(date_from, date_to, produto_id, produto_query, tag_ids, cliente_id)
+    if match_stage is None:
+        return
+    sort_field, sort_order = _ordenacao(sort_by, order)
+    cursor = db.vendas_view.find(match_stage, batch_size=batch_size).sort([(sort_field, sort_order), ("_id", sort_order)])
+    async for venda in cursor:
+        yield venda
+
 async def update_saida(saida_id: str, update_data: dict):
-    return await db.saidas.find_one_and_update(
+    antes = await db.saidas.find_one({"_id": saida_id})
+    depois = await db.saidas.find_one_and_update(
         {"_id": saida_id}, {"$set": update_data}, return_document=ReturnDocument.AFTER
     )
+    if antes and depois:
+        # move os totais do rollup para os novos valores (data, tipo, quantidade...)
+        await registrar_saidas([antes], sinal=-1)
+        await apos_gravar_saidas([antes], sinal=-1)
+        await registrar_saidas([depois])
+        await apos_gravar_saidas([depois])
+    return depois
 
 async def delete_saida(saida_id: str):
-    return await db.saidas.delete_one({"_id": saida_id})
+    saida = await db.saidas.find_one({"_id": saida_id})
+    result = await db.saidas.delete_one({"_id": saida_id})
+    if saida and result.deleted_count:
+        await registrar_saidas([saida], sinal=-1)
+        await apos_gravar_saidas([saida], sinal=-1)
+    return result
 
 # Agregação para Saida
 async def get_saida_com_produto(saida_id: str):
@@ -182,6 +257,7 @@ async def processar_venda(saida_id: str, modalidade_id: str, impostos_adicionais
         taxa = modalidade["valor_taxa"]
 
     if taxa > 0:
+        await incrementar_metricas(taxas_meios_pagamento=taxa)
         despesa = Despesa(
             descricao=f"Taxa {modalidade['nome']} para venda {saida_id}",
             valor=taxa
@@ -204,4 +280,7 @@ async def processar_venda(saida_id: str, modalidade_id: str, impostos_adicionais
         )
         await db.imposto_a_recolher.insert_one(imposto.dict(by_alias=True))
 
+    # faturamento, taxas e impostos entram nos relatórios
+    await invalidar_relatorios()
+
     return {"faturamento_id": fat_id.inserted_id}
\ No newline at end of file
@@ -0,0 +1,14 @@
+"""Efeitos colaterais de gravar ou apagar saídas, fora dos rollups.
+
+Todo caminho que grava ou apaga saídas chama, ao lado de ``registrar_saidas``
+(totais em ``vendas_rollup``), ``apos_gravar_saidas``: invalida o cache de
+relatórios e mantém a ``vendas_view`` das listagens. Assim o rollup pode ser
+reconstruído ou testado sem tocar no cache nem na view.
+"""
+from .cache import invalidar_relatorios
+from .vendas_view_db import atualizar_vendas_view
+
+async def apos_gravar_saidas(saidas: list[dict], sinal: int = 1):
+    """Atualiza a view (``sinal=1`` grava, ``-1`` remove) e invalida os relatórios."""
+    await atualizar_vendas_view(saidas, sinal)
+    await invalidar_relatorios()
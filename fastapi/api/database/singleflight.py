@@ -0,0 +1,61 @@
+"""Coalescência de leituras concorrentes idênticas ("single-flight").
+
+Quando várias requisições iguais chegam ao mesmo tempo (ex.: todos os
+navegadores abrindo o dashboard na abertura da loja), apenas a primeira executa
+a consulta; as demais aguardam o mesmo resultado em vez de repetir o trabalho
+no MongoDB. Nada fica guardado depois que a execução termina — para isso existe
+o cache de relatórios (``cache.py``).
+
+O comportamento é por rota: ``single_flight("nome", habilitado=False)`` desliga
+no código e ``SINGLE_FLIGHT_DESATIVADO=dashboard,produtos`` desliga por
+ambiente. Vale por processo (cada worker do uvicorn coalesce as suas).
+"""
+import asyncio
+import functools
+import os
+from .cache import cache_key
+
+_em_andamento: dict[str, asyncio.Future] = {}
+_stats = {"execucoes": 0, "coalescidas": 0}
+
+def _desativadas() -> set[str]:
+    return {nome.strip() for nome in os.getenv("SINGLE_FLIGHT_DESATIVADO", "").split(",") if nome.strip()}
+
+def stats() -> dict:
+    return {**_stats, "em_andamento": len(_em_andamento)}
+
+async def executar(key: str, fabrica):
+    """Executa ``fabrica()`` uma vez por ``key`` enquanto houver uma execução em andamento.
+
+    A execução roda numa task própria, então o cancelamento de um dos chamadores
+    (cliente desconectou) não cancela os demais. Exceções são repassadas a todos.
+    """
+    task = _em_andamento.get(key)
+    if task is None:
+        _stats["execucoes"] += 1
+        task = asyncio.ensure_future(fabrica())
+        _em_andamento[key] = task
+
+        def _remover(t):
+            if _em_andamento.get(key) is t:
+                del _em_andamento[key]
+        task.add_done_callback(_remover)
+    else:
+        _stats["coalescidas"] += 1
+    return await asyncio.shield(task)
+
+def single_flight(nome: str, habilitado: bool = True):
+    """Decorator para endpoints de leitura: chamadas simultâneas com os mesmos
+    parâmetros compartilham uma única execução.
+
+    Como em ``cached_report``, a assinatura é preservada para o FastAPI. O
+    resultado é o mesmo objeto para todos os chamadores e não deve ser alterado.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(**kwargs):
+            if not habilitado or nome in _desativadas():
+                return await func(**kwargs)
+            return await executar(cache_key(nome, kwargs), lambda: func(**kwargs))
+        return wrapper
+    return decorator
@@ -1,13 +1,9 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from .connection import db
 from pymongo import ReturnDocument
 from ..models.tags import Tag
-import os
 from bson import ObjectId
 from datetime import datetime
 
-client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
-db = client["projeto_silvana"]
-
 # CRUD para Tag
 async def create_tag(tag: Tag):
     result = await db.tags.insert_one(tag.dict(by_alias=True))
@@ -23,7 +19,7 @@ async def find_tags_by_query(q: str):
     regex = {"$regex": q, "$options": "i"}
     return await db.tags.find({"descricao": regex}).sort("descricao", 1).to_list(None)
 
-from pymongo.errors import DuplicateKeyError
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 async def get_or_create_tag_by_descricao(descricao: str):
     # busca case-insensitive usando descricao_case_insensitive
@@ -43,6 +39,30 @@ async def get_or_create_tag_by_descricao(descricao: str):
         existing = await db.tags.find_one({"descricao_case_insensitive": descricao_norm.lower()})
         return existing
 
+async def get_or_create_tags_by_descricoes(descricoes) -> dict:
+    """Versão em lote de ``get_or_create_tag_by_descricao``: uma consulta ``$in``
+    e um ``insert_many`` para as que faltam. Retorna {descricao em minúsculas: tag}."""
+    por_chave = {}
+    for descricao in descricoes:
+        descricao_norm = str(descricao or "").strip()
+        if descricao_norm:
+            por_chave.setdefault(descricao_norm.lower(), descricao_norm)
+    if not por_chave:
+        return {}
+    cursor = db.tags.find({"descricao_case_insensitive": {"$in": list(por_chave)}})
+    encontradas = {t["descricao_case_insensitive"]: t async for t in cursor}
+    novas = [Tag(descricao=d).dict(by_alias=True) for chave, d in por_chave.items() if chave not in encontradas]
+    if novas:
+        try:
+            await db.tags.insert_many(novas, ordered=False)
+        except BulkWriteError:
+            # outras requisições criaram parte delas ao mesmo tempo — relê abaixo
+            pass
+        faltantes = [t["descricao_case_insensitive"] for t in novas]
+        cursor = db.tags.find({"descricao_case_insensitive": {"$in": faltantes}})
+        encontradas.update({t["descricao_case_insensitive"]: t async for t in cursor})
+    return encontradas
+
 async def update_tag(tag_id: str, update_data: dict):
     return await db.tags.find_one_and_update(
         {"_id": tag_id}, {"$set": update_data}, return_document=ReturnDocument.AFTER
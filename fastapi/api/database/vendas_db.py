@@ -1,133 +1,188 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from .connection import db, get_client, suporta_transacoes
 from ..models.saidas import Saida
+from ..models.vendas import Venda, VendaLinha
+from .rollup_db import registrar_saidas
+from .saidas_hook import apos_gravar_saidas
+from .estoque_db import SEM_HISTORICO, calcular_estoque, copiar_lotes, devolver_lotes, get_estoque, gravar_itens, liberar_reserva, reservado
 from datetime import datetime
-import os
-
-client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
-db = client["projeto_silvana"]
+import asyncio
+import logging
 
 async def get_estoque_disponivel_por_produto(produto_id: str):
     """
     Calcula o estoque disponível de um produto.
     Items em condicional_cliente NÃO são considerados disponíveis; itens em condicional_fornecedor SÃO (podem ser vendidos pelo lojista).
     """
-    produto = await db.produtos.find_one({"_id": produto_id})
-    if not produto:
+    estoque = await get_estoque(produto_id)
+    if not estoque:
         return 0
-    
-    total = 0
-    for item in produto.get("itens", []):
-        # Conta itens que não estão em condicional cliente (itens em condicional fornecedor são vendáveis)
-        if not item.get("condicionais_cliente"):
-            total += item.get("quantity", 0)
-    
-    return total
+    return estoque["estoque_disponivel"]
 
-async def processar_venda_produto(produto_id: str, quantidade: int, cliente_id: str = None, 
-                                   valor_total: int = None, observacoes: str = None):
+# Tentativas de gravação otimista (campo `rev` do produto) antes de desistir da venda
+MAX_TENTATIVAS_VENDA = 5
+
+# Produtos distintos processados em paralelo numa venda em lote
+MAX_PRODUTOS_CONCORRENTES = 8
+
+def planejar_venda_fifo(itens: list, quantidade: int):
     """
-    Processa uma venda seguindo lógica FIFO (First In, First Out).
-    Remove itens mais antigos primeiro baseado em acquisition_date.
-    Remove completamente itens quando sua quantidade chega a 0.
+    Calcula, sem tocar no banco, os itens após vender `quantidade` unidades em FIFO.
+    Itens em condicional cliente não são vendáveis; itens em condicional fornecedor são.
+    Retorna (itens_atualizados, condicional_sold) onde condicional_sold mapeia
+    condicional_fornecedor_id -> quantidade vendida daquela condicional.
     """
-    produto = await db.produtos.find_one({"_id": produto_id})
-    if not produto:
-        return {"error": "Produto não encontrado"}
+    itens_atualizados = copiar_lotes(itens)
 
-    # snapshot do produto, sem 'itens' (para registro na saida)
-    produto_snapshot = { k: v for k, v in produto.items() if k != 'itens' }
-    
-    # Verifica estoque disponível (excluindo itens em condicional cliente)
-    itens_disponiveis = [
-        item for item in produto.get("itens", [])
-        if not item.get("condicionais_cliente")
-    ]
-    
-    estoque_disponivel = sum(item.get("quantity", 0) for item in itens_disponiveis)
-    
-    if estoque_disponivel < quantidade:
-        return {"error": f"Estoque insuficiente. Disponível: {estoque_disponivel}, Solicitado: {quantidade}"}
-    
-    # Ordena itens por acquisition_date (mais antigo primeiro - FIFO)
-    itens_ordenados = sorted(
-        itens_disponiveis,
-        key=lambda x: x.get("acquisition_date", datetime.utcnow())
+    # Ordena índices dos itens disponíveis por acquisition_date (mais antigo primeiro - FIFO)
+    disponiveis = sorted(
+        (i for i, item in enumerate(itens_atualizados)
+         if item.get("quantity", 0) > reservado(item, "condicionais_cliente")),
+        key=lambda i: itens_atualizados[i].get("acquisition_date", datetime.utcnow())
     )
-    
+
     quantidade_restante = quantidade
-    itens_atualizados = list(produto.get("itens", []))
-    
-    # Processa remoção FIFO
     items_to_remove = []
     condicional_sold = {}  # condicional_fornecedor_id -> quantidade vendida
-    for item in itens_ordenados:
+    for idx in disponiveis:
         if quantidade_restante <= 0:
             break
-        
-        # Encontra o índice do item na lista original usando múltiplos critérios (agora aceitamos condicional_fornecedor)
-        idx = None
-        for i, it in enumerate(itens_atualizados):
-            if (it.get("acquisition_date") == item.get("acquisition_date") and
-                it.get("quantity") == item.get("quantity") and
-                not it.get("condicionais_cliente") and
-                i not in items_to_remove):
-                idx = i
+
+        item = itens_atualizados[idx]
+        item_quantity = item.get("quantity", 0)
+        vendavel = item_quantity - reservado(item, "condicionais_cliente")
+        vendido = min(vendavel, quantidade_restante)
+        quantidade_restante -= vendido
+
+        # Unidades vendidas saem primeiro das consignadas (condicional fornecedor)
+        restante_cond = vendido
+        for cond_id in list(item["condicionais_fornecedor"]):
+            if restante_cond <= 0:
                 break
-        
-        if idx is None:
-            continue
-        
-        item_quantity = itens_atualizados[idx].get("quantity", 0)
-        cond_ids = itens_atualizados[idx].get("condicionais_fornecedor") or []
-        cond_id = cond_ids[0] if cond_ids else None
-        
-        if item_quantity <= quantidade_restante:
+            baixa = liberar_reserva(item, "condicionais_fornecedor", cond_id, restante_cond)
+            condicional_sold[cond_id] = condicional_sold.get(cond_id, 0) + baixa
+            restante_cond -= baixa
+
+        if vendido == item_quantity:
             # Remove o item completamente
-            quantidade_restante -= item_quantity
             items_to_remove.append(idx)
-            if cond_id:
-                condicional_sold[cond_id] = condicional_sold.get(cond_id, 0) + item_quantity
         else:
             # Diminui a quantidade do item
-            itens_atualizados[idx]["quantity"] = item_quantity - quantidade_restante
-            if cond_id:
-                condicional_sold[cond_id] = condicional_sold.get(cond_id, 0) + quantidade_restante
-            quantidade_restante = 0
+            item["quantity"] = item_quantity - vendido
 
     # Remove items marcados para remoção (em ordem reversa para não afetar índices)
     for idx in sorted(items_to_remove, reverse=True):
         itens_atualizados.pop(idx)
-    
-    # IMPORTANTE: Verificar ANTES de atualizar se o produto poderá ser deletado
-    # Esta verificação usa o produto no estado ATUAL (antes da atualização)
-    total_restante = sum(item.get("quantity", 0) for item in itens_atualizados)
-    produto_pode_ser_deletado = False
-    
-    if total_restante == 0:
-        # Verifica usando o estado atual do produto (com itens ainda intactos no banco)
-        from .produtos_db import can_delete_produto
-        produto_pode_ser_deletado = await can_delete_produto(produto_id)
-    
-    # Atualiza o produto com os itens modificados
-    remaining_cond_fornecedor = sum(item.get("quantity", 0) for item in itens_atualizados if item.get("condicionais_fornecedor"))
-    await db.produtos.update_one(
-        {"_id": produto_id},
-        {"$set": {"itens": itens_atualizados, "updated_at": datetime.utcnow(), "em_condicional_fornecedor": remaining_cond_fornecedor > 0}}
-    )
 
-    # Se verificamos que pode deletar, deleta agora
-    if produto_pode_ser_deletado:
-        await db.produtos.delete_one({"_id": produto_id})
-    
+    return itens_atualizados, condicional_sold
+
+async def processar_venda_produto(produto_id: str, quantidade: int, cliente_id: str = None, 
+                                   valor_total: int = None, observacoes: str = None):
+    """
+    Processa uma venda seguindo lógica FIFO (ver ``_baixar_venda_produto``) e
+    grava as saídas correspondentes.
+    """
+    result, saidas = await _baixar_venda_produto(produto_id, quantidade, cliente_id, valor_total, observacoes)
+    if saidas:
+        docs = [saida.dict(by_alias=True) for saida in saidas]
+        await db.saidas.insert_many(docs)
+        await registrar_saidas(docs)
+        await apos_gravar_saidas(docs)
+    return result
+
+async def baixar_estoque_produto(produto_id: str, quantidade: int, session=None) -> dict:
+    """
+    Baixa o estoque de uma venda seguindo lógica FIFO (First In, First Out).
+    Remove itens mais antigos primeiro baseado em acquisition_date.
+    Remove completamente itens quando sua quantidade chega a 0.
+
+    A gravação dos itens é otimista: o update só é aplicado se o produto ainda
+    estiver na revisão (`rev`) lida; se outra operação alterou o produto no meio
+    do caminho, a venda é recalculada sobre o estado novo (até MAX_TENTATIVAS_VENDA).
+    Assim duas vendas simultâneas não vendem a mesma unidade nem se sobrescrevem.
+
+    Retorna ``{"error": ...}`` ou a baixa gravada: produto lido, lotes antes e
+    depois, unidades vendidas por condicional e se o produto ficou sem estoque
+    e pode ser apagado (a exclusão fica a cargo de quem chama).
+    """
+    for _ in range(MAX_TENTATIVAS_VENDA):
+        produto = await db.produtos.find_one({"_id": produto_id}, projection=SEM_HISTORICO, session=session)
+        if not produto:
+            return {"error": "Produto não encontrado"}
+
+        # Verifica estoque disponível (excluindo itens em condicional cliente)
+        estoque_disponivel = calcular_estoque(produto.get("itens", []))["estoque_disponivel"]
+        if estoque_disponivel < quantidade:
+            return {"error": f"Estoque insuficiente. Disponível: {estoque_disponivel}, Solicitado: {quantidade}"}
+
+        itens_antes = copiar_lotes(produto.get("itens", []))
+        itens_atualizados, condicional_sold = planejar_venda_fifo(itens_antes, quantidade)
+
+        # IMPORTANTE: Verificar ANTES de atualizar se o produto poderá ser deletado
+        # Esta verificação usa o produto no estado ATUAL (antes da atualização)
+        total_restante = sum(item.get("quantity", 0) for item in itens_atualizados)
+        produto_pode_ser_deletado = False
+        if total_restante == 0:
+            # Verifica usando o estado atual do produto (com itens ainda intactos no banco)
+            from .produtos_db import can_delete_produto
+            produto_pode_ser_deletado = await can_delete_produto(produto_id)
+
+        # Atualiza o produto com os itens modificados, somente se ninguém o alterou desde a leitura
+        # (venda parcial de um lote vira um $inc no lote via arrayFilters)
+        if await gravar_itens(produto, itens_atualizados, session=session):
+            return {
+                "produto": produto,
+                "itens_antes": itens_antes,
+                "itens_depois": itens_atualizados,
+                "condicional_sold": condicional_sold,
+                "estoque_disponivel": estoque_disponivel,
+                "pode_deletar": produto_pode_ser_deletado,
+            }
+    return {"error": "Produto alterado por outra operação simultânea. Tente novamente."}
+
+async def _apagar_se_vazio(baixa: dict, session=None) -> bool:
+    """Apaga o produto que a baixa deixou sem estoque, se ninguém repôs estoque
+    (ou o alterou) depois dela."""
+    if not baixa["pode_deletar"]:
+        return False
+    produto = baixa["produto"]
+    result = await db.produtos.delete_one({"_id": produto["_id"], "rev": produto.get("rev", 0) + 1}, session=session)
+    return result.deleted_count == 1
+
+async def desfazer_baixa(baixa: dict) -> bool:
+    """Devolve ao produto as unidades de uma baixa já gravada (fora de transação).
+
+    Relê o produto e grava com a mesma checagem de ``rev`` da venda, de modo que
+    operações concorrentes feitas depois da baixa não sejam sobrescritas.
+    """
+    produto_id = baixa["produto"]["_id"]
+    for _ in range(MAX_TENTATIVAS_VENDA):
+        produto = await db.produtos.find_one({"_id": produto_id}, projection=SEM_HISTORICO)
+        if not produto:
+            break
+        itens = devolver_lotes(produto.get("itens", []), baixa["itens_antes"], baixa["itens_depois"])
+        if await gravar_itens(produto, itens):
+            return True
+    logging.error("Não foi possível desfazer a baixa do produto %s: %s", produto_id, baixa["itens_antes"])
+    return False
+
+def _saidas_da_venda(baixa: dict, quantidade: int, cliente_id: str = None, valor_total: int = None,
+                     observacoes: str = None):
+    """Monta o resultado e as saídas (ainda não gravadas) de uma baixa."""
+    produto = baixa["produto"]
+    condicional_sold = baixa["condicional_sold"]
+    # snapshot do produto, sem 'itens' (para registro na saida)
+    produto_snapshot = { k: v for k, v in produto.items() if k != 'itens' }
+
     # Cria saídas (vendas) - se parte da venda veio de condicionais, registrar uma saida por condicional para rastreio
+    saidas = []
     vendas_criadas = []
     total_vendido = quantidade
     total_from_cond = sum(condicional_sold.values()) if condicional_sold else 0
 
-    # Inserir saídas para quantidades vendidas originadas de condicionais
+    # Saídas para quantidades vendidas originadas de condicionais
     for cond_id, q in condicional_sold.items():
         saida = Saida(
-            produtos_id=produto_id,
+            produtos_id=produto["_id"],
             cliente_id=cliente_id,
             condicional_fornecedor_id=cond_id,
             quantidade=q,
@@ -137,14 +192,14 @@ async def processar_venda_produto(produto_id: str, quantidade: int, cliente_id:
             observacoes=observacoes,
             produto=produto_snapshot
         )
-        res = await db.saidas.insert_one(saida.dict(by_alias=True))
-        vendas_criadas.append({"saida_id": str(res.inserted_id), "quantidade": q, "condicional_fornecedor_id": cond_id})
+        saidas.append(saida)
+        vendas_criadas.append({"saida_id": saida.id, "quantidade": q, "condicional_fornecedor_id": cond_id})
 
-    # Inserir saida para o restante (não de condicional)
+    # Saída para o restante (não de condicional)
     restante = total_vendido - total_from_cond
     if restante > 0:
         saida = Saida(
-            produtos_id=produto_id,
+            produtos_id=produto["_id"],
             cliente_id=cliente_id,
             quantidade=restante,
             tipo="venda",
@@ -153,16 +208,78 @@ async def processar_venda_produto(produto_id: str, quantidade: int, cliente_id:
             observacoes=observacoes,
             produto=produto_snapshot
         )
-        res = await db.saidas.insert_one(saida.dict(by_alias=True))
-        vendas_criadas.append({"saida_id": str(res.inserted_id), "quantidade": restante})
+        saidas.append(saida)
+        vendas_criadas.append({"saida_id": saida.id, "quantidade": restante})
 
     return {
         "success": True,
         "vendas": vendas_criadas,
         "quantidade_vendida": quantidade,
-        "estoque_restante": estoque_disponivel - quantidade,
-        "produto_deletado": produto_pode_ser_deletado
-    }
+        "estoque_restante": baixa["estoque_disponivel"] - quantidade,
+        "produto_deletado": baixa["pode_deletar"]
+    }, saidas
+
+async def _baixar_venda_produto(produto_id: str, quantidade: int, cliente_id: str = None,
+                                valor_total: int = None, observacoes: str = None):
+    """
+    Baixa o estoque de uma venda (``baixar_estoque_produto``), apaga o produto
+    se ele ficou sem estoque e pode ser apagado, e monta as saídas.
+    Retorna (resultado, saídas a gravar).
+    """
+    baixa = await baixar_estoque_produto(produto_id, quantidade)
+    if baixa.get("error"):
+        return {"error": baixa["error"]}, []
+    # Se verificamos que pode deletar, deleta agora (se ninguém repôs estoque entre o update e aqui)
+    await _apagar_se_vazio(baixa)
+    return _saidas_da_venda(baixa, quantidade, cliente_id, valor_total, observacoes)
+
+def agrupar_por_produto(vendas: list[dict]) -> dict:
+    """Agrupa as linhas de venda por produto_id: {produto_id: [(posição, venda), ...]}.
+
+    A ordem das linhas de um mesmo produto é preservada.
+    """
+    grupos = {}
+    for pos, venda in enumerate(vendas):
+        grupos.setdefault(venda["produto_id"], []).append((pos, venda))
+    return grupos
+
+async def _baixar_vendas_em_lote(vendas: list[dict], concorrencia: int = MAX_PRODUTOS_CONCORRENTES):
+    """
+    Baixa o estoque de várias linhas de venda (dicts com os campos de
+    ``processar_venda_produto``), sem gravar as saídas.
+
+    As linhas são agrupadas por produto: produtos diferentes são processados em
+    paralelo (no máximo ``concorrencia`` por vez) e as linhas de um mesmo
+    produto em sequência, na ordem recebida. Retorna (resultados na ordem das
+    linhas, saídas a gravar).
+    """
+    results = [None] * len(vendas)
+    saidas = []
+    semaforo = asyncio.Semaphore(concorrencia)
+
+    async def processar_grupo(linhas):
+        async with semaforo:
+            for pos, venda in linhas:
+                result, saidas_linha = await _baixar_venda_produto(**venda)
+                results[pos] = result
+                saidas.extend(saidas_linha)
+
+    await asyncio.gather(*(processar_grupo(linhas) for linhas in agrupar_por_produto(vendas).values()))
+    return results, saidas
+
+async def processar_vendas_batch(vendas: list[dict], concorrencia: int = MAX_PRODUTOS_CONCORRENTES):
+    """
+    Processa várias linhas de venda independentes (ver ``_baixar_vendas_em_lote``);
+    as saídas de todas as linhas são gravadas num único ``insert_many``.
+    Retorna os resultados na ordem das linhas.
+    """
+    results, saidas = await _baixar_vendas_em_lote(vendas, concorrencia)
+    if saidas:
+        docs = [saida.dict(by_alias=True) for saida in saidas]
+        await db.saidas.insert_many(docs)
+        await registrar_saidas(docs)
+        await apos_gravar_saidas(docs)
+    return results
 
 async def produto_foi_vendido(produto_id: str):
     """
@@ -170,4 +287,146 @@ async def produto_foi_vendido(produto_id: str):
     e retorna os objetos de saida deste produto.
     """
     saidas = await db.saidas.find({"produtos_id": produto_id}).to_list(None)
-    return saidas if saidas else None
\ No newline at end of file
+    return saidas if saidas else None
+
+async def verificar_estoque_carrinho(linhas: list[dict]) -> list[dict]:
+    """
+    Confere, numa única consulta, se há estoque disponível para todas as linhas
+    (somando as linhas de um mesmo produto). Retorna a lista de problemas.
+    """
+    solicitado = {}
+    for linha in linhas:
+        solicitado[linha["produto_id"]] = solicitado.get(linha["produto_id"], 0) + linha["quantidade"]
+
+    cursor = db.produtos.find({"_id": {"$in": list(solicitado)}}, projection={"estoque_disponivel": 1})
+    disponivel = {produto["_id"]: produto.get("estoque_disponivel") async for produto in cursor}
+
+    problemas = []
+    for produto_id, quantidade in solicitado.items():
+        if produto_id not in disponivel:
+            problemas.append({"produto_id": produto_id, "error": "Produto não encontrado"})
+            continue
+        estoque = disponivel[produto_id]
+        if estoque is None:
+            # produto ainda sem contadores materializados
+            estoque = (await get_estoque(produto_id))["estoque_disponivel"]
+        if estoque < quantidade:
+            problemas.append({
+                "produto_id": produto_id,
+                "error": f"Estoque insuficiente. Disponível: {estoque}, Solicitado: {quantidade}"
+            })
+    return problemas
+
+class CarrinhoRecusado(Exception):
+    """Alguma linha do carrinho não pôde ser baixada; nada foi vendido."""
+
+    def __init__(self, falhas: list):
+        super().__init__("Carrinho não vendido")
+        self.falhas = falhas
+
+def _montar_venda_carrinho(linhas: list[dict], baixas: list[dict], cliente_id: str = None, observacoes: str = None):
+    """Cabeçalho ``vendas`` e saídas de um carrinho cujas linhas foram todas baixadas."""
+    venda = Venda(cliente_id=cliente_id, observacoes=observacoes)
+    saidas = []
+    for linha, baixa in zip(linhas, baixas):
+        result, saidas_linha = _saidas_da_venda(baixa, linha["quantidade"], cliente_id, linha.get("valor_total"),
+                                                linha.get("observacoes"))
+        saidas.extend(saidas_linha)
+        venda.itens.append(VendaLinha(**linha, saida_ids=[v["saida_id"] for v in result["vendas"]]))
+    venda.quantidade_total = sum(linha.quantidade for linha in venda.itens)
+    valores = [linha.valor_total for linha in venda.itens if linha.valor_total is not None]
+    venda.valor_total = sum(valores) if valores else None
+    for saida in saidas:
+        saida.venda_id = venda.id
+    return venda, [saida.dict(by_alias=True) for saida in saidas]
+
+def _falhas(linhas: list[dict], baixas: list[dict]) -> list[dict]:
+    return [
+        {"produto_id": linha["produto_id"], "quantidade": linha["quantidade"], "error": baixa["error"]}
+        for linha, baixa in zip(linhas, baixas) if baixa.get("error")
+    ]
+
+async def _vender_carrinho_em_transacao(linhas: list[dict], cliente_id: str = None, observacoes: str = None):
+    """Baixas, saídas e cabeçalho numa única transação (requer replica set).
+
+    As linhas são baixadas em sequência na mesma sessão (linhas do mesmo
+    produto enxergam a baixa anterior). Conflitos de escrita com outras
+    operações fazem ``with_transaction`` repetir tudo.
+    """
+    async def vender(session):
+        baixas = [await baixar_estoque_produto(linha["produto_id"], linha["quantidade"], session) for linha in linhas]
+        falhas = _falhas(linhas, baixas)
+        if falhas:
+            raise CarrinhoRecusado(falhas)
+        venda, docs = _montar_venda_carrinho(linhas, baixas, cliente_id, observacoes)
+        await db.saidas.insert_many(docs, session=session)
+        await db.vendas.insert_one(venda.dict(by_alias=True), session=session)
+        for baixa in baixas:
+            await _apagar_se_vazio(baixa, session=session)
+        return venda, docs
+
+    async with await get_client().start_session() as session:
+        return await session.with_transaction(vender)
+
+async def _vender_carrinho_com_compensacao(linhas: list[dict], cliente_id: str = None, observacoes: str = None):
+    """Sem transações: baixa as linhas (produtos em paralelo) e, se alguma
+    falhar, devolve o estoque das que já foram baixadas antes de recusar."""
+    baixas = [None] * len(linhas)
+    semaforo = asyncio.Semaphore(MAX_PRODUTOS_CONCORRENTES)
+
+    async def processar_grupo(grupo):
+        async with semaforo:
+            for pos, linha in grupo:
+                baixas[pos] = await baixar_estoque_produto(linha["produto_id"], linha["quantidade"])
+
+    await asyncio.gather(*(processar_grupo(grupo) for grupo in agrupar_por_produto(linhas).values()))
+    falhas = _falhas(linhas, baixas)
+    if falhas:
+        # desfaz na ordem inversa (linhas do mesmo produto voltam da última para a primeira)
+        for baixa in reversed(baixas):
+            if not baixa.get("error"):
+                await desfazer_baixa(baixa)
+        raise CarrinhoRecusado(falhas)
+
+    venda, docs = _montar_venda_carrinho(linhas, baixas, cliente_id, observacoes)
+    try:
+        await db.saidas.insert_many(docs)
+        await db.vendas.insert_one(venda.dict(by_alias=True))
+    except Exception:
+        await db.saidas.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        for baixa in reversed(baixas):
+            await desfazer_baixa(baixa)
+        raise
+    for baixa in baixas:
+        await _apagar_se_vazio(baixa)
+    return venda, docs
+
+async def processar_venda_carrinho(linhas: list[dict], cliente_id: str = None, observacoes: str = None):
+    """
+    Vende várias linhas (produto_id, quantidade, valor_total, observacoes) num
+    único pedido e registra um cabeçalho ``vendas`` referenciando as saídas.
+
+    Tudo ou nada: se faltar estoque para qualquer linha, ou uma linha perder a
+    corrida para outra operação, nada é vendido e o retorno traz ``falhas``.
+    Com replica set as baixas, saídas e o cabeçalho vão numa transação; sem,
+    as baixas já feitas são desfeitas. Retorna o recibo consolidado.
+    """
+    if not linhas:
+        return {"error": "Carrinho vazio"}
+
+    problemas = await verificar_estoque_carrinho(linhas)
+    if problemas:
+        return {"error": "Estoque insuficiente para o carrinho", "itens": problemas}
+
+    try:
+        if await suporta_transacoes():
+            venda, docs = await _vender_carrinho_em_transacao(linhas, cliente_id, observacoes)
+        else:
+            venda, docs = await _vender_carrinho_com_compensacao(linhas, cliente_id, observacoes)
+    except CarrinhoRecusado as e:
+        return {"error": "Nenhum item do carrinho foi vendido", "falhas": e.falhas}
+
+    await registrar_saidas(docs)
+
+    await apos_gravar_saidas(docs)
+    return venda.dict(by_alias=True)
@@ -0,0 +1,132 @@
+"""Modelo de leitura das listagens de vendas (``vendas_view``).
+
+Um documento por saída do tipo ``venda`` (mesmo ``_id``) com os campos de
+produto e cliente já achatados (``produto_descricao``, ``cliente_nome``...), de
+modo que ``/vendas/`` e ``/vendas/cliente/{id}`` sejam consultas indexadas numa
+única coleção, sem ``$lookup``.
+
+Escrita: ``saidas_hook.apos_gravar_saidas`` chama ``atualizar_vendas_view``
+sempre que saídas são gravadas ou apagadas. Alterações de nome/telefone/cpf do cliente ou de
+descrição/código/preço do produto são propagadas em background
+(``propagar_cliente``/``propagar_produto``). ``rebuild_vendas_view`` recalcula
+tudo a partir de ``saidas``.
+"""
+from pymongo import ReplaceOne
+import asyncio
+import logging
+from .connection import db
+
+# campo de origem -> campo achatado na view
+CAMPOS_PRODUTO = {"descricao": "produto_descricao", "codigo_interno": "produto_codigo_interno", "preco_venda": "preco_venda"}
+CAMPOS_CLIENTE = {"nome": "cliente_nome", "telefone": "cliente_telefone", "cpf": "cliente_cpf"}
+
+_pendentes: set[asyncio.Task] = set()
+
+def _achatar(origem: dict | None, campos: dict) -> dict:
+    origem = origem or {}
+    return {destino: origem.get(campo) for campo, destino in campos.items()}
+
+def montar_linha_view(saida: dict, produto: dict | None, cliente: dict | None) -> dict:
+    """Documento da view para uma venda: a saída sem o snapshot + campos achatados."""
+    linha = {k: v for k, v in saida.items() if k != "produto"}
+    linha.update(_achatar(produto, CAMPOS_PRODUTO))
+    linha.update(_achatar(cliente, CAMPOS_CLIENTE))
+    return linha
+
+async def _montar_linhas(vendas: list[dict]) -> list[dict]:
+    cliente_ids = list({v["cliente_id"] for v in vendas if v.get("cliente_id")})
+    clientes = {}
+    if cliente_ids:
+        cursor = db.clientes.find({"_id": {"$in": cliente_ids}}, projection=dict.fromkeys(CAMPOS_CLIENTE, 1))
+        clientes = {c["_id"]: c async for c in cursor}
+    # o snapshot gravado na saída já traz os campos do produto; só busca quem não tem
+    sem_snapshot = list({v["produtos_id"] for v in vendas if not v.get("produto")})
+    produtos = {}
+    if sem_snapshot:
+        cursor = db.produtos.find({"_id": {"$in": sem_snapshot}}, projection=dict.fromkeys(CAMPOS_PRODUTO, 1))
+        produtos = {p["_id"]: p async for p in cursor}
+    return [
+        montar_linha_view(v, v.get("produto") or produtos.get(v["produtos_id"]), clientes.get(v.get("cliente_id")))
+        for v in vendas
+    ]
+
+async def atualizar_vendas_view(saidas: list[dict], sinal: int = 1):
+    """Grava (``sinal=1``) ou remove (``sinal=-1``) as vendas da lista na view.
+
+    Como nos rollups, falhas são apenas registradas em log; ``rebuild_vendas_view``
+    corrige a coleção.
+    """
+    vendas = [s for s in saidas if s.get("tipo") == "venda"]
+    if not vendas:
+        return
+    try:
+        if sinal < 0:
+            await db.vendas_view.delete_many({"_id": {"$in": [v["_id"] for v in vendas]}})
+            return
+        linhas = await _montar_linhas(vendas)
+        await db.vendas_view.bulk_write([ReplaceOne({"_id": l["_id"]}, l, upsert=True) for l in linhas], ordered=False)
+    except Exception as e:
+        logging.warning("Falha ao atualizar vendas_view: %s", e)
+
+async def _propagar(filtro: dict, campos: dict):
+    try:
+        result = await db.vendas_view.update_many(filtro, {"$set": campos})
+        logging.info("vendas_view: %d vendas atualizadas (%s)", result.modified_count, filtro)
+    except Exception as e:
+        logging.warning("Falha ao propagar alteração para vendas_view (%s): %s", filtro, e)
+
+def _agendar(coro):
+    # mantém referência às tasks até terminarem (o event loop guarda só referências fracas)
+    task = asyncio.create_task(coro)
+    _pendentes.add(task)
+    task.add_done_callback(_pendentes.discard)
+    return task
+
+def propagar_cliente(cliente: dict | None, alterados) -> asyncio.Task | None:
+    """Agenda a atualização das vendas do cliente se algum campo exibido mudou."""
+    if not cliente or not set(alterados) & set(CAMPOS_CLIENTE):
+        return None
+    return _agendar(_propagar({"cliente_id": cliente["_id"]}, _achatar(cliente, CAMPOS_CLIENTE)))
+
+def propagar_produto(produto: dict | None, alterados) -> asyncio.Task | None:
+    """Agenda a atualização das vendas do produto se algum campo exibido mudou."""
+    if not produto or not set(alterados) & set(CAMPOS_PRODUTO):
+        return None
+    return _agendar(_propagar({"produtos_id": produto["_id"]}, _achatar(produto, CAMPOS_PRODUTO)))
+
+async def _remover_orfaos(ids: list):
+    existentes = {d["_id"] async for d in db.saidas.find({"_id": {"$in": ids}, "tipo": "venda"}, projection={"_id": 1})}
+    orfaos = [vid for vid in ids if vid not in existentes]
+    if orfaos:
+        await db.vendas_view.delete_many({"_id": {"$in": orfaos}})
+
+async def rebuild_vendas_view(apply: bool = True, somente_se_vazio: bool = False, batch_size: int = 1000) -> dict:
+    """Recalcula a view a partir das saídas do tipo venda.
+
+    Com ``apply=False`` apenas conta; ``somente_se_vazio`` só reconstrói quando
+    a coleção ainda está vazia (usado no startup).
+    """
+    if somente_se_vazio and await db.vendas_view.find_one({}, projection={"_id": 1}):
+        return {"vendas": 0}
+    total = 0
+    lote = []
+    async for saida in db.saidas.find({"tipo": "venda"}, batch_size=batch_size):
+        total += 1
+        lote.append(saida)
+        if len(lote) >= batch_size:
+            if apply:
+                await atualizar_vendas_view(lote)
+            lote = []
+    if apply and lote:
+        await atualizar_vendas_view(lote)
+    if apply:
+        # remove linhas de vendas que não existem mais em saidas
+        pedaco = []
+        async for linha in db.vendas_view.find({}, projection={"_id": 1}, batch_size=batch_size):
+            pedaco.append(linha["_id"])
+            if len(pedaco) >= batch_size:
+                await _remover_orfaos(pedaco)
+                pedaco = []
+        if pedaco:
+            await _remover_orfaos(pedaco)
+    return {"vendas": total}
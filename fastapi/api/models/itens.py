@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, validator
 from datetime import datetime
 from bson import ObjectId
 from typing import Optional
@@ -7,16 +7,28 @@ from .condicional_fornecedor import CondicionalFornecedor
 
 
 class Item(BaseModel):
+    # identificador estável do lote (usado para endereçar o lote nos updates)
+    lot_id: str = Field(default_factory=lambda: str(ObjectId()))
     quantity: int
     acquisition_date: datetime = Field(default_factory=datetime.utcnow)
-    # lista de ids de condicionais fornecedor associados a ESTA unidade
-    condicionais_fornecedor: list[str] = Field(default_factory=list)
-    # lista de ids de condicionais cliente associados a ESTA unidade (reservas)
-    condicionais_cliente: list[str] = Field(default_factory=list)
+    # unidades do lote por condicional fornecedor: {condicional_id: quantidade}
+    condicionais_fornecedor: dict[str, int] = Field(default_factory=dict)
+    # unidades do lote reservadas por condicional cliente: {condicional_id: quantidade}
+    condicionais_cliente: dict[str, int] = Field(default_factory=dict)
 
     # campos opcionais para incluir objetos embutidos (não usados para persistência obrigatória)
     conditional_cliente: Optional[CondicionalCliente] = None
     conditional_fornecedor: Optional[CondicionalFornecedor] = None
 
+    @validator('condicionais_fornecedor', 'condicionais_cliente', pre=True)
+    def reservas_como_mapa(cls, v):
+        # aceita o formato antigo (lista com um id por unidade)
+        if isinstance(v, list):
+            contagem = {}
+            for cid in v:
+                contagem[cid] = contagem.get(cid, 0) + 1
+            return contagem
+        return v or {}
+
     class Config:
         populate_by_name = True
\ No newline at end of file
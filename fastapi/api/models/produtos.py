@@ -21,9 +21,11 @@ class Produto(BaseModel):
     itens: List[Item]
     preco_custo: int
     preco_venda: int
-    saidas: List[Saida]
-    entradas: List[Entrada]
+    # histórico: fica nas coleções saidas/entradas (ver /produtos/{id}/entradas), não é gravado no produto
+    saidas: List[Saida] = Field(default_factory=list)
+    entradas: List[Entrada] = Field(default_factory=list)
     tags: List[Tag]
+    rev: int = 0  # revisão do documento, incrementada a cada alteração dos itens (controle otimista)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: Optional[datetime] = None
 
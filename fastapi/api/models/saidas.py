@@ -12,6 +12,7 @@ class Saida(BaseModel):
     fornecedor_id: Optional[str] = None
     condicional_fornecedor_id: Optional[str] = None
     condicional_cliente_id: Optional[str] = None
+    venda_id: Optional[str] = None  # cabeçalho da venda (carrinho), quando houver
     quantidade: int
     tipo: TypoSaida
     data_saida: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,26 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+from datetime import datetime
+from bson import ObjectId
+
+class VendaLinha(BaseModel):
+    produto_id: str
+    quantidade: int
+    valor_total: Optional[int] = None
+    observacoes: Optional[str] = None
+    saida_ids: list[str] = Field(default_factory=list)  # saídas geradas para esta linha
+
+# Cabeçalho de uma venda com vários produtos (carrinho); cada linha gera suas saídas
+class Venda(BaseModel):
+    id: str = Field(default_factory=lambda: str(ObjectId()), alias="_id")
+    cliente_id: Optional[str] = None
+    itens: list[VendaLinha] = Field(default_factory=list)
+    quantidade_total: int = 0
+    valor_total: Optional[int] = None
+    observacoes: Optional[str] = None
+    data_venda: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        populate_by_name = True
@@ -7,6 +7,7 @@ from ..database.condicional_cliente_db import (
     update_condicional_cliente, delete_condicional_cliente,
     enviar_produto_condicional_cliente, processar_retorno_condicional_cliente
 )
+from ..database.singleflight import single_flight
 from ..routers.auth import get_current_user
 
 router = APIRouter()
@@ -35,6 +36,7 @@ async def create_condicional_cliente_endpoint(condicional: CondicionalCliente):
     return {"id": condicional_id}
 
 @router.get("/", dependencies=[Depends(get_current_user)])
+@single_flight("condicionais_cliente")
 async def get_condicional_clientes_endpoint():
     return await get_condicional_clientes()
 
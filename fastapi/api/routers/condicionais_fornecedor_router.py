@@ -88,6 +88,7 @@ async def adicionar_produto_endpoint(condicional_id: str, request: AdicionarProd
 async def create_condicional_with_products_endpoint(request: CondicionalBatchRequest):
     """
     Cria uma condicional e insere múltiplos produtos associados em uma única chamada.
+    Tudo ou nada: com erro nenhum produto, entrada ou condicional fica gravado.
 
     Payload exemplo:
     {
@@ -98,6 +99,9 @@ async def create_condicional_with_products_endpoint(request: CondicionalBatchReq
     try:
         result = await create_condicional_with_produtos(request.condicional, request.produtos)
         return result
+    except ValueError as e:
+        # dados inválidos ou codigo_interno repetido/já cadastrado: nada foi gravado
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         # Log full traceback for debugging purposes
         logging.exception('Error in batch-create condicional with products')
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from ..models.produtos import Produto
 from ..database.produtos_db import (
     create_produto, get_produtos, get_produto_by_id,
     update_produto, delete_produto, can_delete_produto, get_produtos_by_tags, search_produtos,
     exists_codigo_interno, get_last_codigo_interno
 )
+from ..database.entradas_db import get_entradas_by_produto
+from ..database.importacao_db import importar_produtos, linhas_de_bytes, registros_csv, registros_ndjson
+from ..database.busca_db import buscar_produtos, buscar_por_codigo, buscar_por_prefixo_codigo
 from ..database.tags_db import get_tags, find_tags_by_query, get_or_create_tag_by_descricao, delete_tag
+from ..database.singleflight import single_flight
 from ..routers.auth import get_current_user
 
 router = APIRouter()
@@ -19,8 +23,38 @@ async def create_produto_endpoint(produto: Produto):
     return {"id": produto_id}
 
 @router.get("/", dependencies=[Depends(get_current_user)])
-async def get_produtos_endpoint():
-    return await get_produtos()
+@single_flight("produtos")
+async def get_produtos_endpoint(cursor: str | None = None, limit: int = 50, fields: str | None = None, resumo: bool = False,
+                                todos: bool = False, q: str | None = None, ativo: bool | None = None,
+                                sessao: str | None = None, marca_fornecedor: str | None = None,
+                                em_condicional_fornecedor: bool | None = None, em_condicional_cliente: bool | None = None,
+                                com_estoque: bool | None = None):
+    """
+    Lista produtos. Filtros opcionais: q (busca por termos), ativo, sessao, marca_fornecedor,
+    em_condicional_fornecedor, em_condicional_cliente e com_estoque (estoque_total > 0).
+    fields: campos retornados, separados por vírgula; resumo=true: só os campos de listagem.
+    Retorna uma página ({"items", "next_cursor"}, até `limit` itens, máx. 200); para as
+    seguintes envie `cursor` com o `next_cursor` recebido.
+    todos=true: lista completa, sem paginação (sem entradas/saidas embutidas).
+    """
+    return await get_produtos(cursor=cursor, limit=limit, fields=fields, resumo=resumo, todos=todos, q=q, ativo=ativo,
+                              sessao=sessao, marca_fornecedor=marca_fornecedor,
+                              em_condicional_fornecedor=em_condicional_fornecedor,
+                              em_condicional_cliente=em_condicional_cliente, com_estoque=com_estoque)
+
+@router.post("/import", dependencies=[Depends(get_current_user)])
+async def importar_produtos_endpoint(request: Request, formato: str = 'csv', dry_run: bool = False):
+    """
+    Importa produtos em lote a partir do corpo da requisição (o arquivo CSV com
+    cabeçalho ou NDJSON, enviado como está, sem multipart). O corpo é lido em fluxo
+    e gravado em blocos; retorna o relatório com os erros por linha.
+    dry_run=true apenas valida.
+    """
+    if formato not in ('csv', 'ndjson'):
+        raise HTTPException(status_code=400, detail="formato deve ser 'csv' ou 'ndjson'")
+    linhas = linhas_de_bytes(request.stream())
+    registros = registros_csv(linhas) if formato == 'csv' else registros_ndjson(linhas)
+    return await importar_produtos(registros, apply=not dry_run)
 
 @router.get("/{produto_id}", dependencies=[Depends(get_current_user)])
 async def get_produto(produto_id: str):
@@ -29,6 +63,11 @@ async def get_produto(produto_id: str):
         raise HTTPException(status_code=404, detail="Produto not found")
     return produto
 
+@router.get("/{produto_id}/entradas", dependencies=[Depends(get_current_user)])
+async def get_entradas_produto(produto_id: str, cursor: str | None = None, limit: int = 50):
+    """Histórico de entradas do produto (mais recentes primeiro); envie o `next_cursor` para a próxima página."""
+    return await get_entradas_by_produto(produto_id, cursor=cursor, limit=limit)
+
 @router.put("/{produto_id}", dependencies=[Depends(get_current_user)])
 async def update_produto_endpoint(produto_id: str, update_data: dict):
     # If codigo_interno is being changed, ensure uniqueness excluding this document
@@ -54,8 +93,29 @@ async def delete_produto_endpoint(produto_id: str):
     return {"message": "Produto deleted"}
 
 @router.get("/search/", dependencies=[Depends(get_current_user)])
-async def search_produtos_endpoint(query: str):
-    return await search_produtos(query)
+async def search_produtos_endpoint(query: str, limit: int = 50):
+    # Resumo (sem itens/entradas) ordenado por relevância; itens em GET /produtos/{id}
+    return await search_produtos(query, limit=limit)
+
+@router.get("/busca/", dependencies=[Depends(get_current_user)])
+async def busca_produtos_endpoint(q: str, limit: int = 20, cursor: str | None = None):
+    """Busca rápida para o PDV: resumo dos produtos por relevância, paginado por cursor."""
+    return await buscar_produtos(q, limit=min(limit, 100), cursor=cursor)
+
+@router.get("/codigo/", dependencies=[Depends(get_current_user)])
+async def buscar_por_codigo_endpoint(codigo: str, prefixo: bool = False, limit: int = 20):
+    """
+    Leitura de código de barras / código digitado no caixa.
+    Exato (padrão): retorna o produto cujo codigo_interno ou codigo_externo é o código
+    informado (sem diferenciar maiúsculas/acentos), com o estoque disponível atual.
+    prefixo=true: lista os produtos cujo código começa com o valor.
+    """
+    if prefixo:
+        return await buscar_por_prefixo_codigo(codigo, limit=min(limit, 100))
+    produto = await buscar_por_codigo(codigo)
+    if not produto:
+        raise HTTPException(status_code=404, detail="Produto not found")
+    return produto
 
 @router.get("/by-tags/", dependencies=[Depends(get_current_user)])
 async def get_produtos_by_tags_endpoint(tag_ids: str, mode: str = 'OR'):
@@ -1,60 +1,57 @@
 from fastapi import APIRouter, Depends, HTTPException
 from ..routers.auth import require_role
 from ..models.users import Role
-from ..database import condicional_fornecedor_db, condicional_cliente_db, desejo_cliente_db, tags_db, saidas_db, despesas_db, imposto_a_recolher_db
+from ..database import condicional_fornecedor_db, condicional_cliente_db, desejo_cliente_db, tags_db, saidas_db, despesas_db, imposto_a_recolher_db, produtos_db, rollup_db, metricas_db
+from ..database.rollup_db import DIMENSAO_TOTAL
+from ..database import cache, singleflight
+from ..database.cache import cached_report
+from ..database.singleflight import single_flight
 from datetime import datetime, timedelta
+import asyncio
+import time
 
 router = APIRouter(dependencies=[Depends(require_role(Role.ADMIN))])
-async def desempenho_condicionais_fornecedor():
-    # Para cada condicional fornecedor, calcular vendas, stock, devoluções possíveis
-    condicionais = await condicional_fornecedor_db.get_condicional_fornecedores()
-    result = []
-    for cond in condicionais:
-        # Peças vendidas: saídas relacionadas aos produtos
-        produtos_ids = cond["produtos_id"]
-        vendas = await saidas_db.db.saidas.count_documents({"produtos_id": {"$in": produtos_ids}, "tipo": "venda"})
-        
-        # Em stock: quantidade atual dos produtos
-        stock = 0
-        for pid in produtos_ids:
-            prod = await produtos_db.get_produto_by_id(pid)
-            if prod:
-                # Calcular quantidade: entradas - saídas
-                entradas = await saidas_db.db.entradas.find({"produtos_id": pid}).to_list(None)
-                saidas = await saidas_db.db.saidas.find({"produtos_id": pid}).to_list(None)
-                total_entradas = sum(e["quantidade"] for e in entradas)
-                total_saidas = sum(s["quantidade"] for s in saidas)
-                stock += total_entradas - total_saidas
-        
-        # Podem ser devolvidas: quantidade_max_devolucao
-        podem_devolver = cond.get("quantidade_max_devolucao") or 0
-        
-        result.append({
-            "condicional_id": cond["_id"],
-            "pecas_vendidas": vendas,
-            "em_stock": stock,
-            "podem_ser_devolvidas": podem_devolver
-        })
-    return result
+
+@router.get("/desempenho_condicionais_fornecedor")
+@cached_report("desempenho_condicionais_fornecedor")
+async def desempenho_condicionais_fornecedor(fornecedor_id: str | None = None, page: int = 1, per_page: int = 20):
+    # Para cada condicional fornecedor: vendas, devoluções, peças em stock e devoluções possíveis
+    return await condicional_fornecedor_db.get_desempenho_condicionais_fornecedor(
+        fornecedor_id=fornecedor_id, page=page, per_page=per_page
+    )
 
 @router.get("/estatisticas_condicionais_cliente")
+@cached_report("estatisticas_condicionais_cliente")
 async def estatisticas_condicionais_cliente():
-    condicionais = await condicional_cliente_db.get_condicionais_ativas()
-    total_pecas = 0
-    pecas_vendidas = 0
-    pecas_devolvidas = 0
-    
-    for cond in condicionais:
-        for prod in cond["produtos"]:
-            quantidade = prod["quantidade"]
-            total_pecas += quantidade
-            
-            # Verificar se foi vendido ou devolvido (assumindo que se não está mais em condicional, foi vendido)
-            # Para simplificar, contar saídas relacionadas
-            saidas = await saidas_db.db.saidas.find({"produtos_id": prod["produto_id"]}).to_list(None)
-            quantidade_saida = sum(s["quantidade"] for s in saidas)
-            pecas_vendidas += quantidade_saida
-            pecas_devolvidas += quantidade - quantidade_saida  # Assumindo que o resto foi devolvido
+    # Uma única agregação: soma as linhas das condicionais ativas por produto e
+    # busca as saídas de cada produto distinto uma só vez (índice produtos_id/tipo).
+    # Mantém a regra anterior: toda saída do produto conta como vendida em cada
+    # linha de condicional que o contém; o restante da linha conta como devolvido.
+    pipeline = [
+        {"$match": {"ativa": True}},
+        {"$unwind": "$produtos"},
+        {"$group": {
+            "_id": "$produtos.produto_id",
+            "quantidade": {"$sum": "$produtos.quantidade"},
+            "linhas": {"$sum": 1}
+        }},
+        {"$lookup": {
+            "from": "saidas",
+            "localField": "_id",
+            "foreignField": "produtos_id",
+            "pipeline": [{"$group": {"_id": None, "quantidade": {"$sum": "$quantidade"}}}],
+            "as": "saidas"
+        }},
+        {"$project": {
+            "quantidade": 1,
+            "vendidas": {"$multiply": ["$linhas", {"$ifNull": [{"$first": "$saidas.quantidade"}, 0]}]}
+        }},
+        {"$group": {"_id": None, "total_pecas": {"$sum": "$quantidade"}, "pecas_vendidas": {"$sum": "$vendidas"}}}
+    ]
+    docs = await condicional_cliente_db.db.condicional_clientes.aggregate(pipeline).to_list(None)
+    total_pecas = docs[0]["total_pecas"] if docs else 0
+    pecas_vendidas = docs[0]["pecas_vendidas"] if docs else 0
+    pecas_devolvidas = total_pecas - pecas_vendidas  # Assumindo que o resto foi devolvido
     
     porcentagem_vendidas = (pecas_vendidas / total_pecas * 100) if total_pecas > 0 else 0
     porcentagem_devolvidas = (pecas_devolvidas / total_pecas * 100) if total_pecas > 0 else 0
@@ -68,6 +65,7 @@ async def estatisticas_condicionais_cliente():
     }
 
 @router.get("/foco_compras")
+@cached_report("foco_compras")
 async def foco_compras():
     desejos = await desejo_cliente_db.get_desejos_clientes()
     tag_counts = {}
@@ -89,39 +87,57 @@ async def foco_compras():
     
     return result
 
-router = APIRouter(dependencies=[Depends(require_role(Role.ADMIN))])
-
 @router.get("/vendas_por_mes")
+@cached_report("vendas_por_mes")
 async def vendas_por_mes(ano: int):
+    # Lê os totais diários de vendas_rollup (no máximo 366 documentos por ano)
     pipeline = [
         {"$match": {
+            "dimensao": DIMENSAO_TOTAL,
             "tipo": "venda",
-            "data_saida": {"$gte": datetime(ano, 1, 1), "$lt": datetime(ano+1, 1, 1)}
+            "dia": {"$gte": datetime(ano, 1, 1), "$lt": datetime(ano+1, 1, 1)}
         }},
-        {"$group": {"_id": {"$month": "$data_saida"}, "total": {"$sum": "$valor_total"}}},
+        {"$group": {"_id": {"$month": "$dia"}, "total": {"$sum": "$valor_total"}}},
         {"$sort": {"_id": 1}}
     ]
-    result = await saidas_db.db.saidas.aggregate(pipeline).to_list(None)
+    result = await rollup_db.db.vendas_rollup.aggregate(pipeline).to_list(None)
     return result
 
+@router.get("/vendas_por_dimensao")
+@cached_report("vendas_por_dimensao")
+async def vendas_por_dimensao(dimensao: str, date_from: str, date_to: str, tipo: str = "venda"):
+    # Totais por tag, marca_fornecedor ou sessao no período, a partir de vendas_rollup
+    if dimensao not in ("tag", "marca_fornecedor", "sessao"):
+        raise HTTPException(status_code=400, detail="dimensao deve ser tag, marca_fornecedor ou sessao")
+    pipeline = [
+        {"$match": {
+            "dimensao": dimensao,
+            "tipo": tipo,
+            "dia": {"$gte": datetime.fromisoformat(date_from), "$lte": datetime.fromisoformat(date_to)}
+        }},
+        {"$group": {
+            "_id": "$valor",
+            "count": {"$sum": "$count"},
+            "quantidade": {"$sum": "$quantidade"},
+            "valor_total": {"$sum": "$valor_total"}
+        }},
+        {"$sort": {"valor_total": -1}}
+    ]
+    return await rollup_db.db.vendas_rollup.aggregate(pipeline).to_list(None)
+
 @router.get("/estoque_baixo")
+@cached_report("estoque_baixo")
 async def estoque_baixo(limite: int = 5):
-    # Assumindo que produtos têm campo 'quantidade' calculada
-    # Para simplificar, vamos usar entradas - saidas
+    # Usa o contador materializado estoque_total (mantido a cada movimentação)
     pipeline = [
-        {"$lookup": {"from": "entradas", "localField": "_id", "foreignField": "produtos_id", "as": "entradas"}},
-        {"$lookup": {"from": "saidas", "localField": "_id", "foreignField": "produtos_id", "as": "saidas"}},
-        {"$addFields": {
-            "total_entradas": {"$sum": "$entradas.quantidade"},
-            "total_saidas": {"$sum": "$saidas.quantidade"},
-            "quantidade": {"$subtract": ["$total_entradas", "$total_saidas"]}
-        }},
-        {"$match": {"quantidade": {"$lt": limite}}},
+        {"$match": {"estoque_total": {"$lt": limite}}},
+        {"$addFields": {"quantidade": "$estoque_total"}},
         {"$project": {"entradas": 0, "saidas": 0}}
     ]
     return await produtos_db.db.produtos.aggregate(pipeline).to_list(None)
 
 @router.get("/lucro")
+@cached_report("lucro")
 async def lucro(mes: int, ano: int):
     # Faturamento do mês
     vendas = await faturamento_item_db.get_faturamento_itens_por_mes(mes, ano)
@@ -133,32 +149,62 @@ async def lucro(mes: int, ano: int):
     
     return {"lucro": total_vendas - total_despesas, "vendas": total_vendas, "despesas": total_despesas}
 
-@router.get("/dashboard")
-async def get_dashboard():
-    today = datetime.today()
+async def _medir(nome: str, coro, latencias: dict):
+    """Aguarda ``coro`` registrando em ``latencias`` o tempo (ms) da seção ``nome``."""
+    inicio = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        latencias[nome] = round((time.perf_counter() - inicio) * 1000, 1)
+
+def _soma_vendas(de: datetime, ate: datetime | None = None, agrupar_por=None) -> list:
+    """Sub-pipeline do $facet: soma valor_total dos dias de vendas no intervalo [de, ate]."""
+    faixa = {"$gte": de}
+    if ate is not None:
+        faixa["$lte"] = ate
+    etapas = [
+        {"$match": {"dia": faixa}},
+        {"$group": {"_id": agrupar_por, "sales": {"$sum": "$valor_total"}}},
+    ]
+    if agrupar_por is not None:
+        etapas.append({"$sort": {"_id": 1}})
+    return etapas
+
+async def _dashboard_vendas(today: datetime) -> dict:
+    """Métricas de vendas do dashboard num único $facet sobre os totais diários de
+    `vendas_rollup` (a partir do início da seção mais antiga)."""
+    today = rollup_db.dia_da_saida(today)
     start_of_month = today.replace(day=1)
     start_of_last_month = (start_of_month - timedelta(days=1)).replace(day=1)
     end_of_last_month = start_of_month - timedelta(days=1)
-
-    # Daily Sales: last 30 days, only vendas
     thirty_days_ago = today - timedelta(days=30)
-    daily_sales_pipeline = [
-        {"$match": {"data_saida": {"$gte": thirty_days_ago}, "tipo": "venda"}},
-        {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$data_saida"}}, "sales": {"$sum": "$valor_total"}}},
-        {"$sort": {"_id": 1}}
-    ]
-    daily_sales_cursor = saidas_db.db.saidas.aggregate(daily_sales_pipeline)
-    daily_sales = [{"date": doc["_id"], "sales": doc["sales"]} async for doc in daily_sales_cursor]
-
-    # Weekly Sales: last 5 weeks with variation
     five_weeks_ago = today - timedelta(weeks=5)
-    weekly_sales_pipeline = [
-        {"$match": {"data_saida": {"$gte": five_weeks_ago}, "tipo": "venda"}},
-        {"$group": {"_id": {"$isoWeek": "$data_saida"}, "sales": {"$sum": "$valor_total"}}},
-        {"$sort": {"_id": 1}}
+    start_of_week = today - timedelta(days=today.weekday())
+    start_of_last_week = start_of_week - timedelta(weeks=1)
+    end_of_last_week = start_of_week - timedelta(days=1)
+
+    inicio = min(start_of_last_month, thirty_days_ago, five_weeks_ago, start_of_last_week)
+    pipeline = [
+        {"$match": {"dimensao": DIMENSAO_TOTAL, "tipo": "venda", "dia": {"$gte": inicio}}},
+        {"$facet": {
+            # Daily Sales: last 30 days
+            "daily": _soma_vendas(thirty_days_ago, agrupar_por={"$dateToString": {"format": "%Y-%m-%d", "date": "$dia"}}),
+            # Weekly Sales: last 5 weeks
+            "weekly": _soma_vendas(five_weeks_ago, agrupar_por={"$isoWeek": "$dia"}),
+            # Monthly Comparison: last month vs current month
+            "current_month": _soma_vendas(start_of_month),
+            "last_month": _soma_vendas(start_of_last_month, end_of_last_month),
+            # Weekly Comparison: current week vs last week, day by day
+            "current_week": _soma_vendas(start_of_week, agrupar_por={"$dayOfWeek": "$dia"}),
+            "last_week": _soma_vendas(start_of_last_week, end_of_last_week, agrupar_por={"$dayOfWeek": "$dia"}),
+        }}
     ]
-    weekly_sales_cursor = saidas_db.db.saidas.aggregate(weekly_sales_pipeline)
-    weekly_sales_docs = [doc async for doc in weekly_sales_cursor]
+    docs = await rollup_db.db.vendas_rollup.aggregate(pipeline).to_list(None)
+    facets = docs[0] if docs else {}
+
+    daily_sales = [{"date": doc["_id"], "sales": doc["sales"]} for doc in facets.get("daily", [])]
+
+    weekly_sales_docs = facets.get("weekly", [])
     weekly_sales = []
     for i, doc in enumerate(weekly_sales_docs):
         variation = 0.0
@@ -169,46 +215,12 @@ async def get_dashboard():
         # For simplicity, use week number, frontend can format
         weekly_sales.append({"week": f"Semana {i+1}", "total": doc["sales"], "variation": variation})
 
-    # Monthly Comparison: last month vs current month
-    current_month_pipeline = [
-        {"$match": {"data_saida": {"$gte": start_of_month}, "tipo": "venda"}},
-        {"$group": {"_id": None, "sales": {"$sum": "$valor_total"}}}
-    ]
-    last_month_pipeline = [
-        {"$match": {"data_saida": {"$gte": start_of_last_month, "$lte": end_of_last_month}, "tipo": "venda"}},
-        {"$group": {"_id": None, "sales": {"$sum": "$valor_total"}}}
-    ]
-    current_month_cursor = saidas_db.db.saidas.aggregate(current_month_pipeline)
-    current_month_docs = [doc async for doc in current_month_cursor]
-    current_sales = current_month_docs[0]["sales"] if current_month_docs else 0
-
-    last_month_cursor = saidas_db.db.saidas.aggregate(last_month_pipeline)
-    last_month_docs = [doc async for doc in last_month_cursor]
-    last_sales = last_month_docs[0]["sales"] if last_month_docs else 0
-
+    current_sales = facets["current_month"][0]["sales"] if facets.get("current_month") else 0
+    last_sales = facets["last_month"][0]["sales"] if facets.get("last_month") else 0
     monthly_comparison = {"lastMonth": last_sales, "currentMonth": current_sales}
 
-    # Weekly Comparison: current week vs last week, day by day
-    start_of_week = today - timedelta(days=today.weekday())
-    start_of_last_week = start_of_week - timedelta(weeks=1)
-    end_of_last_week = start_of_week - timedelta(days=1)
-
-    current_week_pipeline = [
-        {"$match": {"data_saida": {"$gte": start_of_week}, "tipo": "venda"}},
-        {"$group": {"_id": {"$dayOfWeek": "$data_saida"}, "sales": {"$sum": "$valor_total"}}},
-        {"$sort": {"_id": 1}}
-    ]
-    last_week_pipeline = [
-        {"$match": {"data_saida": {"$gte": start_of_last_week, "$lte": end_of_last_week}, "tipo": "venda"}},
-        {"$group": {"_id": {"$dayOfWeek": "$data_saida"}, "sales": {"$sum": "$valor_total"}}},
-        {"$sort": {"_id": 1}}
-    ]
-    current_week_cursor = saidas_db.db.saidas.aggregate(current_week_pipeline)
-    current_week_docs = {doc["_id"]: doc["sales"] async for doc in current_week_cursor}
-
-    last_week_cursor = saidas_db.db.saidas.aggregate(last_week_pipeline)
-    last_week_docs = {doc["_id"]: doc["sales"] async for doc in last_week_cursor}
-
+    current_week_docs = {doc["_id"]: doc["sales"] for doc in facets.get("current_week", [])}
+    last_week_docs = {doc["_id"]: doc["sales"] for doc in facets.get("last_week", [])}
     day_names = {1: "Segunda", 2: "Terça", 3: "Quarta", 4: "Quinta", 5: "Sexta", 6: "Sábado", 7: "Domingo"}
     weekly_comparison = []
     for day in range(1, 8):  # 1=Monday, 7=Sunday
@@ -216,46 +228,71 @@ async def get_dashboard():
         last = last_week_docs.get(day, 0)
         weekly_comparison.append({"day": day_names[day], "currentWeek": current, "previousWeek": last})
 
-    # Other metrics
-    faturamento_mes_corrente = current_sales
-    gasto_mes_corrente_pipeline = [
-        {"$match": {"data_despesa": {"$gte": start_of_month}}},
-        {"$group": {"_id": None, "total": {"$sum": "$valor"}}}
-    ]
-    gasto_cursor = despesas_db.db.despesas.aggregate(gasto_mes_corrente_pipeline)
-    gasto_docs = [doc async for doc in gasto_cursor]
-    gasto_mes_corrente = gasto_docs[0]["total"] if gasto_docs else 0
+    return {
+        "faturamentoMesCorrente": current_sales,
+        "dailySales": daily_sales,
+        "weeklySales": weekly_sales,
+        "monthlyComparison": monthly_comparison,
+        "weeklyComparison": weekly_comparison,
+    }
 
-    # Pecas em condicionais: count from condicional_cliente
-    pecas_em_condicionais = await condicional_cliente_db.db.condicional_clientes.count_documents({})
+async def _soma_colecao(colecao, campo: str, filtro: dict | None = None, operador: str = "$sum"):
+    pipeline = [{"$group": {"_id": None, "total": {operador: f"${campo}"}}}]
+    if filtro:
+        pipeline.insert(0, {"$match": filtro})
+    docs = await colecao.aggregate(pipeline).to_list(None)
+    return docs[0]["total"] if docs else 0
 
-    # Percentual conversao condicionais: assume some logic, placeholder
-    percentual_conversao_condicionais = 75.0  # Need to calculate based on converted vs total
+@router.get("/dashboard")
+async def get_dashboard():
+    # As latências por seção e ``calculadoEm`` vêm do payload em cache (são do
+    # cálculo que o gerou); ``cache`` e ``total`` são desta resposta
+    inicio = time.perf_counter()
+    recebido_em = datetime.utcnow()
+    dados = await _dashboard_dados()
+    calculado_em = dados.get("calculadoEm")
+    calculado_agora = calculado_em is not None and datetime.fromisoformat(calculado_em) >= recebido_em
+    return {
+        **dados,
+        "cache": "miss" if calculado_agora else "hit",
+        "latenciasMs": {**dados.get("latenciasMs", {}), "total": round((time.perf_counter() - inicio) * 1000, 1)},
+    }
+
+@single_flight("dashboard")
+@cached_report("dashboard")
+async def _dashboard_dados():
+    calculado_em = datetime.utcnow()
+    today = datetime.today()
+    start_of_month = today.replace(day=1)
+    latencias = {}
 
-    # Pecas devolvidas por condicional: placeholder
-    pecas_devolvidas_por_condicional = 30
+    # As métricas de vendas saem de uma única agregação em `vendas_rollup`; as
+    # demais coleções são consultadas em paralelo com ela
+    vendas, gasto_mes_corrente, pecas_em_condicionais, metricas_mes, ticket_medio_condicional, impostos_a_recolher = await asyncio.gather(
+        _medir("vendas", _dashboard_vendas(today), latencias),
+        _medir("despesas", _soma_colecao(despesas_db.db.despesas, "valor", {"data_despesa": {"$gte": start_of_month}}), latencias),
+        # Pecas em condicionais: contador mantido no envio/retorno de condicionais
+        _medir("condicionais", metricas_db.get_pecas_em_condicional(), latencias),
+        # Contadores do mês: peças enviadas/vendidas/devolvidas e taxas de meios de pagamento
+        _medir("metricas", metricas_db.get_metricas_mes(), latencias),
+        # Ticket medio condicional: average valor_total from condicional_cliente
+        _medir("ticket_condicional", _soma_colecao(condicional_cliente_db.db.condicional_clientes, "valor_total", operador="$avg"), latencias),
+        # Impostos a recolher: sum from imposto_a_recolher
+        _medir("impostos", _soma_colecao(imposto_a_recolher_db.db.imposto_a_recolher, "valor"), latencias),
+    )
 
-    # Ticket medio condicional: average valor_total from condicional_cliente
-    ticket_pipeline = [
-        {"$group": {"_id": None, "avg": {"$avg": "$valor_total"}}}
-    ]
-    ticket_cursor = condicional_cliente_db.db.condicional_clientes.aggregate(ticket_pipeline)
-    ticket_docs = [doc async for doc in ticket_cursor]
-    ticket_medio_condicional = ticket_docs[0]["avg"] if ticket_docs else 0
+    conversao = metricas_db.resumo_conversao(metricas_mes)
+    # Percentual conversao condicionais: peças vendidas sobre peças retornadas no mês
+    percentual_conversao_condicionais = conversao["percentual_conversao"]
 
-    # Impostos a recolher: sum from imposto_a_recolher
-    imposto_pipeline = [
-        {"$group": {"_id": None, "total": {"$sum": "$valor"}}}
-    ]
-    imposto_cursor = imposto_a_recolher_db.db.imposto_a_recolher.aggregate(imposto_pipeline)
-    imposto_docs = [doc async for doc in imposto_cursor]
-    impostos_a_recolher = imposto_docs[0]["total"] if imposto_docs else 0
+    # Pecas devolvidas por condicional encerrada no mês
+    pecas_devolvidas_por_condicional = conversao["pecas_devolvidas_por_condicional"]
 
-    # Despesas meios pagamento: sum from modalidade_pagamento or something, placeholder
-    despesas_meios_pagamento = 1500
+    # Despesas meios pagamento: taxas das modalidades de pagamento no mês
+    despesas_meios_pagamento = conversao["taxas_meios_pagamento"]
 
     return {
-        "faturamentoMesCorrente": faturamento_mes_corrente,
+        "faturamentoMesCorrente": vendas["faturamentoMesCorrente"],
         "gastoMesCorrente": gasto_mes_corrente,
         "pecasEmCondicionais": pecas_em_condicionais,
         "percentualConversaoCondicionais": percentual_conversao_condicionais,
@@ -263,8 +300,15 @@ async def get_dashboard():
         "ticketMedioCondicional": ticket_medio_condicional,
         "impostosARecolher": impostos_a_recolher,
         "despesasMeiosPagamento": despesas_meios_pagamento,
-        "dailySales": daily_sales,
-        "weeklySales": weekly_sales,
-        "monthlyComparison": monthly_comparison,
-        "weeklyComparison": weekly_comparison,
-    }
\ No newline at end of file
+        "dailySales": vendas["dailySales"],
+        "weeklySales": vendas["weeklySales"],
+        "monthlyComparison": vendas["monthlyComparison"],
+        "weeklyComparison": vendas["weeklyComparison"],
+        "latenciasMs": latencias,
+        "calculadoEm": calculado_em.isoformat(),
+    }
+
+@router.get("/cache")
+async def cache_stats():
+    # Contadores de hit/miss do cache de relatórios e das leituras coalescidas
+    return {**cache.stats(), "single_flight": singleflight.stats()}
@@ -1,12 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
+from datetime import datetime
+import csv
+import io
+import json
 from ..database.vendas_db import (
     processar_venda_produto,
+    processar_vendas_batch,
+    processar_venda_carrinho,
     get_estoque_disponivel_por_produto
 )
-from ..database.saidas_db import get_saidas_filtered, delete_saida
-from ..database.clientes_db import get_cliente_by_id
+from ..database.saidas_db import get_saidas_filtered, get_saidas_cursor, iterar_vendas_export, delete_saida
+from ..database.clientes_db import get_cliente_by_id, get_clientes_ids_existentes
 from ..routers.auth import get_current_user
 
 router = APIRouter()
@@ -18,6 +25,17 @@ class VendaRequest(BaseModel):
     valor_total: Optional[int] = None
     observacoes: Optional[str] = None
 
+class CarrinhoItem(BaseModel):
+    produto_id: str
+    quantidade: int
+    valor_total: Optional[int] = None
+    observacoes: Optional[str] = None
+
+class CarrinhoRequest(BaseModel):
+    itens: list[CarrinhoItem]
+    cliente_id: Optional[str] = None
+    observacoes: Optional[str] = None
+
 @router.post("/", dependencies=[Depends(get_current_user)])
 async def criar_venda(venda: VendaRequest):
     """
@@ -46,27 +64,56 @@ async def criar_venda(venda: VendaRequest):
 @router.post("/batch", dependencies=[Depends(get_current_user)])
 async def criar_vendas_batch(vendas: list[VendaRequest]):
     """
-    Cria múltiplas vendas em batch. Retorna lista de resultados por venda.
+    Cria múltiplas vendas em batch. Retorna lista de resultados por venda (na ordem recebida).
     Não é transacional: cada venda é processada individualmente e resultado agregado.
+    Os clientes são validados numa única consulta; produtos diferentes são
+    processados em paralelo e as linhas de um mesmo produto em sequência.
     """
-    results = []
-    for v in vendas:
-        # validate cliente
-        if v.cliente_id:
-            cliente = await get_cliente_by_id(v.cliente_id)
-            if not cliente:
-                results.append({"error": "cliente_id not found", "venda": v.dict()})
-                continue
-        res = await processar_venda_produto(
-            produto_id=v.produto_id,
-            quantidade=v.quantidade,
-            cliente_id=v.cliente_id,
-            valor_total=v.valor_total,
-            observacoes=v.observacoes
-        )
-        results.append(res)
+    clientes_validos = await get_clientes_ids_existentes(v.cliente_id for v in vendas if v.cliente_id)
+
+    results = [None] * len(vendas)
+    posicoes = []
+    linhas = []
+    for pos, v in enumerate(vendas):
+        if v.cliente_id and v.cliente_id not in clientes_validos:
+            results[pos] = {"error": "cliente_id not found", "venda": v.dict()}
+            continue
+        posicoes.append(pos)
+        linhas.append(v.dict())
+
+    for pos, res in zip(posicoes, await processar_vendas_batch(linhas)):
+        results[pos] = res
     return {"results": results}
 
+@router.post("/carrinho", dependencies=[Depends(get_current_user)])
+async def criar_venda_carrinho(carrinho: CarrinhoRequest):
+    """
+    Cria uma venda com vários produtos (carrinho) numa única requisição.
+    Baixa o estoque FIFO de todas as linhas, grava um cabeçalho em `vendas`
+    referenciando as saídas e retorna um recibo consolidado. Tudo ou nada:
+    400 se faltar estoque, 409 se uma linha perder a corrida para outra venda.
+    """
+    if carrinho.cliente_id:
+        cliente = await get_cliente_by_id(carrinho.cliente_id)
+        if not cliente:
+            raise HTTPException(status_code=400, detail="cliente_id not found")
+
+    for item in carrinho.itens:
+        if item.quantidade < 1:
+            raise HTTPException(status_code=400, detail=f"Quantidade inválida para o produto {item.produto_id}")
+
+    result = await processar_venda_carrinho(
+        linhas=[item.dict() for item in carrinho.itens],
+        cliente_id=carrinho.cliente_id,
+        observacoes=carrinho.observacoes
+    )
+
+    if result.get("error"):
+        # falhas: alguma linha não pôde ser baixada (estoque vendido no meio do caminho); nada foi vendido
+        raise HTTPException(status_code=409 if result.get("falhas") else 400, detail=result)
+
+    return result
+
 @router.get("/estoque/{produto_id}", dependencies=[Depends(get_current_user)])
 async def get_estoque_disponivel(produto_id: str):
     """
@@ -77,12 +124,15 @@ async def get_estoque_disponivel(produto_id: str):
 
 @router.get("/", dependencies=[Depends(get_current_user)])
 async def listar_vendas(page: int = 1, per_page: int = 20, date_from: str | None = None, date_to: str | None = None,
-                        produto_id: str | None = None, produto_query: str | None = None, tag_ids: str | None = None, cliente_id: str | None = None, sort_by: str = 'data', order: str = 'desc'):
+                        produto_id: str | None = None, produto_query: str | None = None, tag_ids: str | None = None, cliente_id: str | None = None, sort_by: str = 'data', order: str = 'desc',
+                        cursor: str | None = None, incluir_total: bool = False):
     """
     Lista vendas (saidas tipo 'venda') com filtros, paginação e ordenação.
 
     Por padrão retorna as vendas de hoje quando nenhum filtro de data for fornecido.
     tag_ids (opcional): lista de ids separadas por vírgula para filtrar produtos que possuam qualquer uma das tags.
+    cursor (opcional): ativa a paginação por cursor; envie vazio na primeira página e depois
+    o `next_cursor` recebido. Nesse modo `page` é ignorado e `total` só vem com incluir_total=true.
     """
     # Se não foi fornecido filtro de data, usar hoje como padrão
     from datetime import datetime
@@ -94,12 +144,18 @@ async def listar_vendas(page: int = 1, per_page: int = 20, date_from: str | None
     try:
         tag_list = [t for t in (tag_ids or '').split(',') if t]
         tag_list = tag_list if tag_list else None
+        if cursor is not None:
+            return await get_saidas_cursor(cursor=cursor, per_page=per_page, date_from=date_from, date_to=date_to,
+                                           produto_id=produto_id, produto_query=produto_query, tag_ids=tag_list, cliente_id=cliente_id,
+                                           sort_by=sort_by, order=order, incluir_total=incluir_total)
         result = await get_saidas_filtered(page=page, per_page=per_page, date_from=date_from, date_to=date_to,
                                        produto_id=produto_id, produto_query=produto_query, tag_ids=tag_list, cliente_id=cliente_id, sort_by=sort_by, order=order)
         # debug logs
         print(f"listar_vendas called: page={page}, per_page={per_page}, date_from={date_from}, date_to={date_to}, produto_id={produto_id}, produto_query={produto_query}, tag_list={tag_list}")
         print("listar_vendas result:", result)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         # Log for debugging in server logs
         import traceback
@@ -110,6 +166,54 @@ async def listar_vendas(page: int = 1, per_page: int = 20, date_from: str | None
 
 
 
+# Colunas do CSV de exportação (mesmos campos da listagem)
+EXPORT_COLUNAS = [
+    "_id", "data_saida", "produtos_id", "produto_codigo_interno", "produto_descricao", "quantidade",
+    "valor_total", "preco_venda", "cliente_id", "cliente_nome", "cliente_telefone", "cliente_cpf",
+    "venda_id", "observacoes",
+]
+
+def _valor_export(valor):
+    return valor.isoformat() if isinstance(valor, datetime) else valor
+
+async def _linhas_ndjson(vendas):
+    async for venda in vendas:
+        yield json.dumps({k: _valor_export(v) for k, v in venda.items()}, ensure_ascii=False, default=str) + "\n"
+
+async def _linhas_csv(vendas):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUNAS)
+    async for venda in vendas:
+        writer.writerow([_valor_export(venda.get(coluna)) for coluna in EXPORT_COLUNAS])
+        # cada linha sai assim que é escrita; o buffer nunca guarda mais que uma
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+@router.get("/export", dependencies=[Depends(get_current_user)])
+async def exportar_vendas(formato: str = 'ndjson', date_from: str | None = None, date_to: str | None = None,
+                          produto_id: str | None = None, produto_query: str | None = None, tag_ids: str | None = None,
+                          cliente_id: str | None = None, sort_by: str = 'data', order: str = 'desc'):
+    """
+    Exporta todas as vendas do filtro (mesmos filtros da listagem) como NDJSON ou CSV.
+    A resposta é transmitida conforme o cursor avança, sem carregar o resultado inteiro
+    em memória. Sem filtro de data exporta todo o histórico.
+    """
+    if formato not in ('ndjson', 'csv'):
+        raise HTTPException(status_code=400, detail="formato deve ser 'ndjson' ou 'csv'")
+    tag_list = [t for t in (tag_ids or '').split(',') if t] or None
+    vendas = iterar_vendas_export(date_from=date_from, date_to=date_to, produto_id=produto_id, produto_query=produto_query,
+                                  tag_ids=tag_list, cliente_id=cliente_id, sort_by=sort_by, order=order)
+    if formato == 'csv':
+        conteudo, media_type = _linhas_csv(vendas), "text/csv; charset=utf-8"
+    else:
+        conteudo, media_type = _linhas_ndjson(vendas), "application/x-ndjson"
+    nome = f"vendas_{datetime.utcnow():%Y%m%d}.{formato}"
+    return StreamingResponse(conteudo, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{nome}"'})
+
 @router.get("/cliente/{cliente_id}", dependencies=[Depends(get_current_user)])
 async def listar_vendas_cliente(cliente_id: str, page: int = 1, per_page: int = 20, date_from: str | None = None, date_to: str | None = None,
                                 sort_by: str = 'data', order: str = 'desc'):
@@ -1,10 +1,17 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
 import os
 import api.models
 from passlib.context import CryptContext
 from api.models.users import User, Role
+from api.database import connection
+from api.database.indexes import ensure_indexes
+from api.database.estoque_db import rebuild_estoque_dos_itens
+from api.database.rollup_db import rebuild_rollup
+from api.database.vendas_view_db import rebuild_vendas_view
+from api.database.busca_db import rebuild_termos_busca
 from api.routers import (
     auth,
     reports,
@@ -21,20 +28,37 @@ from api.routers import (
     vendas_router,
 )
 
-app = FastAPI()
-
 # Contexto de hash de senha
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
-@app.on_event("startup")
+_startup_task: asyncio.Task | None = None
+
+async def _background_startup(db):
+    await ensure_indexes(db)
+    try:
+        await rebuild_estoque_dos_itens(somente_faltantes=True)
+    except Exception as e:
+        print("Falha ao materializar contadores de estoque:", e)
+    try:
+        await rebuild_rollup(somente_se_vazio=True)
+    except Exception as e:
+        print("Falha ao construir vendas_rollup:", e)
+    try:
+        await rebuild_vendas_view(somente_se_vazio=True)
+    except Exception as e:
+        print("Falha ao construir vendas_view:", e)
+    try:
+        await rebuild_termos_busca(somente_faltantes=True)
+    except Exception as e:
+        print("Falha ao gerar termos de busca dos produtos:", e)
+
 async def startup_event():
-    # Conectar ao MongoDB
-    mongodb_url = os.getenv("MONGODB_URL", "mongodb://localhost:27017/projeto_silvana")
-    client = AsyncIOMotorClient(mongodb_url)
-    db = client.get_database("projeto_silvana")
+    # Client compartilhado (pool único por processo, configurado via env)
+    connection.connect()
+    db = connection.get_db()
     
     # Verificar se o usuário admin existe
     admin_user = await db.users.find_one({"email": "admin"})
@@ -53,15 +77,26 @@ async def startup_event():
     else:
         print("Usuário admin já existe.")
 
-    # Garantir índices
+    # Garantir índices do registro central e contadores de estoque dos produtos
+    # antigos em background (não bloqueia o startup)
+    global _startup_task
+    _startup_task = asyncio.create_task(_background_startup(db))
+
+async def shutdown_event():
+    if _startup_task is not None and not _startup_task.done():
+        _startup_task.cancel()
+    # Fecha o pool compartilhado (libera conexões no mongod)
+    connection.close()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup_event()
     try:
-        await db.produtos.create_index("codigo_interno", unique=True)
-        print("Índice único para codigo_interno garantido.")
-    except Exception as e:
-        print("Falha ao criar índice de codigo_interno:", e)
-    
-    # Fechar conexão (opcional, pois Motor gerencia conexões)
-    # client.close()
+        yield
+    finally:
+        await shutdown_event()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configurar CORS via variável de ambiente ALLOWED_ORIGINS (comma-separated).
 # Exemplo: ALLOWED_ORIGINS=http://localhost:5173,http://127.0.0.1:5173
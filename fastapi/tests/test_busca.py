@@ -0,0 +1,112 @@
+import pytest
+from api.database import busca_db
+
+
+PRODUTO = {"codigo_interno": "VS-012", "codigo_externo": "789100", "descricao": "Vestido Longo Estampado",
+           "marca_fornecedor": "Maré Alta", "sessao": "Feminino", "tags": [{"_id": "t1", "descricao": "Verão"}]}
+
+
+def test_termos_sem_acento_e_codigo_compacto():
+    termos = busca_db.gerar_termos(PRODUTO)
+
+    assert {"vestido", "mare", "verao", "vs", "012", "vs012", "789100"} <= set(termos)
+    assert busca_db.tokenizar("  Calça JEANS-skinny ") == ["calca", "jeans", "skinny"]
+
+
+def test_faixas_codigo_exato_palavra_inteira_e_prefixo():
+    codigo, palavras, prefixos = busca_db.filtros_faixas("VS-012")
+
+    assert codigo == {"$or": [{"codigo_interno_norm": "vs-012"}, {"codigo_externo_norm": "vs-012"}]}
+    assert palavras == {"termos_busca": {"$all": ["vs", "012"]}, "$nor": [codigo]}
+    assert prefixos["$nor"] == [codigo, {"termos_busca": {"$all": ["vs", "012"]}}]
+    assert [r.pattern for r in prefixos["termos_busca"]["$all"]] == ["^vs", "^012"]
+    assert busca_db.filtros_faixas("  --  ") == []
+
+
+class _Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, ordem):
+        self.docs = sorted(self.docs, key=lambda d: (d["descricao_norm"], d["_id"]))
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, n):
+        return [dict(d) for d in self.docs]
+
+
+@pytest.mark.asyncio
+async def test_busca_pagina_pelas_faixas_com_cursor(monkeypatch):
+    # faixa de cada documento conforme o filtro recebido (índice do filtro em filtros_faixas)
+    por_faixa = {
+        0: [{"_id": "c1", "descricao_norm": "z"}],
+        1: [{"_id": f"p{i}", "descricao_norm": f"d{i}"} for i in range(3)],
+        2: [{"_id": "x1", "descricao_norm": "a"}],
+    }
+    filtros = busca_db.filtros_faixas("vestido")
+
+    class Produtos:
+        def find(self, filtro, projection=None):
+            base = filtro["$and"][0] if "$and" in filtro else filtro
+            docs = por_faixa[filtros.index(base)]
+            if "$and" in filtro:
+                cond = filtro["$and"][1]["$or"]
+                ultimo = (cond[1]["descricao_norm"], cond[1]["_id"]["$gt"])
+                docs = [d for d in docs if (d["descricao_norm"], d["_id"]) > ultimo]
+            return _Cursor(docs)
+
+    class Db:
+        produtos = Produtos()
+
+    monkeypatch.setattr(busca_db, "db", Db())
+
+    pagina1 = await busca_db.buscar_produtos("vestido", limit=3)
+    pagina2 = await busca_db.buscar_produtos("vestido", limit=3, cursor=pagina1["next_cursor"])
+
+    assert [d["_id"] for d in pagina1["items"]] == ["c1", "p0", "p1"]
+    assert [d["_id"] for d in pagina2["items"]] == ["p2", "x1"]
+    assert pagina2["next_cursor"] is None
+    assert "descricao_norm" not in pagina1["items"][0]
+
+
+def test_filtro_texto_produtos_usa_termos_e_codigos_indexados():
+    filtro = busca_db.filtro_texto_produtos("VS-0")
+
+    termos, interno, externo = filtro["$or"]
+    assert [r.pattern for r in termos["termos_busca"]["$all"]] == ["^vs", "^0"]
+    assert interno["codigo_interno_norm"].pattern == "^vs\\-0"
+    assert externo["codigo_externo_norm"].pattern == "^vs\\-0"
+    assert busca_db.filtro_texto_produtos("   ") is None
+
+
+def test_campos_de_codigo_normalizados():
+    campos = busca_db.campos_busca({"codigo_interno": " VS-012 ", "codigo_externo": 789100})
+
+    assert campos["codigo_interno_norm"] == "vs-012"
+    assert campos["descricao_norm"] == ""
+    assert campos["codigo_externo_norm"] == "789100"
+
+
+@pytest.mark.asyncio
+async def test_busca_por_codigo_e_uma_consulta_pontual(monkeypatch):
+    consultas = []
+
+    class Produtos:
+        async def find_one(self, filtro, projection=None):
+            consultas.append((filtro, projection))
+            return {"_id": "p1", "codigo_interno": "VS-012"}
+
+    class Db:
+        produtos = Produtos()
+
+    monkeypatch.setattr(busca_db, "db", Db())
+
+    for _ in range(2):
+        assert (await busca_db.buscar_por_codigo(" VS-012 "))["_id"] == "p1"
+    assert consultas == [(busca_db._filtro_codigo("vs-012"), busca_db.PROJECAO_RESUMO)] * 2
+    assert await busca_db.buscar_por_codigo("  ") is None
+    assert len(consultas) == 2
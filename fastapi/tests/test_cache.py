@@ -0,0 +1,60 @@
+import pytest
+from api.database import cache
+
+
+@pytest.mark.asyncio
+async def test_memory_store_expira_e_respeita_limite():
+    store = cache.MemoryCacheStore(max_entries=2)
+    await store.set("a", 1, ttl=60)
+    await store.set("b", 2, ttl=60)
+    await store.get("a")  # "a" passa a ser o mais recente
+    await store.set("c", 3, ttl=60)
+    assert (await store.get("a"), await store.get("b"), await store.get("c")) == (1, None, 3)
+
+    await store.set("d", 4, ttl=0)
+    assert await store.get("d") is None
+
+
+@pytest.mark.asyncio
+async def test_cached_report_conta_hits_e_invalida(monkeypatch):
+    monkeypatch.setattr(cache, "_stats", {"hits": 0, "misses": 0, "invalidacoes": 0})
+    cache.set_store(cache.MemoryCacheStore())
+    chamadas = []
+
+    @cache.cached_report("relatorio")
+    async def relatorio(ano: int, mes: int | None = None):
+        chamadas.append(ano)
+        return {"ano": ano}
+
+    try:
+        assert await relatorio(ano=2024) == {"ano": 2024}
+        assert await relatorio(ano=2024, mes=None) == {"ano": 2024}
+        await cache.invalidar_relatorios()
+        await relatorio(ano=2024)
+
+        assert chamadas == [2024, 2024]
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+    finally:
+        cache.set_store(cache._criar_store())
+
+
+@pytest.mark.asyncio
+async def test_editar_produto_invalida_relatorios(monkeypatch):
+    from api.database import produtos_db
+
+    class Produtos:
+        async def find_one_and_update(self, filtro, update, return_document=None):
+            return {"_id": "p1", "estoque_total": 1}
+
+    class Db:
+        produtos = Produtos()
+
+    monkeypatch.setattr(produtos_db, "db", Db())
+    monkeypatch.setattr(produtos_db, "propagar_produto", lambda produto, alterados: None)
+    cache.set_store(cache.MemoryCacheStore())
+    try:
+        await cache._store.set(cache.cache_key("estoque_baixo", {}), [], ttl=60)
+        await produtos_db.update_produto("p1", {"preco_venda": 100})
+        assert await cache._store.get(cache.cache_key("estoque_baixo", {})) is None
+    finally:
+        cache.set_store(cache._criar_store())
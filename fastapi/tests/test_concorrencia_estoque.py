@@ -0,0 +1,189 @@
+import asyncio
+import os
+from datetime import datetime
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from api.database import condicional_cliente_db, condicional_fornecedor_db, connection, estoque_db, produtos_db
+from api.database.condicional_fornecedor_db import processar_devolucoes_condicional_fornecedor
+from api.database.vendas_db import processar_venda_produto
+
+MONGODB_URL = os.getenv('MONGODB_URL', 'mongodb://localhost:27017')
+
+
+async def _mongo_disponivel():
+    client = AsyncIOMotorClient(MONGODB_URL, serverSelectionTimeoutMS=500)
+    try:
+        await client.admin.command('ping')
+        return True
+    except Exception:
+        return False
+    finally:
+        client.close()
+
+
+@pytest.mark.asyncio
+async def test_alterar_itens_repete_sobre_o_estado_novo(monkeypatch):
+    leituras = [
+        {"_id": "p1", "rev": 1, "itens": [{"lot_id": "a", "quantity": 5}]},
+        {"_id": "p1", "rev": 2, "itens": [{"lot_id": "a", "quantity": 3}]},  # uma venda gravou no meio
+    ]
+    gravacoes = []
+
+    class Produtos:
+        async def find_one(self, filtro, projection=None):
+            return leituras.pop(0)
+
+    class Db:
+        produtos = Produtos()
+
+    async def gravar(produto, itens):
+        gravacoes.append((produto["rev"], [it["quantity"] for it in itens]))
+        return produto["rev"] == 2
+
+    monkeypatch.setattr(estoque_db, "db", Db())
+    monkeypatch.setattr(estoque_db, "gravar_itens", gravar)
+
+    produto, itens = await estoque_db.alterar_itens("p1", lambda itens: itens[0].update(quantity=itens[0]["quantity"] - 1))
+
+    assert gravacoes == [(1, [4]), (2, [2])]
+    assert produto["rev"] == 2 and itens[0]["quantity"] == 2
+
+
+@pytest.mark.asyncio
+async def test_retorno_condicional_cliente_e_tudo_ou_nada(monkeypatch):
+    calc = {"condicional_id": "c1", "produtos": [
+        {"produto_id": "p1", "quantidade_enviada": 2, "quantidade_devolvida": 1, "quantidade_vendida": 1},
+        {"produto_id": "p2", "quantidade_enviada": 1, "quantidade_devolvida": 0, "quantidade_vendida": 1},
+    ]}
+    efeitos = []
+
+    async def calcular(condicional_id, codigos):
+        return calc
+
+    async def condicional(condicional_id):
+        return {"_id": condicional_id, "ativa": True}
+
+    async def alterar(produto_id, alterar):
+        if produto_id == "p2":
+            raise estoque_db.ProdutoAlterado(produto_id)
+        itens = [{"lot_id": "a", "quantity": 2, "condicionais_cliente": {"c1": 2}, "condicionais_fornecedor": {}}]
+        produto = {"_id": produto_id, "rev": 1, "itens": itens}
+        depois = estoque_db.copiar_lotes(itens)
+        alterar(depois)
+        efeitos.append(("alterado", produto_id))
+        return produto, depois
+
+    async def desfazer(produto_id, itens_antes, itens_depois):
+        efeitos.append(("desfeito", produto_id))
+        restaurado = estoque_db.devolver_lotes(itens_depois, itens_antes, itens_depois)
+        assert restaurado[0]["quantity"] == 2 and restaurado[0]["condicionais_cliente"] == {"c1": 2}
+        return True
+
+    async def registrar(*args, **kwargs):
+        efeitos.append(("registrado",))
+
+    monkeypatch.setattr(condicional_cliente_db, "calcular_retorno_condicional_cliente", calcular)
+    monkeypatch.setattr(condicional_cliente_db, "get_condicional_cliente_by_id", condicional)
+    monkeypatch.setattr(condicional_cliente_db, "alterar_itens", alterar)
+    monkeypatch.setattr(condicional_cliente_db, "desfazer_itens", desfazer)
+    for nome in ("incrementar_metricas", "incrementar_pecas_em_condicional", "registrar_saidas",
+                 "apos_gravar_saidas", "update_condicional_cliente"):
+        monkeypatch.setattr(condicional_cliente_db, nome, registrar)
+
+    result = await condicional_cliente_db.processar_retorno_condicional_cliente("c1", ["X"])
+
+    assert "error" in result
+    assert efeitos == [("alterado", "p1"), ("desfeito", "p1")]
+
+
+@pytest.mark.asyncio
+async def test_devolucao_ao_fornecedor_repete_e_so_apaga_a_revisao_gravada(monkeypatch):
+    leituras = [
+        {"_id": "p1", "rev": 1, "itens": [{"lot_id": "a", "quantity": 3, "condicionais_fornecedor": {"cf1": 3}}]},
+        # uma venda gravou no meio: sobrou 1 unidade do condicional
+        {"_id": "p1", "rev": 2, "itens": [{"lot_id": "a", "quantity": 1, "condicionais_fornecedor": {"cf1": 1}}]},
+    ]
+    gravacoes, apagados, saidas = [], [], []
+
+    class Produtos:
+        async def find_one(self, filtro, projection=None):
+            return leituras.pop(0)
+
+        async def delete_one(self, filtro):
+            raise AssertionError("delete sem checagem de rev")
+
+    class Saidas:
+        def find(self, filtro):
+            raise AssertionError("sem limite de devolução não consulta saídas")
+
+        async def insert_one(self, doc):
+            saidas.append(doc)
+            return type("R", (), {"inserted_id": "s1"})()
+
+    class Db:
+        produtos = Produtos()
+
+    async def gravar(produto, itens):
+        gravacoes.append(produto["rev"])
+        return produto["rev"] == 2
+
+    async def condicional(condicional_id):
+        return {"_id": condicional_id, "fornecedor_id": "f1"}
+
+    async def apagar(produto):
+        apagados.append(produto["rev"])
+        return True
+
+    async def nada(*args, **kwargs):
+        return True
+
+    Db.saidas = Saidas()
+    monkeypatch.setattr(estoque_db, "db", Db())
+    monkeypatch.setattr(estoque_db, "gravar_itens", gravar)
+    monkeypatch.setattr(condicional_fornecedor_db, "db", Db())
+    monkeypatch.setattr(condicional_fornecedor_db, "get_condicional_fornecedor_by_id", condicional)
+    monkeypatch.setattr(condicional_fornecedor_db, "apagar_produto_gravado", apagar)
+    monkeypatch.setattr(condicional_fornecedor_db, "registrar_saidas", nada)
+    monkeypatch.setattr(condicional_fornecedor_db, "apos_gravar_saidas", nada)
+    monkeypatch.setattr(produtos_db, "can_delete_produto", nada)
+
+    result = await condicional_fornecedor_db.devolver_itens_condicional_fornecedor("cf1", "p1", 1)
+
+    assert result["success"] and gravacoes == [1, 2] and apagados == [2]
+    assert saidas[0]["quantidade"] == 1
+
+
+@pytest.mark.asyncio
+async def test_venda_e_devolucao_ao_fornecedor_simultaneas_nao_perdem_atualizacao(monkeypatch):
+    if not await _mongo_disponivel():
+        pytest.skip('MongoDB indisponível')
+    monkeypatch.setenv('MONGODB_DB', 'projeto_silvana_test_concorrencia')
+    connection.close()
+    db = connection.db
+    try:
+        for rodada in range(10):
+            pid = f'TSTCONC{rodada}'
+            await db.produtos.delete_many({'_id': pid})
+            # lote antigo com 4 unidades e lote novo com 6, todas da condicional cf_conc
+            itens = [
+                {'lot_id': 'a', 'quantity': 4, 'acquisition_date': datetime(2024, 1, 1),
+                 'condicionais_fornecedor': {'cf_conc': 4}, 'condicionais_cliente': {}},
+                {'lot_id': 'b', 'quantity': 6, 'acquisition_date': datetime(2024, 2, 1),
+                 'condicionais_fornecedor': {'cf_conc': 6}, 'condicionais_cliente': {}},
+            ]
+            await db.produtos.insert_one({'_id': pid, 'codigo_interno': pid, 'itens': itens, 'rev': 0,
+                                          **estoque_db.calcular_estoque(itens)})
+
+            # a devolução de 4 unidades remove um lote inteiro (reescreve o array de itens)
+            venda, _ = await asyncio.gather(
+                processar_venda_produto(pid, 3),
+                processar_devolucoes_condicional_fornecedor('cf_conc', pid, 4),
+            )
+
+            assert venda.get('success') is True
+            produto = await db.produtos.find_one({'_id': pid})
+            assert sum(item['quantity'] for item in produto['itens']) == 3
+            assert produto['estoque_total'] == 3
+    finally:
+        await connection.get_client().drop_database('projeto_silvana_test_concorrencia')
+        connection.close()
@@ -0,0 +1,26 @@
+from api.database import condicional_fornecedor_db
+from api.models.condicional_fornecedor import CondicionalFornecedor
+from api.models.produtos import Produto
+
+
+def _produto(codigo, itens, tags=()):
+    return Produto(codigo_interno=codigo, codigo_externo="", descricao=f"Peça {codigo}", marca_fornecedor="Marca",
+                   sessao="S1", preco_custo=1000, preco_venda=2500, itens=itens, tags=[{"descricao": t} for t in tags])
+
+
+def test_lote_marca_lotes_entradas_e_produtos_da_condicional():
+    condicional = CondicionalFornecedor(fornecedor_id="f1").dict(by_alias=True)
+    tags = {"verao": {"_id": "t1", "descricao": "verao"}}
+    produtos = [_produto("A1", [{"quantity": 3}], tags=["Verao", "verao"]), _produto("A2", [])]
+
+    docs, entradas = condicional_fornecedor_db.montar_lote_condicional(condicional, produtos, tags)
+
+    cid = condicional["_id"]
+    assert condicional["produtos_id"] == [docs[0]["_id"], docs[1]["_id"]]
+    assert docs[0]["tags"] == [{"_id": "t1", "descricao": "verao"}]
+    assert docs[0]["itens"][0]["condicionais_fornecedor"] == {cid: 3}
+    assert docs[0]["em_condicional_fornecedor"] and docs[0]["estoque_total"] == 3
+    # sem itens: um lote de 1 unidade
+    assert [i["quantity"] for i in docs[1]["itens"]] == [1]
+    assert "entradas" not in docs[0] and docs[0]["termos_busca"]
+    assert [(e["produtos_id"], e["quantidade"]) for e in entradas] == [(docs[0]["_id"], 3), (docs[1]["_id"], 1)]
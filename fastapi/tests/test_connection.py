@@ -0,0 +1,28 @@
+from api.database import connection
+
+
+def test_client_options_from_env(monkeypatch):
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "25")
+    monkeypatch.setenv("MONGO_MIN_POOL_SIZE", "2")
+    monkeypatch.setenv("MONGO_MAX_IDLE_TIME_MS", "30000")
+    monkeypatch.setenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "abc")  # inválido -> ignorado
+    monkeypatch.delenv("MONGO_CONNECT_TIMEOUT_MS", raising=False)
+
+    options = connection.get_client_options()
+
+    assert options == {"maxPoolSize": 25, "minPoolSize": 2, "maxIdleTimeMS": 30000}
+
+
+def test_shared_client_is_reused_and_closed(monkeypatch):
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "7")
+    connection.close()
+    try:
+        client = connection.connect()
+        assert connection.connect() is client
+        assert connection.get_client() is client
+        assert client.options.pool_options.max_pool_size == 7
+        # o proxy `db` usado pelos módulos *_db resolve no client compartilhado
+        assert connection.db.produtos.database.client is client
+    finally:
+        connection.close()
+    assert connection._client is None
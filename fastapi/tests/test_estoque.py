@@ -0,0 +1,63 @@
+import pytest
+from api.database import estoque_db
+from api.database.estoque_db import baixar_reservados, calcular_estoque, contar_reservas, estoque_inc
+
+
+def test_calcular_estoque_separa_reservas():
+    itens = [
+        {"quantity": 3, "condicionais_cliente": [], "condicionais_fornecedor": []},
+        {"quantity": 2, "condicionais_cliente": ["cc1", "cc1"], "condicionais_fornecedor": []},
+        {"quantity": 4, "condicionais_cliente": [], "condicionais_fornecedor": ["cf1"] * 4},
+    ]
+    assert calcular_estoque(itens) == {
+        "estoque_total": 9,
+        "estoque_disponivel": 7,  # itens em condicional fornecedor continuam vendáveis
+        "estoque_em_condicional_cliente": 2,
+        "estoque_em_condicional_fornecedor": 4,
+    }
+
+
+def test_estoque_inc_omite_campos_sem_variacao():
+    assert estoque_inc(total=5, em_fornecedor=5) == {
+        "estoque_total": 5,
+        "estoque_disponivel": 5,
+        "estoque_em_condicional_fornecedor": 5,
+    }
+    # reservar para cliente não altera o total, só move de disponível para reservado
+    assert estoque_inc(em_cliente=2) == {"estoque_disponivel": -2, "estoque_em_condicional_cliente": 2}
+
+
+def test_contar_reservas_le_formato_antigo_e_mapa():
+    assert contar_reservas(["cf1", "cf1", "cf2"]) == {"cf1": 2, "cf2": 1}
+    assert contar_reservas({"cf1": 2, "cf2": 0}) == {"cf1": 2}
+    assert contar_reservas(None) == {}
+
+
+def test_baixar_reservados_remove_lotes_que_zeram():
+    itens = [
+        {"quantity": 2, "condicionais_cliente": {"cc1": 2}},
+        {"quantity": 3, "condicionais_cliente": {"cc1": 1, "cc2": 1}},
+    ]
+    assert baixar_reservados(itens, "condicionais_cliente", "cc1", 5) == 3
+    assert itens == [{"quantity": 2, "condicionais_cliente": {"cc2": 1}}]
+
+
+@pytest.mark.asyncio
+async def test_get_estoque_so_preenche_contadores_na_revisao_lida(monkeypatch):
+    leituras = [{"_id": "p1"}, {"_id": "p1", "rev": 3, "itens": [{"quantity": 2}]}]
+    updates = []
+
+    class Produtos:
+        async def find_one(self, filtro, projection=None):
+            return leituras.pop(0)
+
+        async def update_one(self, filtro, update):
+            updates.append(filtro)
+
+    class Db:
+        produtos = Produtos()
+
+    monkeypatch.setattr(estoque_db, "db", Db())
+
+    assert (await estoque_db.get_estoque("p1"))["estoque_total"] == 2
+    assert updates == [{"_id": "p1", "rev": 3}]
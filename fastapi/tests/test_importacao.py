@@ -0,0 +1,40 @@
+import pytest
+from api.database import importacao_db
+
+
+async def _chunks(*partes):
+    for parte in partes:
+        yield parte
+
+
+async def _registros(*partes):
+    linhas = importacao_db.linhas_de_bytes(_chunks(*partes))
+    return [r async for r in importacao_db.registros_csv(linhas)]
+
+
+@pytest.mark.asyncio
+async def test_csv_em_pedacos_com_aspas_multilinha():
+    registros = await _registros(
+        "﻿codigo_interno,descricao,preco_custo,preco_venda,tags\r\n".encode(),
+        'A1,"Vestido, longo",1000,2500,verao|festa\nA2,"Blusa\ncom'.encode(),
+        ' renda",800,1900,\nA3,x,1,2,a,b\n'.encode(),
+    )
+
+    assert registros[0] == (2, {"codigo_interno": "A1", "descricao": "Vestido, longo", "preco_custo": "1000",
+                                "preco_venda": "2500", "tags": "verao|festa"}, None)
+    assert registros[1][0] == 3 and registros[1][1]["descricao"] == "Blusa\ncom renda"
+    assert registros[2] == (5, None, "mais colunas que o cabeçalho")
+
+
+def test_validacao_de_registro():
+    linha = importacao_db.validar_registro({"codigo_interno": " A1 ", "descricao": "Vestido", "preco_custo": "1000",
+                                            "preco_venda": "2500", "tags": "verao|festa"})
+    assert linha["produto"].codigo_interno == "A1"
+    assert linha["produto"].itens[0].quantity == 1
+    assert linha["tags"] == ["verao", "festa"]
+
+    with pytest.raises(ValueError, match="preco_venda"):
+        importacao_db.validar_registro({"codigo_interno": "A1", "descricao": "x", "preco_custo": "1", "preco_venda": "abc"})
+    with pytest.raises(ValueError, match="espaços"):
+        importacao_db.validar_registro({"codigo_interno": "A1", "descricao": "x", "preco_custo": "1", "preco_venda": "2",
+                                        "tags": ["meia estação"]})
@@ -0,0 +1,19 @@
+from api.database.indexes import INDEXES, QUERY_SHAPES, _plan_stages
+
+
+def test_every_query_shape_has_a_leading_index():
+    for shape in QUERY_SHAPES:
+        leading_fields = {
+            next(iter(modelo.document["key"])) for modelo in INDEXES.get(shape["colecao"], [])
+        }
+        assert leading_fields & set(shape["filtro"]), shape["nome"]
+
+
+def test_plan_stages_finds_nested_collscan():
+    plan = {
+        "queryPlan": {
+            "stage": "SORT",
+            "inputStage": {"stage": "FETCH", "inputStage": {"stage": "COLLSCAN"}},
+        }
+    }
+    assert _plan_stages(plan) == ["SORT", "FETCH", "COLLSCAN"]
@@ -0,0 +1,54 @@
+from datetime import datetime
+import pytest
+from api.database import produtos_db
+
+
+def test_filtros_da_listagem():
+    filtro = produtos_db.filtro_produtos(q="vest", ativo=True, sessao="Feminino", em_condicional_cliente=False, com_estoque=True)
+
+    assert filtro["ativo"] == {"$ne": False}
+    assert filtro["sessao"] == "Feminino"
+    assert filtro["em_condicional_cliente"] is False
+    assert filtro["estoque_total"] == {"$gt": 0}
+    assert filtro["termos_busca"]["$all"][0].pattern == "^vest"
+    assert produtos_db.filtro_produtos() == {}
+
+
+def test_projecao_da_listagem():
+    assert produtos_db.projecao_produtos("descricao, preco_venda,entradas") == {"descricao": 1, "preco_venda": 1, "created_at": 1}
+    assert "itens" not in produtos_db.projecao_produtos(resumo=True)
+    assert produtos_db.projecao_produtos()["entradas"] == 0
+
+
+@pytest.mark.asyncio
+async def test_sem_cursor_retorna_primeira_pagina_limitada(monkeypatch):
+    chamadas = []
+
+    class Cursor:
+        def __init__(self, n):
+            self.n = n
+
+        def sort(self, ordem):
+            return self
+
+        def limit(self, n):
+            chamadas.append(n)
+            return self
+
+        async def to_list(self, n):
+            docs = [{"_id": f"p{i}", "created_at": datetime(2024, 1, 1)} for i in range(self.n)]
+            return docs[:n] if n else docs
+
+    class Produtos:
+        def find(self, query, projection=None):
+            return Cursor(5)
+
+    class Db:
+        produtos = Produtos()
+
+    monkeypatch.setattr(produtos_db, "db", Db())
+
+    pagina = await produtos_db.get_produtos(limit=2)
+    assert [p["_id"] for p in pagina["items"]] == ["p0", "p1"] and pagina["next_cursor"]
+    assert chamadas == [3]
+    assert len(await produtos_db.get_produtos(todos=True)) == 5
@@ -0,0 +1,57 @@
+import asyncio
+from datetime import datetime
+import pytest
+from api.database import cache, metricas_db
+from api.routers import reports
+
+
+def test_rotas_de_relatorio_registradas_no_mesmo_router():
+    paths = {route.path for route in reports.router.routes}
+    assert {"/estatisticas_condicionais_cliente", "/desempenho_condicionais_fornecedor", "/foco_compras", "/vendas_por_mes", "/dashboard"} <= paths
+
+
+@pytest.mark.asyncio
+async def test_medir_registra_latencia_da_secao():
+    latencias = {}
+
+    async def secao():
+        await asyncio.sleep(0.01)
+        return 42
+
+    assert await reports._medir("vendas", secao(), latencias) == 42
+    assert latencias["vendas"] >= 10
+
+
+@pytest.mark.asyncio
+async def test_dashboard_rotula_latencias_do_cache():
+    cache.set_store(cache.MemoryCacheStore())
+    try:
+        # Payload já em cache: as latências por seção são do cálculo anterior
+        guardado = {"faturamentoMesCorrente": 10, "latenciasMs": {"vendas": 5.0},
+                    "calculadoEm": datetime(2024, 5, 1).isoformat()}
+        await cache._store.set(cache.cache_key("dashboard", {}), guardado, ttl=60)
+        resposta = await reports.get_dashboard()
+        assert resposta["faturamentoMesCorrente"] == 10
+        assert resposta["cache"] == "hit" and resposta["calculadoEm"] == guardado["calculadoEm"]
+        assert resposta["latenciasMs"]["vendas"] == 5.0 and "total" in resposta["latenciasMs"]
+        assert "total" not in (await cache._store.get(cache.cache_key("dashboard", {})))["latenciasMs"]
+    finally:
+        cache.set_store(cache._criar_store())
+
+
+def test_soma_vendas_limita_intervalo_da_secao():
+    de, ate = datetime(2024, 1, 1), datetime(2024, 1, 31)
+    assert reports._soma_vendas(de, ate) == [
+        {"$match": {"dia": {"$gte": de, "$lte": ate}}},
+        {"$group": {"_id": None, "sales": {"$sum": "$valor_total"}}},
+    ]
+
+
+def test_resumo_conversao_a_partir_dos_contadores():
+    assert metricas_db.resumo_conversao({}) == {
+        "percentual_conversao": 0.0, "pecas_devolvidas_por_condicional": 0.0, "taxas_meios_pagamento": 0,
+    }
+    metricas = {"pecas_vendidas": 3, "pecas_devolvidas": 1, "condicionais_encerradas": 2, "taxas_meios_pagamento": 450}
+    assert metricas_db.resumo_conversao(metricas) == {
+        "percentual_conversao": 75.0, "pecas_devolvidas_por_condicional": 0.5, "taxas_meios_pagamento": 450,
+    }
@@ -0,0 +1,129 @@
+from datetime import datetime
+import asyncio
+import pytest
+from pymongo.errors import DuplicateKeyError
+from api.database import rollup_db
+from api.database.rollup_db import acumular_rollup, montar_ops_rollup
+
+
+def test_acumular_rollup_por_dia_e_dimensoes():
+    produto = {"tags": [{"_id": "t1"}], "marca_fornecedor": "m1", "sessao": "s1"}
+    saidas = [
+        {"tipo": "venda", "data_saida": datetime(2024, 5, 1, 10), "quantidade": 2, "valor_total": 100, "produto": produto},
+        {"tipo": "venda", "data_saida": datetime(2024, 5, 1, 18), "quantidade": 1, "valor_total": None},
+    ]
+
+    acumulado = acumular_rollup(saidas)
+
+    dia = datetime(2024, 5, 1)
+    assert acumulado[(dia, "venda", "total", None)] == {"count": 2, "quantidade": 3, "valor_total": 100}
+    assert acumulado[(dia, "venda", "tag", "t1")] == {"count": 1, "quantidade": 2, "valor_total": 100}
+    assert set(acumulado) == {
+        (dia, "venda", "total", None), (dia, "venda", "tag", "t1"),
+        (dia, "venda", "marca_fornecedor", "m1"), (dia, "venda", "sessao", "s1"),
+    }
+
+
+def test_saida_apagada_decrementa_o_rollup():
+    saida = {"tipo": "venda", "data_saida": datetime(2024, 5, 1), "quantidade": 2, "valor_total": 50}
+    (op,) = montar_ops_rollup(acumular_rollup([saida], sinal=-1))
+    assert op._filter == {"_id": "2024-05-01|venda|total|"}
+    assert op._doc["$inc"] == {"count": -1, "quantidade": -2, "valor_total": -50}
+    assert op._upsert is True
+
+
+class _SoRollup:
+    def __init__(self):
+        self.ops = []
+
+    async def bulk_write(self, ops, ordered=True):
+        self.ops.extend(ops)
+
+    def __getattr__(self, nome):
+        raise AssertionError(f"registrar_saidas não deve acessar {nome}")
+
+
+@pytest.mark.asyncio
+async def test_registrar_saidas_so_aplica_o_rollup(monkeypatch):
+    rollup = _SoRollup()
+
+    class FakeDB:
+        vendas_rollup = rollup
+
+        def __getattr__(self, nome):
+            raise AssertionError(f"registrar_saidas não deve acessar {nome}")
+
+    monkeypatch.setattr(rollup_db, "db", FakeDB())
+    saida = {"tipo": "venda", "data_saida": datetime(2024, 5, 1), "quantidade": 1, "valor_total": 10}
+    await rollup_db.registrar_saidas([saida])
+    assert len(rollup.ops) == 1
+
+
+def test_rebuild_grava_totais_absolutos():
+    saida = {"tipo": "venda", "data_saida": datetime(2024, 5, 1), "quantidade": 2, "valor_total": 50}
+    (op,) = rollup_db.montar_docs_rollup(acumular_rollup([saida, saida]))
+    assert op._filter == {"_id": "2024-05-01|venda|total|"}
+    assert op._doc["count"] == 2 and op._doc["quantidade"] == 4 and op._doc["valor_total"] == 100
+    assert "$inc" not in op._doc and op._upsert is True
+
+
+@pytest.mark.asyncio
+async def test_rebuild_no_startup_roda_em_um_so_worker(monkeypatch):
+    travas = {}
+    escritas = []
+
+    class Locks:
+        async def insert_one(self, doc):
+            if doc["_id"] in travas:
+                raise DuplicateKeyError("trava")
+            travas[doc["_id"]] = doc
+
+        async def update_one(self, filtro, update):
+            return type("R", (), {"modified_count": 0})()
+
+        async def delete_one(self, filtro):
+            travas.pop(filtro["_id"], None)
+
+    class Cursor:
+        def __init__(self, docs):
+            self.docs = list(docs)
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            await asyncio.sleep(0)
+            if not self.docs:
+                raise StopAsyncIteration
+            return self.docs.pop(0)
+
+    class Rollup:
+        async def find_one(self, filtro, projection=None):
+            return {"_id": "x"} if escritas else None
+
+        async def bulk_write(self, ops, ordered=True):
+            escritas.extend(ops)
+
+        def find(self, filtro, projection=None):
+            return Cursor([])
+
+    segundo = []
+
+    class Saidas:
+        def find(self, filtro, projection=None, batch_size=None):
+            # enquanto o primeiro worker varre as saídas, outro tenta reconstruir
+            segundo.append(asyncio.ensure_future(rollup_db.rebuild_rollup(somente_se_vazio=True)))
+            return Cursor([{"tipo": "venda", "data_saida": datetime(2024, 5, 1), "quantidade": 1, "valor_total": 10}])
+
+    class FakeDB:
+        startup_locks = Locks()
+        vendas_rollup = Rollup()
+        saidas = Saidas()
+
+    monkeypatch.setattr(rollup_db, "db", FakeDB())
+
+    primeiro = await rollup_db.rebuild_rollup(somente_se_vazio=True)
+
+    assert primeiro == {"saidas": 1, "chaves": 1}
+    assert await segundo[0] == {"saidas": 0, "chaves": 0}
+    assert len(escritas) == 1 and travas == {}
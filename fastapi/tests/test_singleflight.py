@@ -0,0 +1,45 @@
+import asyncio
+import pytest
+from api.database import singleflight
+
+
+@pytest.mark.asyncio
+async def test_chamadas_simultaneas_executam_uma_vez():
+    execucoes = []
+
+    @singleflight.single_flight("listagem")
+    async def listagem(pagina: int = 1):
+        execucoes.append(pagina)
+        await asyncio.sleep(0.01)
+        return [pagina]
+
+    resultados = await asyncio.gather(*(listagem(pagina=1) for _ in range(20)), listagem(pagina=2))
+
+    assert sorted(execucoes) == [1, 2]
+    assert resultados[:20] == [[1]] * 20 and resultados[20] == [2]
+    assert singleflight.stats()["em_andamento"] == 0
+
+    # terminada a execução, a próxima chamada consulta de novo
+    await listagem(pagina=1)
+    assert len(execucoes) == 3
+
+
+@pytest.mark.asyncio
+async def test_erro_repassado_e_rota_desativada(monkeypatch):
+    execucoes = []
+
+    async def falha():
+        execucoes.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("mongo fora")
+
+    @singleflight.single_flight("falha")
+    async def rota():
+        return await falha()
+
+    resultados = await asyncio.gather(*(rota() for _ in range(5)), return_exceptions=True)
+    assert len(execucoes) == 1 and all(isinstance(r, RuntimeError) for r in resultados)
+
+    monkeypatch.setenv("SINGLE_FLIGHT_DESATIVADO", "falha")
+    await asyncio.gather(*(rota() for _ in range(3)), return_exceptions=True)
+    assert len(execucoes) == 4
@@ -0,0 +1,37 @@
+from datetime import datetime
+import pytest
+from fastapi import HTTPException
+from api.database import saidas_db
+
+
+def test_cursor_ida_e_volta():
+    venda = {"_id": "65f0a1", "data_saida": datetime(2024, 5, 3, 14, 30), "valor_total": 9000}
+    token = saidas_db.encode_cursor("data_saida", -1, venda)
+
+    assert saidas_db.decode_cursor(token, "data_saida", -1) == (datetime(2024, 5, 3, 14, 30), "65f0a1")
+    with pytest.raises(HTTPException):
+        saidas_db.decode_cursor(token, "valor_total", -1)
+    with pytest.raises(HTTPException):
+        saidas_db.decode_cursor("nao-e-um-cursor", "data_saida", -1)
+
+
+def test_filtro_apos_cursor_trata_nulos():
+    desc = saidas_db.filtro_apos_cursor("valor_total", -1, 500, "b")
+    assert {"valor_total": None} in desc["$or"]
+    assert {"valor_total": 500, "_id": {"$lt": "b"}} in desc["$or"]
+
+    # em ordem crescente os nulos vêm primeiro: depois deles vêm todos os valores
+    asc_nulo = saidas_db.filtro_apos_cursor("valor_total", 1, None, "b")
+    assert asc_nulo == {"$or": [{"valor_total": {"$ne": None}}, {"valor_total": None, "_id": {"$gt": "b"}}]}
+
+
+@pytest.mark.asyncio
+async def test_filtro_de_produto_vira_in_no_match(monkeypatch):
+    async def ids(produto_query, tag_ids):
+        return ["p1", "p2"] if (produto_query or tag_ids) else None
+    monkeypatch.setattr(saidas_db, "_ids_produtos_filtrados", ids)
+
+    filtro = await saidas_db._montar_filtro_vendas(produto_query="camisa", cliente_id="c1")
+    assert filtro == {"cliente_id": "c1", "produtos_id": {"$in": ["p1", "p2"]}}
+    assert await saidas_db._montar_filtro_vendas(produto_id="p9", tag_ids=["t1"]) is None
+    assert await saidas_db._montar_filtro_vendas(produto_id="p9") == {"produtos_id": "p9"}
@@ -0,0 +1,28 @@
+from datetime import datetime
+import json
+import pytest
+from api.routers import vendas_router
+
+
+async def _vendas():
+    yield {"_id": "s1", "data_saida": datetime(2024, 5, 3, 10, 0), "quantidade": 1, "valor_total": 5000,
+           "produto_descricao": "Vestido, longo", "cliente_nome": None}
+    yield {"_id": "s2", "data_saida": datetime(2024, 5, 4), "quantidade": 2, "valor_total": None}
+
+
+@pytest.mark.asyncio
+async def test_exporta_ndjson_uma_venda_por_linha():
+    linhas = [l async for l in vendas_router._linhas_ndjson(_vendas())]
+
+    assert len(linhas) == 2 and all(l.endswith("\n") for l in linhas)
+    assert json.loads(linhas[0])["data_saida"] == "2024-05-03T10:00:00"
+
+
+@pytest.mark.asyncio
+async def test_exporta_csv_com_cabecalho_e_escape():
+    csv_texto = "".join([l async for l in vendas_router._linhas_csv(_vendas())])
+    linhas = csv_texto.strip().splitlines()
+
+    assert linhas[0].split(",") == vendas_router.EXPORT_COLUNAS
+    assert '"Vestido, longo"' in linhas[1]
+    assert len(linhas) == 3
@@ -0,0 +1,171 @@
+import asyncio
+from datetime import datetime
+import pytest
+from api.database import vendas_db
+from api.database.vendas_db import planejar_venda_fifo
+from api.database.estoque_db import devolver_lotes, filtro_rev, montar_update_itens
+
+
+def test_planejar_venda_fifo_consome_lotes_mais_antigos_primeiro():
+    itens = [
+        {"quantity": 2, "acquisition_date": datetime(2024, 3, 1), "condicionais_fornecedor": [], "condicionais_cliente": []},
+        {"quantity": 3, "acquisition_date": datetime(2024, 1, 1), "condicionais_fornecedor": ["cf1"] * 3, "condicionais_cliente": []},
+        {"quantity": 1, "acquisition_date": datetime(2023, 1, 1), "condicionais_fornecedor": [], "condicionais_cliente": ["cc1"]},
+    ]
+
+    itens_atualizados, condicional_sold = planejar_venda_fifo(itens, 4)
+
+    # o lote reservado para cliente (mais antigo) não é vendável; o de jan/24 sai inteiro
+    assert [it["quantity"] for it in itens_atualizados] == [1, 1]
+    assert itens_atualizados[1]["condicionais_cliente"] == {"cc1": 1}
+    assert condicional_sold == {"cf1": 3}
+    # a lista original não é alterada (o plano só é gravado se a revisão ainda casar)
+    assert itens[0]["quantity"] == 2
+
+
+def test_filtro_rev_para_documentos_sem_revisao():
+    assert filtro_rev({"_id": "p1", "rev": 4}) == {"_id": "p1", "rev": 4}
+    assert filtro_rev({"_id": "p1"}) == {"_id": "p1", "rev": {"$exists": False}}
+
+
+def test_venda_parcial_vira_inc_no_lote_por_array_filters():
+    antes = [
+        {"lot_id": "a", "quantity": 5, "condicionais_cliente": []},
+        {"lot_id": "b", "quantity": 2, "condicionais_cliente": []},
+    ]
+    depois = [dict(antes[0], quantity=3), dict(antes[1])]
+
+    update, array_filters = montar_update_itens(antes, depois)
+
+    assert update == {"$inc": {"itens.$[l0].quantity": -2}}
+    assert array_filters == [{"l0.lot_id": "a"}]
+
+
+def test_lote_removido_ou_sem_lot_id_reescreve_array():
+    antes = [{"lot_id": "a", "quantity": 1}, {"lot_id": "b", "quantity": 2}]
+    assert montar_update_itens(antes, antes[1:]) == ({"$set": {"itens": antes[1:]}}, None)
+
+    legado = [{"quantity": 1}]
+    novo = [{"lot_id": "x", "quantity": 1}]
+    assert montar_update_itens(legado, novo) == ({"$set": {"itens": novo}}, None)
+
+
+def test_venda_parcial_baixa_reserva_do_fornecedor_no_mesmo_inc():
+    antes = [{"lot_id": "a", "quantity": 5, "condicionais_fornecedor": {"cf1": 5}, "condicionais_cliente": {}}]
+    depois, condicional_sold = planejar_venda_fifo(antes, 2)
+
+    assert condicional_sold == {"cf1": 2}
+    update, array_filters = montar_update_itens(antes, depois)
+    assert update == {"$inc": {"itens.$[l0].quantity": -2, "itens.$[l0].condicionais_fornecedor.cf1": -2}}
+    assert array_filters == [{"l0.lot_id": "a"}]
+
+
+@pytest.mark.asyncio
+async def test_vendas_batch_paraleliza_produtos_e_preserva_ordem_do_mesmo_produto(monkeypatch):
+    em_andamento = {"atual": 0, "max": 0}
+    ordem = []
+
+    async def baixar(produto_id, quantidade, **kwargs):
+        em_andamento["atual"] += 1
+        em_andamento["max"] = max(em_andamento["max"], em_andamento["atual"])
+        await asyncio.sleep(0.01)
+        ordem.append((produto_id, quantidade))
+        em_andamento["atual"] -= 1
+        return {"produto_id": produto_id, "quantidade": quantidade}, []
+
+    monkeypatch.setattr(vendas_db, "_baixar_venda_produto", baixar)
+    linhas = [
+        {"produto_id": "p1", "quantidade": 1},
+        {"produto_id": "p2", "quantidade": 1},
+        {"produto_id": "p1", "quantidade": 2},
+    ]
+
+    results = await vendas_db.processar_vendas_batch(linhas)
+
+    assert [r["quantidade"] for r in results] == [1, 1, 2]
+    assert em_andamento["max"] == 2
+    assert [q for p, q in ordem if p == "p1"] == [1, 2]
+
+
+def test_devolver_lotes_desfaz_baixa_preservando_alteracoes_posteriores():
+    antes = [
+        {"lot_id": "a", "quantity": 2, "condicionais_fornecedor": {"cf1": 2}, "condicionais_cliente": {}},
+        {"lot_id": "b", "quantity": 5, "condicionais_fornecedor": {}, "condicionais_cliente": {}},
+    ]
+    depois, _ = planejar_venda_fifo(antes, 3)
+    # depois da baixa outra operação vendeu mais 1 unidade do lote b
+    atuais = [dict(depois[0], quantity=depois[0]["quantity"] - 1)]
+
+    itens = devolver_lotes(atuais, antes, depois)
+
+    por_lote = {it["lot_id"]: it for it in itens}
+    assert por_lote["a"]["quantity"] == 2 and por_lote["a"]["condicionais_fornecedor"] == {"cf1": 2}
+    assert por_lote["b"]["quantity"] == 4
+
+
+@pytest.mark.asyncio
+async def test_carrinho_sem_transacao_desfaz_linhas_ja_baixadas(monkeypatch):
+    desfeitas = []
+
+    async def baixar(produto_id, quantidade, session=None):
+        if produto_id == "p2":
+            return {"error": "Produto alterado por outra operação simultânea. Tente novamente."}
+        return {"produto": {"_id": produto_id}, "itens_antes": [], "itens_depois": [], "condicional_sold": {},
+                "estoque_disponivel": 5, "pode_deletar": False}
+
+    async def desfazer(baixa):
+        desfeitas.append(baixa["produto"]["_id"])
+        return True
+
+    async def sem_problemas(linhas):
+        return []
+
+    async def sem_transacoes():
+        return False
+
+    monkeypatch.setattr(vendas_db, "baixar_estoque_produto", baixar)
+    monkeypatch.setattr(vendas_db, "desfazer_baixa", desfazer)
+    monkeypatch.setattr(vendas_db, "verificar_estoque_carrinho", sem_problemas)
+    monkeypatch.setattr(vendas_db, "suporta_transacoes", sem_transacoes)
+
+    result = await vendas_db.processar_venda_carrinho([
+        {"produto_id": "p1", "quantidade": 1}, {"produto_id": "p2", "quantidade": 1}, {"produto_id": "p3", "quantidade": 2},
+    ])
+
+    assert result["error"] and [f["produto_id"] for f in result["falhas"]] == ["p2"]
+    assert sorted(desfeitas) == ["p1", "p3"]
+
+
+@pytest.mark.asyncio
+async def test_saida_manual_baixa_estoque_e_desfaz_se_insert_falhar(monkeypatch):
+    from api.database import saidas_db
+    from api.models.saidas import Saida
+
+    baixas, desfeitas = [], []
+
+    async def baixar(produto_id, quantidade, session=None):
+        baixas.append((produto_id, quantidade))
+        return {"produto": {"_id": produto_id, "descricao": "x", "itens": []}}
+
+    async def desfazer(baixa):
+        desfeitas.append(baixa["produto"]["_id"])
+
+    async def sem_transacoes():
+        return False
+
+    class Saidas:
+        async def insert_one(self, doc, session=None):
+            raise RuntimeError("falha de rede")
+
+    class Db:
+        saidas = Saidas()
+
+    monkeypatch.setattr(saidas_db, "baixar_estoque_produto", baixar)
+    monkeypatch.setattr(saidas_db, "desfazer_baixa", desfazer)
+    monkeypatch.setattr(saidas_db, "suporta_transacoes", sem_transacoes)
+    monkeypatch.setattr(saidas_db, "db", Db())
+
+    with pytest.raises(RuntimeError):
+        await saidas_db.create_saida(Saida(produtos_id="p1", quantidade=2, tipo="perca"))
+
+    assert baixas == [("p1", 2)] and desfeitas == ["p1"]
@@ -0,0 +1,23 @@
+from datetime import datetime
+from api.database import vendas_view_db
+
+
+def test_linha_da_view_achata_produto_e_cliente():
+    saida = {"_id": "s1", "produtos_id": "p1", "cliente_id": "c1", "tipo": "venda", "quantidade": 2,
+             "valor_total": 5000, "data_saida": datetime(2024, 5, 3),
+             "produto": {"_id": "p1", "descricao": "Vestido", "codigo_interno": "V01", "preco_venda": 2500, "tags": []}}
+    cliente = {"_id": "c1", "nome": "Ana", "telefone": "119999", "cpf": None}
+
+    linha = vendas_view_db.montar_linha_view(saida, saida["produto"], cliente)
+
+    assert "produto" not in linha
+    assert linha["produto_descricao"] == "Vestido" and linha["preco_venda"] == 2500
+    assert (linha["cliente_nome"], linha["cliente_telefone"], linha["cliente_cpf"]) == ("Ana", "119999", None)
+    assert linha["valor_total"] == 5000
+
+
+def test_propagacao_so_quando_campo_exibido_muda():
+    # sem campos exibidos alterados nada é agendado (não precisa de event loop)
+    assert vendas_view_db.propagar_cliente({"_id": "c1", "nome": "Ana"}, {"email": "x@y"}) is None
+    assert vendas_view_db.propagar_produto({"_id": "p1"}, {"itens": [], "updated_at": 1}) is None
+    assert vendas_view_db.propagar_cliente(None, {"nome": "Ana"}) is None
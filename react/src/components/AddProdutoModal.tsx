@@ -37,8 +37,8 @@ const AddProdutoModal: React.FC<AddProdutoModalProps> = ({
     setLoadingProducts(true);
     try {
       const token = localStorage.getItem('token');
-      const res = await api.get('/produtos/', { headers: { Authorization: `Bearer ${token}` }, params: { q } });
-      setProductOptions(res.data || []);
+      const res = await api.get('/produtos/', { headers: { Authorization: `Bearer ${token}` }, params: { q, resumo: true, limit: 20 } });
+      setProductOptions(res.data?.items || []);
     } catch (error) {
       console.error('Erro ao buscar produtos:', error);
       setProductOptions([]);
@@ -172,7 +172,7 @@ const ProdutoModal: React.FC<ProdutoModalProps> = ({
   }, [marcaOptions, defaultMarcaFornecedor, selectedMarca]);
 
   const addItem = () => {
-    setTempItens([...tempItens, { quantity: 1, acquisition_date: new Date().toISOString().split('T')[0], condicionais_fornecedor: condicionalFornecedorId ? [condicionalFornecedorId] : [], condicionais_cliente: [] }]);
+    setTempItens([...tempItens, { quantity: 1, acquisition_date: new Date().toISOString().split('T')[0], condicionais_fornecedor: condicionalFornecedorId ? { [condicionalFornecedorId]: 1 } : {}, condicionais_cliente: {} }]);
   };
 
   const removeItem = (index: number) => {
@@ -180,13 +180,21 @@ const ProdutoModal: React.FC<ProdutoModalProps> = ({
   };
 
   const updateItem = (index: number, field: keyof Item, value: string | number) => {
-    setTempItens(tempItens.map((item, i) => i === index ? { ...item, [field]: value } : item));
+    setTempItens(tempItens.map((item, i) => {
+      if (i !== index) return item;
+      const updated = { ...item, [field]: value };
+      // lote da condicional: todas as unidades pertencem a ela
+      if (field === 'quantity' && condicionalFornecedorId) {
+        updated.condicionais_fornecedor = { ...(item.condicionais_fornecedor || {}), [condicionalFornecedorId]: Number(value) || 0 };
+      }
+      return updated;
+    }));
   };
 
   const handleAddProdutoLocal = () => {
     let finalItens = tempItens;
     if (finalItens.length === 0) {
-      finalItens = [{ quantity: 1, acquisition_date: new Date().toISOString().split('T')[0], condicionais_fornecedor: condicionalFornecedorId ? [condicionalFornecedorId] : [], condicionais_cliente: [] }];
+      finalItens = [{ quantity: 1, acquisition_date: new Date().toISOString().split('T')[0], condicionais_fornecedor: condicionalFornecedorId ? { [condicionalFornecedorId]: 1 } : {}, condicionais_cliente: {} }];
     }
     const produtoData = {
       codigo_interno: newProduto.codigo_interno,
@@ -135,10 +135,9 @@ const DevolucaoCondicionalFornecedor: React.FC = () => {
   // Per-product calculations
   const computeQuantidades = (p: ProdutoDevolucao) => {
     const { produto, saida } = p;
-    // quantidade em condicional: somar itens que contém condicionalId
+    // quantidade em condicional: somar as unidades de condicionalId em cada lote
     const quantidadeEmCondicional = produto.itens.reduce((acc: number, it) => {
-      const count = (it.condicionais_fornecedor || []).filter((cid) => cid === condicionalId).length;
-      return acc + (it.quantity || 0) * (count > 0 ? 1 : 0);
+      return acc + ((condicionalId && it.condicionais_fornecedor?.[condicionalId]) || 0);
     }, 0);
 
     // vendido a partir desta condicional para este produto
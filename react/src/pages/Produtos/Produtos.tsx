@@ -50,10 +50,14 @@ import ProdutoModal from '../../components/ProdutoModal';
 import ShadowIconButton from '../../components/ShadowIconButton';
 import Title from '../../components/Title';
 
+// produtos por requisição na listagem (paginada por cursor no servidor)
+const PRODUTOS_POR_PAGINA = 50;
+
 const Produtos: React.FC = () => {
   const theme = useTheme();
   const [, setProdutos] = useState<Produto[]>([]);
   const [filteredProdutos, setFilteredProdutos] = useState<Produto[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [tags, setTags] = useState<Tag[]>([]);
   const [tagOptions, setTagOptions] = useState<Tag[]>([]);
   const [tagInputValue, setTagInputValue] = useState<string>('');
@@ -104,6 +108,7 @@ const Produtos: React.FC = () => {
     setLoadingProdutos(true);
     try {
       let prods: Produto[] = [];
+      let cursor: string | null = null;
 
       const query = q ?? searchQuery;
       const tagsParam = selectedTagsParam ?? selectedTags;
@@ -127,11 +132,14 @@ const Produtos: React.FC = () => {
         const res = await api.get(`/produtos/by-tags/?tag_ids=${encodeURIComponent(tag_ids)}&mode=${encodeURIComponent(tagFilterMode)}`);
         prods = res.data;
       } else {
-        const res = await api.get('/produtos/');
-        prods = res.data;
+        // primeira página do catálogo (resumo, sem itens); as seguintes vêm por cursor em loadMaisProdutos
+        const res = await api.get('/produtos/', { params: { resumo: true, limit: PRODUTOS_POR_PAGINA } });
+        prods = res.data.items;
+        cursor = res.data.next_cursor;
       }
 
       // ensure product prices are numbers and in cents from server (server stores cents)
+      setNextCursor(cursor);
       setProdutos(prods);
       setFilteredProdutos(prods);
       setPage(0);
@@ -199,7 +207,26 @@ const Produtos: React.FC = () => {
     }
   };
 
-  const handleChangePage = (_event: unknown, newPage: number) => {
+  const loadMaisProdutos = async () => {
+    if (!nextCursor) return;
+    setLoadingProdutos(true);
+    try {
+      const res = await api.get('/produtos/', { params: { resumo: true, limit: PRODUTOS_POR_PAGINA, cursor: nextCursor } });
+      setProdutos((atual) => [...atual, ...res.data.items]);
+      setFilteredProdutos((atual) => [...atual, ...res.data.items]);
+      setNextCursor(res.data.next_cursor);
+    } catch (error) {
+      console.error('Erro ao carregar produtos:', error);
+    } finally {
+      setLoadingProdutos(false);
+    }
+  };
+
+  const handleChangePage = async (_event: unknown, newPage: number) => {
+    // busca a próxima página do servidor quando a tabela passa do que já foi carregado
+    if ((newPage + 1) * rowsPerPage > filteredProdutos.length && nextCursor) {
+      await loadMaisProdutos();
+    }
     setPage(newPage);
   };
 
@@ -498,7 +525,7 @@ const Produtos: React.FC = () => {
               <TablePagination
                 rowsPerPageOptions={[5, 10, 25]}
                 component="div"
-                count={filteredProdutos.length}
+                count={nextCursor ? -1 : filteredProdutos.length}
                 rowsPerPage={rowsPerPage}
                 page={Math.min(page, Math.max(0, Math.ceil(filteredProdutos.length / rowsPerPage) - 1))}
                 onPageChange={handleChangePage}
@@ -549,7 +576,7 @@ const Produtos: React.FC = () => {
               <TablePagination
                 rowsPerPageOptions={[5, 10, 25]}
                 component="div"
-                count={filteredProdutos.length}
+                count={nextCursor ? -1 : filteredProdutos.length}
                 rowsPerPage={rowsPerPage}
                 page={Math.min(page, Math.max(0, Math.ceil(filteredProdutos.length / rowsPerPage) - 1))}
                 onPageChange={handleChangePage}
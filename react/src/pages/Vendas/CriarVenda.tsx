@@ -126,8 +126,13 @@ const CriarVenda: React.FC = () => {
 
   // helper para estoque disponível e totais
   const getStockInfo = (p: Produto) => {
+    // resultados da busca trazem só os contadores (sem itens)
+    if (p.estoque_disponivel !== undefined) {
+      const reservedCliente = p.estoque_em_condicional_cliente ?? 0;
+      return { available: Math.max(0, p.estoque_disponivel), total: p.estoque_total ?? p.estoque_disponivel + reservedCliente, reservedCliente };
+    }
     const total = (p.itens || []).reduce((s: number, it: Item) => s + (it.quantity || 0), 0);
-    const reservedCliente = (p.itens || []).reduce((s: number, it: Item) => s + ((it.condicionais_cliente || []).length), 0);
+    const reservedCliente = (p.itens || []).reduce((s: number, it: Item) => s + Object.values(it.condicionais_cliente || {}).reduce((a, n) => a + n, 0), 0);
     const available = Math.max(0, total - reservedCliente);
     return { available, total, reservedCliente };
   };
@@ -351,23 +356,18 @@ const CriarVenda: React.FC = () => {
 
     setLoading(true);
     try {
-      const vendas = itensVenda.map(item => {
-        let obs = '';
-        if (item.observacao.trim()) {
-          obs += `Observação Específica : ${item.observacao.trim()}\n`;
-        }
-        if (observacaoGeral.trim()) {
-          obs += `Observação geral : ${observacaoGeral.trim()}`;
-        }
-        return {
+      // uma única venda (carrinho) com todos os itens
+      const carrinho = {
+        cliente_id: selectedCliente?._id || null,
+        observacoes: observacaoGeral.trim() ? `Observação geral : ${observacaoGeral.trim()}` : null,
+        itens: itensVenda.map(item => ({
           produto_id: item.produto!._id,
           quantidade: item.quantidade,
-          cliente_id: selectedCliente?._id || null,
           valor_total: item.valorTotal,
-          observacoes: obs.trim(),
-        };
-      });
-      await api.post('/vendas/batch', vendas);
+          observacoes: item.observacao.trim() ? `Observação Específica : ${item.observacao.trim()}` : null,
+        })),
+      };
+      await api.post('/vendas/carrinho', carrinho);
       navigate('/vendas');
     } catch (e: unknown) {
       console.error(e);
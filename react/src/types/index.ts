@@ -13,8 +13,9 @@ export interface Tag {
 export interface Item {
   quantity: number;
   acquisition_date: string;
-  condicionais_fornecedor?: string[];
-  condicionais_cliente?: string[];
+  // unidades do lote por condicional: { condicional_id: quantidade }
+  condicionais_fornecedor?: Record<string, number>;
+  condicionais_cliente?: Record<string, number>;
 }
 
 export interface Entrada {
@@ -60,6 +61,10 @@ export interface Produto {
   saidas: Saida[];
   entradas: Entrada[];
   tags: Tag[];
+  // contadores materializados (vêm também nos resumos de busca/listagem, que não trazem itens)
+  estoque_total?: number;
+  estoque_disponivel?: number;
+  estoque_em_condicional_cliente?: number;
   created_at: string;
   updated_at?: string;
 }
@@ -0,0 +1,49 @@
+"""Auto-verificação dos índices declarados em `api/database/indexes.py`.
+
+Roda `explain()` em cada formato de consulta registrado e aponta os que
+caem em COLLSCAN. Com --apply, cria antes os índices que estiverem faltando.
+
+Uso:
+  python3 scripts/check_indexes.py
+  python3 scripts/check_indexes.py --apply
+
+Sai com código 1 se algum formato de consulta ainda fizer COLLSCAN.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'fastapi'))
+
+from api.database import connection
+from api.database.indexes import ensure_indexes, verify_query_shapes
+
+async def check(apply: bool) -> int:
+    try:
+        if apply:
+            result = await ensure_indexes()
+            print(f"Índices garantidos: {len(result['criados'])}")
+            for falha in result['falhas']:
+                print(f"  FALHA {falha['indice']}: {falha['erro']}")
+
+        report = await verify_query_shapes()
+        collscans = 0
+        for item in report:
+            status = 'COLLSCAN' if item['collscan'] else 'ok'
+            if item['collscan']:
+                collscans += 1
+            print(f"[{status:8}] {item['colecao']}: {item['nome']} -> {' > '.join(item['estagios'])}")
+
+        print('--- Summary ---')
+        print(f'Query shapes verificados: {len(report)}')
+        print(f'Com COLLSCAN: {collscans}')
+        return 1 if collscans else 0
+    finally:
+        connection.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Verifica (explain) os índices das consultas registradas')
+    parser.add_argument('--apply', action='store_true', help='Cria os índices faltantes antes de verificar')
+    args = parser.parse_args()
+    sys.exit(asyncio.run(check(args.apply)))
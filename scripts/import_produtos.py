@@ -0,0 +1,58 @@
+"""Importa produtos em lote a partir de um arquivo CSV (com cabeçalho) ou NDJSON.
+
+Mesmo fluxo do endpoint POST /produtos/import: o arquivo é lido em pedaços e
+gravado em blocos (tags resolvidas em lote, insert_many de produtos e entradas).
+Colunas: codigo_interno, codigo_externo, descricao, marca_fornecedor, sessao,
+preco_custo, preco_venda (centavos), quantidade e tags (separadas por `|`).
+
+Uso:
+  python3 scripts/import_produtos.py produtos.csv --dry-run
+  python3 scripts/import_produtos.py produtos.csv --apply
+  python3 scripts/import_produtos.py produtos.ndjson --apply
+
+O script imprime um resumo e os erros por linha; sem --apply apenas valida.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'fastapi'))
+
+from api.database import connection
+from api.database.importacao_db import importar_produtos, linhas_de_bytes, registros_csv, registros_ndjson
+
+CHUNK_SIZE = 64 * 1024
+
+async def ler_arquivo(path: str):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+async def run(path: str, formato: str, apply: bool):
+    linhas = linhas_de_bytes(ler_arquivo(path))
+    registros = registros_csv(linhas) if formato == 'csv' else registros_ndjson(linhas)
+    try:
+        result = await importar_produtos(registros, apply=apply)
+    finally:
+        connection.close()
+
+    for erro in result['erros']:
+        print(f"Line {erro['linha']} ({erro['codigo_interno']}): {erro['erro']}")
+    print('--- Summary ---')
+    print(f"Rows read: {result['linhas']}")
+    print(f"Products valid: {result['importados']}" if not apply else f"Products imported: {result['importados']}")
+    print(f"Rows with errors: {result['erros_total']}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Importação de produtos em lote (CSV ou NDJSON)')
+    parser.add_argument('arquivo', help='Arquivo .csv ou .ndjson/.jsonl')
+    parser.add_argument('--formato', choices=['csv', 'ndjson'], default=None, help='Padrão: pela extensão do arquivo')
+    parser.add_argument('--apply', action='store_true', help='Apply changes to DB')
+    parser.add_argument('--dry-run', action='store_true', help='Only validate (default)')
+    args = parser.parse_args()
+    formato = args.formato or ('csv' if args.arquivo.lower().endswith('.csv') else 'ndjson')
+    asyncio.run(run(args.arquivo, formato, args.apply))
@@ -0,0 +1,57 @@
+"""Script de migração: atribui um `lot_id` estável a cada item (lote) dos
+produtos que ainda não possuem.
+
+Uso:
+  python3 scripts/migrate_lot_ids.py --dry-run
+  python3 scripts/migrate_lot_ids.py --apply
+
+O script imprime um resumo e, com --apply, aplica as mudanças.
+"""
+import argparse
+import os
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
+
+async def migrate(apply: bool):
+    client = AsyncIOMotorClient(os.getenv('MONGODB_URL', 'mongodb://localhost:27017'))
+    db = client['projeto_silvana']
+
+    cursor = db.produtos.find({'itens': {'$elemMatch': {'lot_id': {'$exists': False}}}}, projection={'itens': 1, 'rev': 1})
+    updated_products = 0
+    total_items_changed = 0
+    conflicts = 0
+
+    async for prod in cursor:
+        new_items = []
+        for it in prod.get('itens', []) or []:
+            it_copy = dict(it)
+            if not it_copy.get('lot_id'):
+                it_copy['lot_id'] = str(ObjectId())
+                total_items_changed += 1
+            new_items.append(it_copy)
+
+        updated_products += 1
+        print(f"Product {prod.get('_id')} needs update (items without lot_id)")
+        if apply:
+            # só grava se o produto não foi alterado desde a leitura (campo rev)
+            rev_filter = prod['rev'] if 'rev' in prod else {'$exists': False}
+            result = await db.produtos.update_one(
+                {'_id': prod['_id'], 'rev': rev_filter},
+                {'$set': {'itens': new_items}, '$inc': {'rev': 1}}
+            )
+            if result.matched_count == 0:
+                conflicts += 1
+                print(f"Product {prod.get('_id')} changed during migration; run again")
+
+    print('--- Summary ---')
+    print(f'Total items changed: {total_items_changed}')
+    print(f'Products to update: {updated_products}' if not apply else f'Products updated: {updated_products - conflicts}')
+    if conflicts:
+        print(f'Conflicts (re-run needed): {conflicts}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migração: lot_id estável por item')
+    parser.add_argument('--apply', action='store_true', help='Apply changes to DB')
+    args = parser.parse_args()
+    asyncio.run(migrate(args.apply))
@@ -0,0 +1,67 @@
+"""Script de migração: converte as reservas dos itens (lotes) do formato antigo,
+uma lista com um id de condicional por unidade, para o mapa
+`{condicional_id: quantidade}`.
+
+Os contadores de estoque do produto são recalculados no mesmo update.
+
+Uso:
+  python3 scripts/migrate_reservas_map.py --dry-run
+  python3 scripts/migrate_reservas_map.py --apply
+
+O script imprime um resumo e, com --apply, aplica as mudanças.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'fastapi'))
+
+from api.database import connection
+from api.database.estoque_db import calcular_estoque, copiar_lotes, filtro_rev
+
+async def migrate(apply: bool):
+    db = connection.get_db()
+    try:
+        query = {'$or': [
+            {'itens': {'$elemMatch': {'condicionais_fornecedor': {'$type': 'array'}}}},
+            {'itens': {'$elemMatch': {'condicionais_cliente': {'$type': 'array'}}}},
+        ]}
+        updated_products = 0
+        total_items_changed = 0
+        conflicts = 0
+
+        async for prod in db.produtos.find(query, projection={'itens': 1, 'rev': 1}):
+            itens = prod.get('itens', []) or []
+            total_items_changed += sum(
+                1 for it in itens
+                if isinstance(it.get('condicionais_fornecedor'), list) or isinstance(it.get('condicionais_cliente'), list)
+            )
+            new_items = copiar_lotes(itens)
+
+            updated_products += 1
+            print(f"Product {prod.get('_id')} needs update (reservations stored as lists)")
+            if apply:
+                # só grava se o produto não foi alterado desde a leitura (campo rev)
+                result = await db.produtos.update_one(
+                    filtro_rev(prod),
+                    {'$set': {'itens': new_items, **calcular_estoque(new_items)}, '$inc': {'rev': 1}}
+                )
+                if result.matched_count == 0:
+                    conflicts += 1
+                    print(f"Product {prod.get('_id')} changed during migration; run again")
+
+        print('--- Summary ---')
+        print(f'Total items changed: {total_items_changed}')
+        print(f'Products to update: {updated_products}' if not apply else f'Products updated: {updated_products - conflicts}')
+        if conflicts:
+            print(f'Conflicts (re-run needed): {conflicts}')
+    finally:
+        connection.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migração: reservas por item como mapa condicional_id -> quantidade')
+    parser.add_argument('--apply', action='store_true', help='Apply changes to DB')
+    parser.add_argument('--dry-run', action='store_true', help='Only report (default)')
+    args = parser.parse_args()
+    asyncio.run(migrate(args.apply))
@@ -0,0 +1,85 @@
+"""Script de migração: remove o array `entradas` embutido nos documentos de
+`produtos`.
+
+As entradas continuam na coleção `entradas` (consultadas por
+/produtos/{id}/entradas). Antes de remover o array, o script garante que cada
+entrada embutida exista na coleção, inserindo as que faltarem, para nenhum
+histórico se perder. O array `saidas` embutido, quando existir, também é
+removido.
+
+Uso:
+  python3 scripts/migrate_strip_entradas.py --dry-run
+  python3 scripts/migrate_strip_entradas.py --apply
+
+O script imprime um resumo e, com --apply, aplica as mudanças.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+from pymongo import UpdateOne
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'fastapi'))
+
+from api.database import connection
+
+BATCH_SIZE = 200
+
+async def migrate(apply: bool):
+    db = connection.get_db()
+    try:
+        query = {'$or': [{'entradas': {'$exists': True}}, {'saidas': {'$exists': True}}]}
+        products = 0
+        embedded = 0
+        missing_total = 0
+        lote = []
+
+        async def flush(lote):
+            nonlocal missing_total
+            ids = [e['_id'] for _, entradas in lote for e in entradas if e.get('_id')]
+            existentes = set()
+            if ids:
+                existentes = {d['_id'] async for d in db.entradas.find({'_id': {'$in': ids}}, projection={'_id': 1})}
+            faltantes = []
+            for produto_id, entradas in lote:
+                for e in entradas:
+                    if e.get('_id') and e['_id'] not in existentes:
+                        faltantes.append({**e, 'produtos_id': e.get('produtos_id') or produto_id})
+            missing_total += len(faltantes)
+            if not apply:
+                return
+            if faltantes:
+                await db.entradas.bulk_write(
+                    [UpdateOne({'_id': e['_id']}, {'$setOnInsert': e}, upsert=True) for e in faltantes],
+                    ordered=False
+                )
+            await db.produtos.update_many(
+                {'_id': {'$in': [produto_id for produto_id, _ in lote]}},
+                {'$unset': {'entradas': '', 'saidas': ''}}
+            )
+
+        async for prod in db.produtos.find(query, projection={'entradas': 1}):
+            products += 1
+            entradas = prod.get('entradas') or []
+            embedded += len(entradas)
+            lote.append((prod['_id'], entradas))
+            if len(lote) >= BATCH_SIZE:
+                await flush(lote)
+                lote = []
+        if lote:
+            await flush(lote)
+
+        print('--- Summary ---')
+        print(f'Embedded entradas found: {embedded}')
+        print(f'Entradas missing from collection: {missing_total}' if not apply else f'Entradas copied to collection: {missing_total}')
+        print(f'Products to update: {products}' if not apply else f'Products updated: {products}')
+    finally:
+        connection.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migração: remove o histórico de entradas embutido nos produtos')
+    parser.add_argument('--apply', action='store_true', help='Apply changes to DB')
+    parser.add_argument('--dry-run', action='store_true', help='Only report (default)')
+    args = parser.parse_args()
+    asyncio.run(migrate(args.apply))
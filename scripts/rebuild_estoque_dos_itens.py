@@ -0,0 +1,39 @@
+"""Recalcula os contadores de estoque materializados nos produtos
+(`estoque_total`, `estoque_disponivel`, `estoque_em_condicional_cliente`,
+`estoque_em_condicional_fornecedor`) a partir dos lotes em `itens`. Não
+concilia os lotes com o histórico de entradas/saidas.
+
+Uso:
+  python3 scripts/rebuild_estoque_dos_itens.py --dry-run
+  python3 scripts/rebuild_estoque_dos_itens.py --apply
+  python3 scripts/rebuild_estoque_dos_itens.py --apply --produto-id <id>
+
+O script imprime um resumo e, com --apply, grava os contadores divergentes.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'fastapi'))
+
+from api.database import connection
+from api.database.estoque_db import rebuild_estoque_dos_itens
+
+async def rebuild(apply: bool, produto_id: str | None):
+    try:
+        result = await rebuild_estoque_dos_itens(produto_id=produto_id, apply=apply)
+    finally:
+        connection.close()
+
+    print('--- Summary ---')
+    print(f"Total products scanned: {result['examinados']}")
+    print(f"Products to update: {result['divergentes']}" if not apply else f"Products updated: {result['divergentes']}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recalcula contadores de estoque a partir dos itens')
+    parser.add_argument('--apply', action='store_true', help='Apply changes to DB')
+    parser.add_argument('--dry-run', action='store_true', help='Only report divergences (default)')
+    parser.add_argument('--produto-id', default=None, help='Recalcula apenas este produto')
+    args = parser.parse_args()
+    asyncio.run(rebuild(args.apply, args.produto_id))
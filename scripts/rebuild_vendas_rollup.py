@@ -0,0 +1,38 @@
+"""Reconstrói a coleção `vendas_rollup` (totais diários de saídas por tipo e por
+tag / marca_fornecedor / sessao) a partir de `saidas`.
+
+Uso:
+  python3 scripts/rebuild_vendas_rollup.py --dry-run
+  python3 scripts/rebuild_vendas_rollup.py --apply
+  python3 scripts/rebuild_vendas_rollup.py --apply --desde 2024-01-01
+
+O script imprime um resumo e, com --apply, substitui os rollups do período.
+"""
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'fastapi'))
+
+from api.database import connection
+from api.database.rollup_db import rebuild_rollup
+
+async def rebuild(apply: bool, desde: datetime | None):
+    try:
+        result = await rebuild_rollup(desde=desde, apply=apply)
+    finally:
+        connection.close()
+
+    print('--- Summary ---')
+    print(f"Total saidas scanned: {result['saidas']}")
+    print(f"Rollup keys to write: {result['chaves']}" if not apply else f"Rollup keys written: {result['chaves']}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reconstrói vendas_rollup a partir das saídas')
+    parser.add_argument('--apply', action='store_true', help='Apply changes to DB')
+    parser.add_argument('--dry-run', action='store_true', help='Only report (default)')
+    parser.add_argument('--desde', default=None, help='Reconstrói apenas a partir deste dia (YYYY-MM-DD)')
+    args = parser.parse_args()
+    asyncio.run(rebuild(args.apply, datetime.fromisoformat(args.desde) if args.desde else None))
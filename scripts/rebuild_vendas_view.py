@@ -0,0 +1,35 @@
+"""Reconstrói a coleção `vendas_view` (vendas com produto e cliente achatados,
+usada pelas listagens de /vendas) a partir de `saidas`, `produtos` e `clientes`.
+
+Uso:
+  python3 scripts/rebuild_vendas_view.py --dry-run
+  python3 scripts/rebuild_vendas_view.py --apply
+
+O script imprime um resumo e, com --apply, regrava a view e remove linhas de
+vendas que não existem mais.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'fastapi'))
+
+from api.database import connection
+from api.database.vendas_view_db import rebuild_vendas_view
+
+async def rebuild(apply: bool):
+    try:
+        result = await rebuild_vendas_view(apply=apply)
+    finally:
+        connection.close()
+
+    print('--- Summary ---')
+    print(f"Vendas to write: {result['vendas']}" if not apply else f"Vendas written: {result['vendas']}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reconstrói vendas_view a partir das saídas')
+    parser.add_argument('--apply', action='store_true', help='Apply changes to DB')
+    parser.add_argument('--dry-run', action='store_true', help='Only report (default)')
+    args = parser.parse_args()
+    asyncio.run(rebuild(args.apply))